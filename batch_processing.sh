@@ -4,7 +4,9 @@
 #
 # Please note that this batch script has a lot of redundancy and should not
 # be used as a pipeline for regular processing. For example, there is no need
-# to process both t1 and t2 to extract CSA values.
+# to process both t1 and t2 to extract CSA values. To process several subjects,
+# use sct_batch_processing, which runs the t2 and t2s steps of this script
+# incrementally and in parallel across subjects.
 #
 # For information about acquisition parameters, see: https://osf.io/wkdym/
 # N.B. The parameters are set for these type of data. With your data, parameters
@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+# -*- coding: utf-8
+# Benchmarks of spinalcordtoolbox.image and spinalcordtoolbox.resampling
+
+from __future__ import absolute_import
+
+from spinalcordtoolbox.image import Image
+from spinalcordtoolbox.resampling import resample_nib
+
+from .common import SIZES, phantom_anat, TempFolderBenchmark
+
+
+class ImageIO(TempFolderBenchmark):
+    params = (SIZES, [".nii", ".nii.gz"])
+    param_names = ["size", "ext"]
+
+    def setup(self, size, ext):
+        super(ImageIO, self).setup()
+        self.img = phantom_anat(size)
+        self.fname = "anat" + ext
+        self.img.save(self.fname)
+
+    def time_load(self, size, ext):
+        Image(self.fname).data
+
+    def peakmem_load(self, size, ext):
+        Image(self.fname).data
+
+    def time_save(self, size, ext):
+        self.img.save("out" + ext)
+
+    def peakmem_save(self, size, ext):
+        self.img.save("out" + ext)
+
+
+class ChangeOrientation(object):
+    params = (SIZES, ["RPI", "AIL", "PSR"])
+    param_names = ["size", "orientation"]
+
+    def setup(self, size, orientation):
+        self.img = phantom_anat(size)
+
+    def time_change_orientation(self, size, orientation):
+        self.img.copy().change_orientation(orientation)
+
+
+class Resample(object):
+    params = (SIZES, ["nn", "linear", "spline"])
+    param_names = ["size", "interpolation"]
+
+    def setup(self, size, interpolation):
+        self.img = phantom_anat(size)
+
+    def time_resample_nib(self, size, interpolation):
+        resample_nib(self.img, new_size=[0.5, 0.5, 1], new_size_type='mm', interpolation=interpolation)
+
+    def peakmem_resample_nib(self, size, interpolation):
+        resample_nib(self.img, new_size=[0.5, 0.5, 1], new_size_type='mm', interpolation=interpolation)
@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+# -*- coding: utf-8
+# Benchmarks of the centerline, morphometry and metric extraction
+
+from __future__ import absolute_import
+
+import numpy as np
+
+from spinalcordtoolbox import process_seg, aggregate_slicewise
+from spinalcordtoolbox.centerline.core import ParamCenterline, get_centerline
+
+from .common import SIZES, phantom_seg, phantom_anat
+
+
+class ComputeShape(object):
+    params = (SIZES, [False, True])
+    param_names = ["size", "angle_correction"]
+
+    def setup(self, size, angle_correction):
+        self.seg = phantom_seg(size)
+
+    def time_compute_shape(self, size, angle_correction):
+        process_seg.compute_shape(self.seg, angle_correction=angle_correction, param_centerline=ParamCenterline(),
+                                  verbose=0)
+
+    def peakmem_compute_shape(self, size, angle_correction):
+        process_seg.compute_shape(self.seg, angle_correction=angle_correction, param_centerline=ParamCenterline(),
+                                  verbose=0)
+
+
+class GetCenterline(object):
+    params = (SIZES, ["polyfit", "bspline", "linear", "nurbs"])
+    param_names = ["size", "algo_fitting"]
+
+    def setup(self, size, algo_fitting):
+        self.seg = phantom_seg(size)
+
+    def time_get_centerline(self, size, algo_fitting):
+        get_centerline(self.seg, ParamCenterline(algo_fitting=algo_fitting, minmax=False), verbose=0)
+
+
+class ExtractMetric(object):
+    params = (SIZES, ["wa", "bin", "max", "ml", "map"])
+    param_names = ["size", "method"]
+
+    def setup(self, size, method):
+        anat = phantom_anat(size)
+        seg = phantom_seg(size).data.astype(np.float32)
+        # 4 labels: quadrants of the cord, with partial volume at their borders
+        nx, ny, nz = seg.shape
+        xx = np.clip((np.arange(nx) - nx / 2.) / 2. + 0.5, 0, 1)[:, None, None]
+        yy = np.clip((np.arange(ny) - ny / 2.) / 2. + 0.5, 0, 1)[None, :, None]
+        labels = [seg * (1 - xx) * (1 - yy), seg * xx * (1 - yy), seg * (1 - xx) * yy, seg * xx * yy]
+        self.data = aggregate_slicewise.Metric(data=anat.data, label='anat')
+        self.labels = np.stack(labels, axis=-1)
+        self.label_struc = dict((i, aggregate_slicewise.LabelStruc(id=i, name='label_{}'.format(i), map_cluster=0))
+                                for i in range(4))
+        self.label_struc[4] = aggregate_slicewise.LabelStruc(id=[0, 1, 2, 3], name='cord')
+
+    def time_extract_metric(self, size, method):
+        aggregate_slicewise.extract_metric(self.data, labels=self.labels, label_struc=self.label_struc, id_label=4,
+                                           indiv_labels_ids=[0, 1, 2, 3], perslice=True, method=method)
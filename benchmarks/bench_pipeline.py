@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+# -*- coding: utf-8
+# Benchmarks of the straightening and of deep learning inference
+
+from __future__ import absolute_import
+
+import os
+
+import nibabel as nib
+
+from spinalcordtoolbox.utils import check_exe, __data_dir__
+
+from .common import SIZES, phantom_seg, phantom_anat, TempFolderBenchmark
+
+
+class Straighten(TempFolderBenchmark):
+    params = (SIZES,)
+    param_names = ["size"]
+    timeout = 1200
+
+    def setup(self, size):
+        if not check_exe("isct_antsApplyTransforms"):
+            raise NotImplementedError("SCT binaries are not installed")
+        super(Straighten, self).setup()
+        phantom_anat(size).save("anat.nii.gz")
+        phantom_seg(size).save("seg.nii.gz")
+
+    def _straighten(self):
+        from spinalcordtoolbox.straightening import SpinalCordStraightener
+        SpinalCordStraightener("anat.nii.gz", "seg.nii.gz", verbose=0).straighten()
+
+    def time_straighten(self, size):
+        self._straighten()
+
+    def peakmem_straighten(self, size):
+        self._straighten()
+
+
+class DeepsegGM(object):
+    params = (SIZES, ["large", "challenge"])
+    param_names = ["size", "model"]
+    timeout = 1200
+
+    def setup(self, size, model):
+        try:
+            from spinalcordtoolbox.deepseg_gm import deepseg_gm
+        except ImportError:
+            raise NotImplementedError("keras is not installed")
+        if not os.path.isdir(os.path.join(__data_dir__, "deepseg_gm_models")):
+            raise NotImplementedError("deepseg_gm models are not installed")
+        self.deepseg_gm = deepseg_gm
+        img = phantom_anat(size)
+        self.nii = nib.Nifti1Image(img.data, img.hdr.get_best_affine())
+        # the first call loads the model, which is kept in memory
+        self.deepseg_gm.segment_volume(self.nii, model)
+
+    def time_segment_volume(self, size, model):
+        self.deepseg_gm.segment_volume(self.nii, model)
+
+    def peakmem_segment_volume(self, size, model):
+        self.deepseg_gm.segment_volume(self.nii, model)
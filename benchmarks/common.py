@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# -*- coding: utf-8
+# Synthetic data shared by the benchmarks
+#
+# The sizes of the phantoms are set by the environment variable SCT_BENCHMARK_SIZES, a comma-separated list of
+# NXxNYxNZ (default: 64x64x64,160x160x200).
+
+from __future__ import absolute_import
+
+import sys
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from spinalcordtoolbox.utils import __sct_dir__
+sys.path.append(os.path.join(__sct_dir__, 'scripts'))
+sys.path.append(os.path.join(__sct_dir__, 'unit_testing'))
+
+from create_test_data import dummy_segmentation
+
+SIZES = os.environ.get("SCT_BENCHMARK_SIZES", "64x64x64,160x160x200").split(",")
+
+# Phantoms already created in this process, indexed by parameters
+_phantoms = {}
+
+
+def parse_size(size):
+    """
+    :param size: "NXxNYxNZ"
+    :return: tuple (nx, ny, nz)
+    """
+    return tuple(int(n) for n in size.split("x"))
+
+
+def phantom_seg(size, angle=10):
+    """
+    :param size: "NXxNYxNZ"
+    :param angle: angle of the cord around the RL axis (deg)
+    :return: Image of a binary elliptic cord, in RPI orientation
+    """
+    key = ("seg", size, angle)
+    if key not in _phantoms:
+        nx, ny, nz = parse_size(size)
+        img = dummy_segmentation(size_arr=(nx, ny, nz), shape='ellipse', angle_RL=angle, radius_RL=nx / 12.,
+                                 radius_AP=ny / 18., orientation='RPI')
+        img.data = (img.data > 0.5).astype(np.uint8)
+        _phantoms[key] = img
+    return _phantoms[key].copy()
+
+
+def phantom_anat(size, angle=10):
+    """
+    :return: Image of a T2-like anatomical image (bright cord on a noisy background) matching phantom_seg()
+    """
+    key = ("anat", size, angle)
+    if key not in _phantoms:
+        img = phantom_seg(size, angle)
+        rng = np.random.RandomState(0)
+        img.data = (img.data * 800. + 200. + rng.normal(0, 20, img.data.shape)).astype(np.float32)
+        _phantoms[key] = img
+    return _phantoms[key].copy()
+
+
+class TempFolderBenchmark(object):
+    """
+    Base class of benchmarks working in a temporary folder (the working directory during the benchmark)
+    """
+    def setup(self, *params):
+        self.cwd = os.getcwd()
+        self.path_tmp = tempfile.mkdtemp(prefix="sct_benchmark_")
+        os.chdir(self.path_tmp)
+
+    def teardown(self, *params):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.path_tmp, ignore_errors=True)
@@ -268,11 +268,7 @@ def register(param, file_src, file_dest, file_mat, file_out, im_mask=None):
         # run command
         if do_registration:
             kw.update(dict(is_sct_binary=True))
-            env = dict()
-            env.update(os.environ)
-            env = kw.get("env", env)
-            # reducing the number of CPU used for moco (see issue #201)
-            env["ITK_GLOBAL_DEFAULT_NUMBER_OF_THREADS"] = "1"
+            # ITK threads are set by the CPU budget (see spinalcordtoolbox.cpu)
             status, output = sct.run(cmd, verbose=0, **kw)
 
     elif param.todo == 'apply':
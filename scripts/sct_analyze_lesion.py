@@ -18,6 +18,7 @@ import pandas as pd
 from skimage.measure import label
 
 from spinalcordtoolbox.image import Image
+from spinalcordtoolbox.packed_labels import open_packed_labels
 from spinalcordtoolbox.centerline.core import ParamCenterline, get_centerline
 from spinalcordtoolbox.utils import Metavar, SmartFormatter, ActionCreateFolder
 
@@ -151,6 +152,7 @@ class AnalyzeLeion:
             self.path_atlas, self.path_levels = None, None
         self.vert_lst = None
         self.atlas_roi_lst = None
+        self.atlas_packed = None
         self.distrib_matrix_dct = {}
 
         # output names
@@ -383,6 +385,12 @@ class AnalyzeLeion:
 
             # In order to open atlas images only one time
             atlas_data_dct = {}  # dict containing the np.array of the registrated atlas
+            if self.atlas_packed is not None:
+                # packed atlas: already in RPI orientation
+                for i, (_, _, fname_atlas_roi) in enumerate(self.atlas_packed.labels):
+                    tract_id = int(fname_atlas_roi.split('_')[-1].split('.nii.gz')[0])
+                    if tract_id < 36:  # Not interested in CSF
+                        atlas_data_dct[tract_id] = self.atlas_packed.label_data(i)
             for fname_atlas_roi in self.atlas_roi_lst:
                 tract_id = int(fname_atlas_roi.split('_')[-1].split('.nii.gz')[0])
                 img_cur = Image(fname_atlas_roi)
@@ -500,7 +508,9 @@ class AnalyzeLeion:
             self.path_levels = ''.join(extract_fname(self.path_levels)[1:])
 
             self.atlas_roi_lst = []
-            for fname_atlas_roi in os.listdir(self.path_atlas):
+            # If the atlas was packed (see sct_warp_template), it is read from the packed file
+            self.atlas_packed = open_packed_labels(self.path_atlas)
+            for fname_atlas_roi in os.listdir(self.path_atlas) if self.atlas_packed is None else []:
                 if fname_atlas_roi.endswith('.nii.gz'):
                     tract_id = int(fname_atlas_roi.split('_')[-1].split('.nii.gz')[0])
                     if tract_id < 36:  # Not interested in CSF
@@ -350,7 +350,5 @@ def main(args=None):
 # ==========================================================================================
 if __name__ == "__main__":
     sct.init_sct()
-    # initialize parameters
-    param = Param()
     # call main function
     main()
@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+#########################################################################################
+#
+# Run an incremental pipeline on all the subjects of a dataset
+#
+# ---------------------------------------------------------------------------------------
+# Copyright (c) 2019 Polytechnique Montreal <www.neuro.polymtl.ca>
+#
+# About the license: see the file LICENSE.TXT
+#########################################################################################
+
+from __future__ import absolute_import
+
+import sys
+import os
+import runpy
+import argparse
+
+from spinalcordtoolbox.utils import Metavar, SmartFormatter
+from spinalcordtoolbox import pipeline
+
+import sct_utils as sct
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description='Run a pipeline on all the subjects of a dataset. The steps of the pipeline declare the files '
+                    'they read and write; they are scheduled as a graph, in parallel across subjects. Like make, '
+                    'steps whose inputs and command did not change since they last ran are skipped, so an '
+                    'interrupted run resumes where it stopped, and after changing a step only this step and the '
+                    'steps that depend on its outputs are run again. The state and the logs of the steps are '
+                    'stored in the folder "{}" of each subject.'.format(pipeline.FOLDER_STATE),
+        add_help=None,
+        formatter_class=SmartFormatter,
+        prog=os.path.basename(__file__).strip(".py"))
+
+    mandatory = parser.add_argument_group("MANDATORY ARGUMENTS")
+    mandatory.add_argument(
+        "-path-data",
+        metavar=Metavar.folder,
+        required=True,
+        help="Folder of the dataset, containing one folder per subject (eg: the parent folder of "
+             "sct_example_data).")
+
+    optional = parser.add_argument_group("OPTIONAL ARGUMENTS")
+    optional.add_argument(
+        "-h",
+        "--help",
+        action="help",
+        help="Show this help message and exit")
+    optional.add_argument(
+        "-pipeline",
+        metavar=Metavar.file,
+        default=None,
+        help="R|Python file defining the pipeline in a variable named 'pipeline'. Example:\n"
+             "from spinalcordtoolbox.pipeline import Pipeline, Step\n"
+             "pipeline = Pipeline([\n"
+             "  Step('segment', 'sct_deepseg_sc -i t2.nii.gz -c t2', inputs=['t2.nii.gz'],\n"
+             "       outputs=['t2_seg.nii.gz'], folder='t2'),\n"
+             "  Step('csa', 'sct_process_segmentation -i t2_seg.nii.gz -o csa.csv', inputs=['t2_seg.nii.gz'],\n"
+             "       outputs=['csa.csv'], folder='t2'),\n"
+             "])\n"
+             "Default: processing of the t2 and t2s data of sct_example_data (segmentation, vertebral labeling, "
+             "registration to the template, cross-sectional areas).")
+    optional.add_argument(
+        "-subj",
+        nargs="+",
+        metavar=Metavar.str,
+        default=None,
+        help="Subjects to process (names of their folders). Default: all the folders of the dataset.")
+    optional.add_argument(
+        "-j",
+        type=int,
+        metavar=Metavar.int,
+        default=0,
+        help="Number of steps run in parallel. 0: as many as the CPU budget allows (see SCT_NCPU).")
+    optional.add_argument(
+        "-force",
+        nargs="+",
+        metavar=Metavar.str,
+        default=[],
+        help="Steps to run even if they are up to date.")
+    optional.add_argument(
+        "-n",
+        action="store_true",
+        help="Dry run: show the steps that would run, without running them.")
+    optional.add_argument(
+        "-v",
+        type=int,
+        help="Verbose: 0 = no verbosity, 1 = verbose, 2 = debug.",
+        choices=(0, 1, 2),
+        default=1)
+
+    return parser
+
+
+def main(args=None):
+    if args is None:
+        args = sys.argv[1:]
+    parser = get_parser()
+    arguments = parser.parse_args(args=args)
+    sct.init_sct(log_level=arguments.v, update=True)  # Update log level
+
+    if arguments.pipeline is None:
+        pipe = pipeline.example_pipeline()
+    else:
+        pipe = runpy.run_path(arguments.pipeline)["pipeline"]
+    unknown = set(arguments.force) - set(step.name for step in pipe.steps)
+    if unknown:
+        parser.error("Unknown steps: {}".format(", ".join(sorted(unknown))))
+
+    results = pipe.run(arguments.path_data, subjects=arguments.subj, jobs=arguments.j, force=arguments.force,
+                       dry_run=arguments.n)
+
+    counts = {}
+    for res in results:
+        counts[res.status] = counts.get(res.status, 0) + 1
+    sct.printv("\n" + ", ".join("{} {}".format(n, status) for status, n in sorted(counts.items())))
+    failed = [res for res in results if res.status == pipeline.STATUS_FAILED]
+    for res in failed:
+        sct.printv("{} {}: {}".format(res.subject, res.step, res.message), type="warning")
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    sct.init_sct()
+    main()
@@ -245,8 +245,8 @@ def main():
 
     # Check number of CPU cores
     from multiprocessing import cpu_count
-    output = int(os.getenv('ITK_GLOBAL_DEFAULT_NUMBER_OF_THREADS', 0))
-    print('CPU cores: Available: {}, Used by SCT: {}'.format(cpu_count(), output))
+    from spinalcordtoolbox.cpu import get_ncpu
+    print('CPU cores: Available: {}, Used by SCT: {}'.format(cpu_count(), get_ncpu()))
 
     # check RAM
     sct.checkRAM(os_running, 0)
@@ -27,6 +27,10 @@ class Param:
         self.fname_warp_final = 'warp_final.nii.gz'
 
 
+# initialize parameters
+param = Param()
+
+
 def main(args=None):
     """
     Main function
@@ -185,6 +189,5 @@ def get_parser():
 #=======================================================================================================================
 if __name__ == "__main__":
     sct.init_sct()
-    param = Param()
     # call main function
     main()
@@ -94,9 +94,11 @@ def get_parser():
     return parser
 
 
-def run_main():
+def main(args=None):
+    if args is None:
+        args = None if sys.argv[1:] else ['--help']
     parser = get_parser()
-    arguments = parser.parse_args(args=None if sys.argv[1:] else ['--help'])
+    arguments = parser.parse_args(args=args)
     input_filename = arguments.i
     if arguments.o is not None:
         output_filename = arguments.o
@@ -138,4 +140,4 @@ def run_main():
 
 if __name__ == '__main__':
     sct.init_sct()
-    run_main()
+    main()
@@ -111,10 +111,12 @@ def get_parser():
     return parser
 
 
-def main():
+def main(args=None):
     """Main function."""
+    if args is None:
+        args = None if sys.argv[1:] else ['--help']
     parser = get_parser()
-    args = parser.parse_args(args=None if sys.argv[1:] else ['--help'])
+    args = parser.parse_args(args=args)
 
     fname_image = args.i
     contrast_type = args.c
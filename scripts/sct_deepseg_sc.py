@@ -115,10 +115,12 @@ def get_parser():
     return parser
 
 
-def main():
+def main(args=None):
     """Main function."""
+    if args is None:
+        args = None if sys.argv[1:] else ['--help']
     parser = get_parser()
-    args = parser.parse_args(args=None if sys.argv[1:] else ['--help'])
+    args = parser.parse_args(args=args)
 
     fname_image = os.path.abspath(args.i)
     contrast_type = args.c
@@ -168,21 +170,36 @@ def main():
     from spinalcordtoolbox.image import Image
     from spinalcordtoolbox.deepseg_sc.core import deep_segmentation_spinalcord
     from spinalcordtoolbox.reports.qc import generate_qc
+    from spinalcordtoolbox.cache import get_step_cache
 
-    im_image = Image(fname_image)
-    # note: below we pass im_image.copy() otherwise the field absolutepath becomes None after execution of this function
-    im_seg, im_image_RPI_upsamp, im_seg_RPI_upsamp = \
-        deep_segmentation_spinalcord(im_image.copy(), contrast_type, ctr_algo=ctr_algo,
-                                     ctr_file=manual_centerline_fname, brain_bool=brain_bool, kernel_size=kernel_size,
-                                     remove_temp_files=remove_temp_files, verbose=verbose)
-
-    # Save segmentation
     fname_seg = os.path.abspath(os.path.join(output_folder, sct.extract_fname(fname_image)[1] + '_seg' +
                                              sct.extract_fname(fname_image)[2]))
 
-    # copy q/sform from input image to output segmentation
-    im_seg.copy_qform_from_ref(im_image)
-    im_seg.save(fname_seg)
+    # reuse the segmentation if the same image was already segmented with the same parameters. Not for a centerline
+    # clicked in the viewer (the viewer must open at each run), nor when the temporary files are kept (-r 0), which
+    # a cached run would not produce.
+    cache = get_step_cache()
+    if ctr_algo == 'viewer' or not remove_temp_files:
+        cache.enabled = False
+    with cache.step(
+     "deepseg_sc",
+     input_files=[fname_image] + ([manual_centerline_fname] if manual_centerline_fname else []),
+     params={"contrast": contrast_type, "centerline": ctr_algo, "brain": brain_bool, "kernel": kernel_size},
+     outputs=[fname_seg],
+    ) as step:
+        if not step.cached:
+            im_image = Image(fname_image)
+            # note: below we pass im_image.copy() otherwise the field absolutepath becomes None after execution of
+            # this function
+            im_seg, im_image_RPI_upsamp, im_seg_RPI_upsamp = \
+                deep_segmentation_spinalcord(im_image.copy(), contrast_type, ctr_algo=ctr_algo,
+                                             ctr_file=manual_centerline_fname, brain_bool=brain_bool,
+                                             kernel_size=kernel_size, remove_temp_files=remove_temp_files,
+                                             verbose=verbose)
+
+            # copy q/sform from input image to output segmentation
+            im_seg.copy_qform_from_ref(im_image)
+            im_seg.save(fname_seg)
 
     if path_qc is not None:
         generate_qc(fname_image, fname_seg=fname_seg, args=sys.argv[1:], path_qc=os.path.abspath(path_qc),
@@ -23,6 +23,10 @@ class Param:
         self.verbose = 1
 
 
+# initialize parameters
+param = Param()
+
+
 # PARSER
 # ==========================================================================================
 def get_parser():
@@ -202,7 +206,5 @@ def compute_dti(fname_in, fname_bvals, fname_bvecs, prefix, method, evecs, file_
 # ==========================================================================================
 if __name__ == "__main__":
     sct.init_sct()
-    # initialize parameters
-    param = Param()
     # call main function
     main()
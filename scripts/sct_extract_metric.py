@@ -25,10 +25,14 @@ import sys, os
 import numpy as np
 
 from spinalcordtoolbox.metadata import read_label_file
+from spinalcordtoolbox.packed_labels import open_packed_labels
 from spinalcordtoolbox.utils import parse_num_list
-from spinalcordtoolbox.aggregate_slicewise import check_labels, extract_metric, save_as_csv, Metric, LabelStruc
+from spinalcordtoolbox.aggregate_slicewise import check_labels, extract_metric, extract_metric_multilabel, \
+    save_as_csv, Metric, LabelStruc
+from spinalcordtoolbox.metrics_db import is_metrics_db, save_as_sqlite
 import sct_utils as sct
 from spinalcordtoolbox.image import Image
+from spinalcordtoolbox.template import VertLevelIndex
 from msct_parser import Parser
 
 # get path of the script and the toolbox
@@ -94,6 +98,10 @@ max: for each z-slice of the input data, extract the max value for each slice of
                       description='Append results as a new line in the output csv file instead of overwriting it.',
                       mandatory=False,
                       default_value=0)
+    parser.add_option(name='-subject',
+                      type_value='str',
+                      description='Subject to list with the results, if they are saved in a SQLite database (see -o).',
+                      mandatory=False)
     parser.add_option(name='-combine',
                       type_value='int',
                       description='Combine multiple labels into a single estimation.',
@@ -101,7 +109,7 @@ max: for each z-slice of the input data, extract the max value for each slice of
                       default_value=0)
     parser.add_option(name='-o',
                       type_value='file_output',
-                      description="""File name (including the file extension) of the output result file collecting the metric estimation results. \nThree file types are available: a CSV text file (extension .txt), a MS Excel file (extension .xls) and a pickle file (extension .pickle). Default: """ + param_default.fname_output,
+                      description="""File name (including the file extension) of the output result file collecting the metric estimation results. \nThree file types are available: a CSV text file (extension .txt), a MS Excel file (extension .xls) and a pickle file (extension .pickle). With extension .sqlite or .db, results are added to a SQLite database of metrics, which can be shared by several runs in parallel. Default: """ + param_default.fname_output,
                       mandatory=False,
                       default_value=param_default.fname_output)
     parser.add_option(name='-output-map',
@@ -223,7 +231,7 @@ To compute average MTR in a region defined by a single label file (could be bina
 
 
 def main(fname_data, path_label, method, slices, levels, fname_output, labels_user, append_csv,
-         fname_vertebral_labeling="", perslice=1, perlevel=1, verbose=1, combine_labels=True):
+         fname_vertebral_labeling="", perslice=1, perlevel=1, verbose=1, combine_labels=True, subject=None):
     """
     Extract metrics from MRI data based on mask (could be single file of folder to atlas)
     :param fname_data: data to extract metric from
@@ -245,6 +253,7 @@ def main(fname_data, path_label, method, slices, levels, fname_output, labels_us
            instead of a single average output.
     :param verbose
     :param combine_labels: bool: Combine labels into a single value
+    :param subject: subject to list with the results, if fname_output is a database of metrics
     :return:
     """
 
@@ -307,21 +316,36 @@ def main(fname_data, path_label, method, slices, levels, fname_output, labels_us
     input_im = Image(fname_data).change_orientation("RPI")
 
     data = Metric(data=input_im.data, label='')
-    # Load labels
-    labels_tmp = np.empty([nb_labels], dtype=object)
-    for i_label in range(nb_labels):
-        im_label = Image(os.path.join(path_label, indiv_labels_files[i_label])).change_orientation("RPI")
-        labels_tmp[i_label] = np.expand_dims(im_label.data, 3)  # TODO: generalize to 2D input label
-    labels = np.concatenate(labels_tmp[:], 3)  # labels: (x,y,z,label)
+    # Load labels. If the label folder was packed (see sct_warp_template), the labels are memory-mapped from the packed
+    # file instead of loading each label file
+    packed_labels = open_packed_labels(path_label) if path_label else None
+    if packed_labels is not None and packed_labels.shape != data.data.shape:
+        packed_labels = None
+    # Methods that don't depend on the other labels extract all labels at once, from a sparse matrix of the labels
+    multilabel = method in ['wa', 'bin', 'max'] and (len(labels_id_user) > 1 or packed_labels is not None)
+    if packed_labels is not None and multilabel:
+        labels = packed_labels.matrix()  # labels: (voxel, label)
+    elif packed_labels is not None:
+        labels = packed_labels.dense()  # labels: (x,y,z,label)
+    else:
+        labels_tmp = np.empty([nb_labels], dtype=object)
+        for i_label in range(nb_labels):
+            im_label = Image(os.path.join(path_label, indiv_labels_files[i_label])).change_orientation("RPI")
+            labels_tmp[i_label] = np.expand_dims(im_label.data, 3)  # TODO: generalize to 2D input label
+        labels = np.concatenate(labels_tmp[:], 3)  # labels: (x,y,z,label)
     # Load vertebral levels
     if vertebral_levels:
-        im_vertebral_labeling = Image(fname_vertebral_labeling).change_orientation("RPI")
+        # Compute the vertebral level of each slice once for all the labels
+        vert_level_index = VertLevelIndex(Image(fname_vertebral_labeling).change_orientation("RPI"))
     else:
-        im_vertebral_labeling = None
+        vert_level_index = None
 
     # Get dimensions of data and labels
     nx, ny, nz = data.data.shape
-    nx_atlas, ny_atlas, nz_atlas, nt_atlas = labels.shape
+    if packed_labels is not None:
+        nx_atlas, ny_atlas, nz_atlas = packed_labels.shape
+    else:
+        nx_atlas, ny_atlas, nz_atlas, nt_atlas = labels.shape
 
     # Check dimensions consistency between atlas and data
     if (nx, ny, nz) != (nx_atlas, ny_atlas, nz_atlas):
@@ -334,15 +358,31 @@ def main(fname_data, path_label, method, slices, levels, fname_output, labels_us
                                      map_cluster=None)
         labels_id_user = [99]
 
-    for id_label in labels_id_user:
-        sct.printv('Estimation for label: '+label_struc[id_label].name, verbose)
-        agg_metric = extract_metric(data, labels=labels, slices=slices, levels=levels, perslice=perslice,
-                                    perlevel=perlevel, vert_level=im_vertebral_labeling, method=method,
-                                    label_struc=label_struc, id_label=id_label, indiv_labels_ids=indiv_labels_ids)
-
-        save_as_csv(agg_metric, fname_output, fname_in=fname_data, append=append_csv)
+    if multilabel:
+        sct.printv('Estimation for labels: ' + ', '.join([label_struc[i].name for i in labels_id_user]), verbose)
+        list_agg_metric = extract_metric_multilabel(data, labels=labels, slices=slices, levels=levels,
+                                                    perslice=perslice, perlevel=perlevel,
+                                                    vert_level=vert_level_index, method=method,
+                                                    label_struc=label_struc, ids_label=labels_id_user)
+    else:
+        list_agg_metric = []
+        for id_label in labels_id_user:
+            sct.printv('Estimation for label: '+label_struc[id_label].name, verbose)
+            list_agg_metric.append(
+                extract_metric(data, labels=labels, slices=slices, levels=levels, perslice=perslice,
+                               perlevel=perlevel, vert_level=vert_level_index, method=method,
+                               label_struc=label_struc, id_label=id_label, indiv_labels_ids=indiv_labels_ids))
+
+    for agg_metric in list_agg_metric:
+        if is_metrics_db(fname_output):
+            save_as_sqlite(agg_metric, fname_output, fname_in=fname_data, subject=subject, append=append_csv)
+        else:
+            save_as_csv(agg_metric, fname_output, fname_in=fname_data, append=append_csv)
         append_csv = True  # when looping across labels, need to append results in the same file
-    sct.display_open(fname_output)
+    if is_metrics_db(fname_output):
+        sct.printv('\nDone! Results were added to the database: ' + fname_output + '\n', verbose=1, type='info')
+    else:
+        sct.display_open(fname_output)
 
 
 if __name__ == "__main__":
@@ -363,6 +403,10 @@ if __name__ == "__main__":
         append_csv = int(arguments['-append'])
     else:
         append_csv = 0
+    if '-subject' in arguments:
+        subject = arguments['-subject']
+    else:
+        subject = None
     if '-combine' in arguments:
         combine_labels = arguments['-combine']
     else:
@@ -422,4 +466,4 @@ if __name__ == "__main__":
     main(fname_data=fname_data, path_label=path_label, method=method, slices=parse_num_list(slices_of_interest),
          levels=parse_num_list(vertebral_levels), fname_output=fname_output, labels_user=labels_user,
          append_csv=append_csv, fname_vertebral_labeling=fname_vertebral_labeling, perslice=perslice,
-         perlevel=perlevel, verbose=verbose, combine_labels=combine_labels)
+         perlevel=perlevel, verbose=verbose, combine_labels=combine_labels, subject=subject)
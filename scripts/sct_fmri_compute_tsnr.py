@@ -110,5 +110,4 @@ def main(args=None):
 # ==========================================================================================
 if __name__ == "__main__":
     sct.init_sct()
-    param = Param()
     main()
@@ -281,20 +281,11 @@ class ProcessLabels(object):
         # 0. Initialization of output image
         output_image = msct_image.zeros_like(self.image_input)
 
-        # 1. Extraction of coordinates from all non-null voxels in the image. Coordinates are sorted by value.
-        coordinates = self.image_input.getNonZeroCoordinates(sorting='value')
-
-        # 2. Separate all coordinates into groups by value
-        groups = dict()
-        for coord in coordinates:
-            if coord.value in groups:
-                groups[coord.value].append(coord)
-            else:
-                groups[coord.value] = [coord]
+        # 1. Compute the center of mass of each group of non-null voxels with the same value (sorted by value)
+        centers_of_mass = self.image_input.getCoordinatesAveragedByValue()
 
-        # 3. Compute the center of mass of each group of voxels and write them into the output image
-        for value, list_coord in groups.items():
-            center_of_mass = sum(list_coord) / float(len(list_coord))
+        # 2. Write them into the output image
+        for center_of_mass in centers_of_mass:
             sct.printv("Value = " + str(center_of_mass.value) + " : (" + str(center_of_mass.x) + ", " + str(center_of_mass.y) + ", " + str(center_of_mass.z) + ") --> ( " + str(np.round(center_of_mass.x)) + ", " + str(np.round(center_of_mass.y)) + ", " + str(np.round(center_of_mass.z)) + ")", verbose=self.verbose)
             output_image.data[int(np.round(center_of_mass.x)), int(np.round(center_of_mass.y)), int(np.round(center_of_mass.z))] = center_of_mass.value
 
@@ -25,6 +25,7 @@ from spinalcordtoolbox.vertebrae.core import create_label_z, get_z_and_disc_valu
     clean_labeled_segmentation, label_discs, label_vert
 from spinalcordtoolbox.vertebrae.detect_c2c3 import detect_c2c3
 from spinalcordtoolbox.reports.qc import generate_qc
+from spinalcordtoolbox.cache import get_step_cache
 import sct_straighten_spinalcord
 
 
@@ -239,27 +240,19 @@ def main(args=None):
 
     # Straighten spinal cord
     sct.printv('\nStraighten spinal cord...', verbose)
-    # check if warp_curve2straight and warp_straight2curve already exist (i.e. no need to do it another time)
-    cache_sig = sct.cache_signature(
-     input_files=[fname_in, fname_seg],
-    )
-    cachefile = os.path.join(curdir, "straightening.cache")
-    if sct.cache_valid(cachefile, cache_sig) and os.path.isfile(os.path.join(curdir, "warp_curve2straight.nii.gz")) and os.path.isfile(os.path.join(curdir, "warp_straight2curve.nii.gz")) and os.path.isfile(os.path.join(curdir, "straight_ref.nii.gz")):
-        # if they exist, copy them into current folder
-        sct.printv('Reusing existing warping field which seems to be valid', verbose, 'warning')
-        sct.copy(os.path.join(curdir, "warp_curve2straight.nii.gz"), 'warp_curve2straight.nii.gz')
-        sct.copy(os.path.join(curdir, "warp_straight2curve.nii.gz"), 'warp_straight2curve.nii.gz')
-        sct.copy(os.path.join(curdir, "straight_ref.nii.gz"), 'straight_ref.nii.gz')
-        # apply straightening
-        s, o = sct.run(['sct_apply_transfo', '-i', 'data.nii', '-w', 'warp_curve2straight.nii.gz', '-d', 'straight_ref.nii.gz', '-o', 'data_straight.nii'])
-    else:
-        sct_straighten_spinalcord.main(args=[
-            '-i', 'data.nii',
-            '-s', 'segmentation.nii',
-            '-r', str(remove_temp_files),
-            '-v', str(verbose),
-        ])
-        sct.cache_save(cachefile, cache_sig)
+    # reuse the warping fields if the straightening was already done with the same inputs
+    with get_step_cache().step(
+     "straightening",
+     input_files=['data.nii', 'segmentation.nii'],
+     outputs=['warp_curve2straight.nii.gz', 'warp_straight2curve.nii.gz', 'straight_ref.nii.gz', 'data_straight.nii'],
+    ) as step:
+        if not step.cached:
+            sct_straighten_spinalcord.main(args=[
+                '-i', 'data.nii',
+                '-s', 'segmentation.nii',
+                '-r', str(remove_temp_files),
+                '-v', str(verbose),
+            ])
 
     # resample to 0.5mm isotropic to match template resolution
     sct.printv('\nResample to 0.5mm isotropic...', verbose)
@@ -368,8 +361,17 @@ def main(args=None):
             sct.run(['sct_maths', '-i', 'data_straightr.nii', '-laplacian', '1', '-o', 'data_straightr.nii'], verbose)
 
         # detect vertebral levels on straight spinal cord
-        vertebral_detection('data_straightr.nii', 'segmentation_straight.nii', contrast, param, init_disc=init_disc,
-                            verbose=verbose, path_template=path_template, path_output=path_output, scale_dist=scale_dist)
+        with get_step_cache().step(
+         "vertebral_detection",
+         input_files=['data_straightr.nii', 'segmentation_straight.nii'],
+         params={"contrast": contrast, "init_disc": init_disc, "path_template": path_template,
+                 "scale_dist": scale_dist, "param": dict((k, v) for k, v in vars(param).items() if k != 'path_qc')},
+         outputs=['segmentation_straight_labeled.nii'],
+        ) as step:
+            if not step.cached:
+                vertebral_detection('data_straightr.nii', 'segmentation_straight.nii', contrast, param,
+                                    init_disc=init_disc, verbose=verbose, path_template=path_template,
+                                    path_output=path_output, scale_dist=scale_dist)
 
     # un-straighten labeled spinal cord
     sct.printv('\nUn-straighten labeling...', verbose)
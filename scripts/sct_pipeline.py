@@ -45,12 +45,15 @@ usage:
 
 from __future__ import print_function, absolute_import
 
-import sys, io, os, types, copy, copy_reg, time, itertools, glob, importlib, pickle
+import sys, io, os, types, copy, time, itertools, glob, importlib, pickle, json, hashlib, logging
 import platform
 import signal
+try:
+    import copy_reg
+except ImportError:  # python 3 pickles methods natively
+    copy_reg = None
 
 path_script = os.path.dirname(__file__)
-sys.path.append(os.path.join(sct.__sct_dir__, 'testing'))
 
 import concurrent.futures
 if "SCT_MPI_MODE" in os.environ:
@@ -68,9 +71,15 @@ import h5py
 import pandas as pd
 
 import sct_utils as sct
+sys.path.append(os.path.join(sct.__sct_dir__, 'testing'))
 import msct_parser
+from spinalcordtoolbox import cpu
+from spinalcordtoolbox.jobqueue import JobQueue
+from spinalcordtoolbox.result_sink import ResultSink
 import sct_testing
 
+logger = logging.getLogger(__name__)
+
 def _pickle_method(method):
     """
     Author: Steven Bethard (author of argparse)
@@ -101,7 +110,8 @@ def _unpickle_method(func_name, obj, cls):
             break
     return func.__get__(obj, cls)
 
-copy_reg.pickle(types.MethodType, _pickle_method, _unpickle_method)
+if copy_reg is not None:
+    copy_reg.pickle(types.MethodType, _pickle_method, _unpickle_method)
 
 
 def generate_data_list(folder_dataset, verbose=1):
@@ -310,9 +320,12 @@ def get_list_subj(folder_dataset, data_specifications=None, fname_database=''):
     return list_subj
 
 
-def run_function(function, folder_dataset, list_subj, list_args=[], nb_cpu=None, verbose=1, test_integrity=0):
+def run_function(function, folder_dataset, list_subj, list_args=[], nb_cpu=None, verbose=1, test_integrity=0,
+                 path_results=None):
     """
     Run a test function on the dataset using multiprocessing and save the results
+    :param path_results: folder where the results are also written as they come (see
+                         spinalcordtoolbox.result_sink), default: not written
     :return: results
     # results are organized as the following: tuple of (status, output, DataFrame with results)
     """
@@ -320,8 +333,7 @@ def run_function(function, folder_dataset, list_subj, list_args=[], nb_cpu=None,
     # add full path to each subject
     list_subj_path = [os.path.join(folder_dataset, subject) for subject in list_subj]
 
-    # All scripts that are using multithreading with ITK must not use it when using multiprocessing
-    os.environ["ITK_GLOBAL_DEFAULT_NUMBER_OF_THREADS"] = "1"
+    nb_cpu = cpu.pool_size(nb_cpu)
 
     # create list that finds all the combinations for function + subject path + arguments. Example of one list element:
     # ('sct_propseg', os.path.join(path_sct, 'data', 'sct_test_function', '200_005_s2''), '-i ' + os.path.join("t2", "t2.nii.gz") + ' -c t2', 1)
@@ -329,49 +341,106 @@ def run_function(function, folder_dataset, list_subj, list_args=[], nb_cpu=None,
         # data_and_params = itertools.izip(itertools.repeat(function), data_subjects, itertools.repeat(parameters))
 
     logger.debug("stating pool with {} thread(s)".format(nb_cpu))
-    pool = PoolExecutor(nb_cpu)
-    compute_time = None
-    try:
-        compute_time = time.time()
-        count = 0
-        all_results = []
-
-        # logger.info('Waiting for results, be patient')
-        future_dirs = {pool.submit(function_launcher, subject_arg): subject_arg
-                         for subject_arg in list_func_subj_args}
-
-        for future in concurrent.futures.as_completed(future_dirs):
-            count += 1
-            subject = os.path.basename(future_dirs[future][1])
-            arguments = future_dirs[future][2]
-            try:
-                result = future.result()
-                sct.no_new_line_log('Processing subjects... {}/{}'.format(count, len(list_func_subj_args)))
-                all_results.append(result)
-            except Exception as exc:
-                logger.error('{} {} generated an exception: {}'.format(subject, arguments, exc))
-
-        compute_time = time.time() - compute_time
-
-        # concatenate all_results into single Panda structure
-        results_dataframe = pd.concat(all_results)
-
-    except KeyboardInterrupt:
-        logger.warning("\nCaught KeyboardInterrupt, terminating workers")
-        for job in future_dirs:
-            job.cancel()
-    except Exception as e:
-        logger.error('Error on line {}'.format(sys.exc_info()[-1].tb_lineno))
-        logger.exception(e)
-        for job in future_dirs:
-            job.cancel()
-        raise
-    finally:
-        pool.shutdown()
+    # The CPU budget is split between the workers (ITK, OpenMP, TensorFlow threads of each subject)
+    with cpu.split(nb_cpu):
+        # the sink only persists the results (types of the columns are not kept), they are returned from memory
+        sink = ResultSink(path_results) if path_results else None
+        pool = PoolExecutor(nb_cpu)
+        compute_time = None
+        results_dataframe = None
+        future_dirs = {}
+        try:
+            compute_time = time.time()
+            count = 0
+            all_results = []
+
+            # logger.info('Waiting for results, be patient')
+            future_dirs = {pool.submit(function_launcher, subject_arg): subject_arg
+                             for subject_arg in list_func_subj_args}
+
+            for future in concurrent.futures.as_completed(future_dirs):
+                count += 1
+                subject = os.path.basename(future_dirs[future][1])
+                arguments = future_dirs[future][2]
+                try:
+                    result = future.result()
+                    sct.no_new_line_log('Processing subjects... {}/{}'.format(count, len(list_func_subj_args)))
+                    all_results.append(result)
+                    if sink is not None:
+                        sink.append(result)
+                except Exception as exc:
+                    logger.error('{} {} generated an exception: {}'.format(subject, arguments, exc))
+
+            compute_time = time.time() - compute_time
+
+            # concatenate all_results into single Panda structure
+            results_dataframe = pd.concat(all_results) if all_results else pd.DataFrame()
+
+        except KeyboardInterrupt:
+            logger.warning("\nCaught KeyboardInterrupt, terminating workers")
+            for job in future_dirs:
+                job.cancel()
+        except Exception as e:
+            logger.error('Error on line {}'.format(sys.exc_info()[-1].tb_lineno))
+            logger.exception(e)
+            for job in future_dirs:
+                job.cancel()
+            raise
+        finally:
+            pool.shutdown()
+            if sink is not None:
+                sink.close()
 
     return {'results': results_dataframe, "compute_time": compute_time}
 
 
+def run_function_queue(function, folder_dataset, list_subj, path_queue, list_args=[], nb_cpu=None,
+                       test_integrity=0, path_results=None):
+    """
+    Run a test function on the dataset through a job queue in a shared folder: several instances of this function,
+    possibly on different nodes, share the jobs (one per subject and arguments). Jobs already done in the queue are
+    not run again, so an interrupted run can be resumed.
+    :param path_results: folder where the results of the jobs are written (see spinalcordtoolbox.result_sink)
+    :return: results of all the jobs of the queue, see run_function()
+    """
+    queue = JobQueue(path_queue)
+    jobs = {}
+    for subject, args in itertools.product(list_subj, list_args):
+        key = hashlib.sha1(json.dumps([function, subject, args, test_integrity]).encode("utf-8")).hexdigest()[:12]
+        jobs["{}-{}".format(subject, key)] = [function, os.path.join(folder_dataset, subject), args, test_integrity]
+    logger.info("Queue {}: {} new job(s), {}".format(path_queue, queue.submit(jobs), queue.status()))
+
+    nb_cpu = cpu.pool_size(nb_cpu)
+    compute_time = time.time()
+    with cpu.split(nb_cpu):
+        pool = PoolExecutor(nb_cpu)
+        try:
+            futures = [pool.submit(queue_worker, path_queue) for i in range(nb_cpu)]
+            for future in concurrent.futures.as_completed(futures):
+                logger.debug("worker ran {} job(s)".format(future.result()))
+        finally:
+            pool.shutdown()
+    compute_time = time.time() - compute_time
+
+    status = queue.status()
+    if status["failed"]:
+        logger.warning("{} job(s) failed, see {}".format(status["failed"], os.path.join(path_queue, "failed")))
+    results = [result for job_id, result in queue.results() if job_id in jobs]
+    if path_results:
+        with ResultSink(path_results) as sink:
+            for result in results:
+                sink.append(result)
+    return {'results': pd.concat(results) if results else pd.DataFrame(), "compute_time": compute_time}
+
+
+def queue_worker(path_queue):
+    """
+    Worker of run_function_queue()
+    :return: number of jobs run
+    """
+    return JobQueue(path_queue).work(lambda args: function_launcher(tuple(args)))
+
+
 def get_parser():
     # Initialize parser
     parser = msct_parser.Parser(__file__)
@@ -421,6 +490,16 @@ def get_parser():
                       mandatory=False,
                       example='42')
 
+    parser.add_option(name="-queue",
+                      type_value="str",
+                      description="Folder of a job queue shared by several instances of sct_pipeline (eg: on the "
+                                  "nodes of a cluster with a shared file system). Each instance runs the jobs (one "
+                                  "per subject and '-p' arguments) that were not taken by the others, and takes over "
+                                  "the jobs of instances that died. Re-running the command only runs the jobs that "
+                                  "are not done.",
+                      mandatory=False,
+                      example='/shared/queue_propseg')
+
     parser.add_option(name="-test-integrity",
                       type_value="multiple_choice",
                       description="Run (=1) or not (=0) integrity testing which is defined in test_integrity() function of the test_ script. See example here: https://github.com/neuropoly/spinalcordtoolbox/blob/master/testing/test_sct_propseg.py",
@@ -430,6 +509,16 @@ def get_parser():
 
     parser.usage.addSection("\nOUTPUT")
 
+    parser.add_option(name="-results",
+                      type_value="folder_creation",
+                      description="Folder where the results of each subject are written as soon as they are "
+                                  "available (Arrow files, or SQLite if pyarrow is not installed). Results of "
+                                  "several runs (eg: interrupted runs) can be read together with "
+                                  "spinalcordtoolbox.result_sink.read_results(). With -queue, the results of all "
+                                  "the jobs of the queue are written once they are done.",
+                      mandatory=False,
+                      example='results_propseg/')
+
     parser.add_option(name="-log",
                       type_value='multiple_choice',
                       description="Redirects Terminal verbose to log file.",
@@ -497,7 +586,7 @@ if __name__ == "__main__":
     if "-j" in arguments:
         jobs = arguments["-j"]
     else:
-        jobs = cpu_count()  # uses maximum number of available CPUs
+        jobs = cpu.get_ncpu()  # uses the whole CPU budget
     test_integrity = int(arguments['-test-integrity'])
     create_log = int(arguments['-log'])
     output_pickle = int(arguments['-pickle'])
@@ -555,6 +644,7 @@ if __name__ == "__main__":
 
     # Check number of CPU cores
     logger.info('CPU Thread on local machine: {} '.format(cpu_count()))
+    logger.info('CPU budget (SCT_NCPU):      {} '.format(cpu.get_ncpu()))
 
     logger.info('    Requested threads:       {} '.format(jobs))
 
@@ -583,7 +673,13 @@ if __name__ == "__main__":
             sct.remove_handler(file_handler)
         # run function
         logger.debug("enter test fct")
-        tests_ret = run_function(function_to_test, path_data, list_subj, list_args=list_args, nb_cpu=jobs, verbose=1, test_integrity=test_integrity)
+        if "-queue" in arguments:
+            tests_ret = run_function_queue(function_to_test, path_data, list_subj, arguments["-queue"],
+                                           list_args=list_args, nb_cpu=jobs, test_integrity=test_integrity,
+                                           path_results=arguments.get("-results", None))
+        else:
+            tests_ret = run_function(function_to_test, path_data, list_subj, list_args=list_args, nb_cpu=jobs, verbose=1, test_integrity=test_integrity,
+                                     path_results=arguments.get("-results", None))
         logger.debug("exit test fct")
         results = tests_ret['results']
         compute_time = tests_ret['compute_time']
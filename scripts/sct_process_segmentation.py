@@ -24,9 +24,13 @@ from matplotlib.ticker import MaxNLocator
 import sct_utils as sct
 from msct_parser import Parser
 from spinalcordtoolbox import process_seg
+from spinalcordtoolbox.cache import get_step_cache
 from spinalcordtoolbox.aggregate_slicewise import aggregate_per_slice_or_level, save_as_csv, func_wa, func_std, \
     func_sum, _merge_dict
+from spinalcordtoolbox.metrics_db import is_metrics_db, save_as_sqlite
 from spinalcordtoolbox.utils import parse_num_list
+from spinalcordtoolbox.image import Image
+from spinalcordtoolbox.template import VertLevelIndex
 from spinalcordtoolbox.centerline.core import ParamCenterline
 from spinalcordtoolbox.reports.qc import generate_qc
 
@@ -55,13 +59,19 @@ def get_parser():
     parser.usage.addSection('Optional Arguments')
     parser.add_option(name='-o',
                       type_value='file_output',
-                      description="Output file name (add extension). Default: csa.csv.",
+                      description="Output file name (add extension). With extension .sqlite or .db, results are "
+                                  "added to a SQLite database of metrics, which can be shared by several runs in "
+                                  "parallel. Default: csa.csv.",
                       mandatory=False)
     parser.add_option(name='-append',
                       type_value='int',
                       description='Append results as a new line in the output csv file instead of overwriting it.',
                       mandatory=False,
                       default_value=0)
+    parser.add_option(name='-subject',
+                      type_value='str',
+                      description='Subject to list with the results, if they are saved in a SQLite database (see -o).',
+                      mandatory=False)
     parser.add_option(name='-z',
                       type_value='str',
                       description='Slice range to compute the metrics across (requires \"-p csa\").',
@@ -235,6 +245,10 @@ def main(args):
         append = int(arguments['-append'])
     else:
         append = 0
+    if '-subject' in arguments:
+        subject = arguments['-subject']
+    else:
+        subject = None
     if '-vert' in arguments:
         vert_levels = arguments['-vert']
     else:
@@ -277,22 +291,30 @@ def main(args):
     metrics, fit_results = process_seg.compute_shape(fname_segmentation,
                                                      angle_correction=angle_correction,
                                                      param_centerline=param_centerline,
-                                                     verbose=verbose)
+                                                     verbose=verbose,
+                                                     cache=get_step_cache())
+    # Compute the vertebral level of each slice once for all the metrics
+    vert_level_index = None
+    if vert_levels:
+        vert_level_index = VertLevelIndex(Image(fname_vert_levels).change_orientation('RPI'))
     for key in metrics:
         if key == 'length':
             # For computing cord length, slice-wise length needs to be summed across slices
             metrics_agg[key] = aggregate_per_slice_or_level(metrics[key], slices=parse_num_list(slices),
                                                             levels=parse_num_list(vert_levels), perslice=perslice,
-                                                            perlevel=perlevel, vert_level=fname_vert_levels,
+                                                            perlevel=perlevel, vert_level=vert_level_index,
                                                             group_funcs=(('SUM', func_sum),))
         else:
             # For other metrics, we compute the average and standard deviation across slices
             metrics_agg[key] = aggregate_per_slice_or_level(metrics[key], slices=parse_num_list(slices),
                                                             levels=parse_num_list(vert_levels), perslice=perslice,
-                                                            perlevel=perlevel, vert_level=fname_vert_levels,
+                                                            perlevel=perlevel, vert_level=vert_level_index,
                                                             group_funcs=group_funcs)
     metrics_agg_merged = _merge_dict(metrics_agg)
-    save_as_csv(metrics_agg_merged, file_out, fname_in=fname_segmentation, append=append)
+    if is_metrics_db(file_out):
+        save_as_sqlite(metrics_agg_merged, file_out, fname_in=fname_segmentation, subject=subject, append=append)
+    else:
+        save_as_csv(metrics_agg_merged, file_out, fname_in=fname_segmentation, append=append)
 
     # QC report (only show CSA for clarity)
     if path_qc is not None:
@@ -300,7 +322,10 @@ def main(args):
                     subject=qc_subject, path_img=_make_figure(metrics_agg_merged, fit_results),
                     process='sct_process_segmentation')
 
-    sct.display_open(file_out)
+    if is_metrics_db(file_out):
+        sct.printv('\nDone! Results were added to the database: ' + file_out + '\n', verbose=1, type='info')
+    else:
+        sct.display_open(file_out)
 
 
 if __name__ == "__main__":
@@ -40,6 +40,8 @@ import numpy as np
 import spinalcordtoolbox.image as msct_image
 from spinalcordtoolbox.image import Image
 from spinalcordtoolbox.reports.qc import generate_qc
+from spinalcordtoolbox.cache import get_step_cache
+from spinalcordtoolbox.trace import traced
 
 import sct_utils as sct
 from msct_parser import Parser
@@ -603,6 +605,7 @@ def main(args=None):
 def register(src, dest, paramreg, param, i_step_str):
     """
     Register src onto dest image. Output affine transformations that need to be inverted will have the prefix "-".
+    If the same step was already run on the same images, the transformations are taken from the step cache.
     :param src:
     :param dest:
     :param paramreg:
@@ -610,6 +613,27 @@ def register(src, dest, paramreg, param, i_step_str):
     :param i_step_str:
     :return: list: warp_forward, warp_inverse
     """
+    input_files = (src if isinstance(src, list) else [src]) + (dest if isinstance(dest, list) else [dest])
+    if param.fname_mask:
+        input_files.append('mask.nii.gz')
+    with get_step_cache().step(
+     "register",
+     input_files=input_files,
+     params={"paramreg": vars(paramreg.steps[i_step_str]), "i_step": i_step_str, "padding": param.padding},
+    ) as step:
+        if not step.cached:
+            warp_forward, warp_inverse = register_step(src, dest, paramreg, param, i_step_str)
+            step.outputs = sorted(set(w.lstrip('-') for w in (warp_forward, warp_inverse)
+                                      if os.path.isfile(w.lstrip('-'))))
+            step.result = [warp_forward, warp_inverse]
+    return tuple(step.result)
+
+
+@traced(cat="registration")
+def register_step(src, dest, paramreg, param, i_step_str):
+    """
+    Register src onto dest image (see :func:`register`), without caching.
+    """
     # initiate default parameters of antsRegistration transformation
     ants_registration_params = {'rigid': '', 'affine': '', 'compositeaffine': '', 'similarity': '', 'translation': '',
                                 'bspline': ',10', 'gaussiandisplacementfield': ',3,0',
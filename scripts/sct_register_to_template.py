@@ -25,6 +25,7 @@ from spinalcordtoolbox.image import Image
 from spinalcordtoolbox.centerline.core import ParamCenterline, get_centerline
 from spinalcordtoolbox.reports.qc import generate_qc
 from spinalcordtoolbox.resampling import resample_file
+from spinalcordtoolbox.cache import get_step_cache
 
 import sct_utils as sct
 import sct_maths
@@ -391,11 +392,7 @@ def main(args=None):
         # straighten segmentation
         sct.printv('\nStraighten the spinal cord using centerline/segmentation...', verbose)
 
-        # check if warp_curve2straight and warp_straight2curve already exist (i.e. no need to do it another time)
-        fn_warp_curve2straight = os.path.join(curdir, "warp_curve2straight.nii.gz")
-        fn_warp_straight2curve = os.path.join(curdir, "warp_straight2curve.nii.gz")
-        fn_straight_ref = os.path.join(curdir, "straight_ref.nii.gz")
-
+        # reuse the warping fields if the straightening was already done with the same inputs
         cache_input_files=[ftmp_seg]
         if vertebral_alignment:
             cache_input_files += [
@@ -403,39 +400,30 @@ def main(args=None):
              ftmp_label,
              ftmp_template_label,
             ]
-        cache_sig = sct.cache_signature(
+        with get_step_cache().step(
+         "straightening",
          input_files=cache_input_files,
-        )
-        cachefile = os.path.join(curdir, "straightening.cache")
-        if sct.cache_valid(cachefile, cache_sig) and os.path.isfile(fn_warp_curve2straight) and os.path.isfile(fn_warp_straight2curve) and os.path.isfile(fn_straight_ref):
-            sct.printv('Reusing existing warping field which seems to be valid', verbose, 'warning')
-            sct.copy(fn_warp_curve2straight, 'warp_curve2straight.nii.gz')
-            sct.copy(fn_warp_straight2curve, 'warp_straight2curve.nii.gz')
-            sct.copy(fn_straight_ref, 'straight_ref.nii.gz')
-            # apply straightening
-            sct_apply_transfo.main(args=[
-                '-i', ftmp_seg,
-                '-w', 'warp_curve2straight.nii.gz',
-                '-d', 'straight_ref.nii.gz',
-                '-o', add_suffix(ftmp_seg, '_straight')])
-        else:
-            from spinalcordtoolbox.straightening import SpinalCordStraightener
-            sc_straight = SpinalCordStraightener(ftmp_seg, ftmp_seg)
-            sc_straight.param_centerline = param_centerline
-            sc_straight.output_filename = add_suffix(ftmp_seg, '_straight')
-            sc_straight.path_output = './'
-            sc_straight.qc = '0'
-            sc_straight.remove_temp_files = param.remove_temp_files
-            sc_straight.verbose = verbose
-
-            if vertebral_alignment:
-                sc_straight.centerline_reference_filename = ftmp_template_seg
-                sc_straight.use_straight_reference = True
-                sc_straight.discs_input_filename = ftmp_label
-                sc_straight.discs_ref_filename = ftmp_template_label
-
-            sc_straight.straighten()
-            sct.cache_save(cachefile, cache_sig)
+         params={"param_centerline": vars(param_centerline), "vertebral_alignment": vertebral_alignment},
+         outputs=['warp_curve2straight.nii.gz', 'warp_straight2curve.nii.gz', 'straight_ref.nii.gz',
+                  add_suffix(ftmp_seg, '_straight')],
+        ) as step:
+            if not step.cached:
+                from spinalcordtoolbox.straightening import SpinalCordStraightener
+                sc_straight = SpinalCordStraightener(ftmp_seg, ftmp_seg)
+                sc_straight.param_centerline = param_centerline
+                sc_straight.output_filename = add_suffix(ftmp_seg, '_straight')
+                sc_straight.path_output = './'
+                sc_straight.qc = '0'
+                sc_straight.remove_temp_files = param.remove_temp_files
+                sc_straight.verbose = verbose
+
+                if vertebral_alignment:
+                    sc_straight.centerline_reference_filename = ftmp_template_seg
+                    sc_straight.use_straight_reference = True
+                    sc_straight.discs_input_filename = ftmp_label
+                    sc_straight.discs_ref_filename = ftmp_template_label
+
+                sc_straight.straighten()
 
         # N.B. DO NOT UPDATE VARIABLE ftmp_seg BECAUSE TEMPORARY USED LATER
         # re-define warping field using non-cropped space (to avoid issue #367)
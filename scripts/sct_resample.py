@@ -93,9 +93,11 @@ def get_parser():
     return parser
 
 
-def run_main():
+def main(args=None):
+    if args is None:
+        args = sys.argv[1:]
     parser = get_parser()
-    arguments = parser.parse(sys.argv[1:])
+    arguments = parser.parse(args)
     param.fname_data = arguments["-i"]
     arg = 0
     if "-f" in arguments:
@@ -135,4 +137,4 @@ def run_main():
 
 if __name__ == "__main__":
     sct.init_sct()
-    run_main()
+    main()
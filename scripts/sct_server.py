@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+#########################################################################################
+#
+# Local daemon running SCT commands in a warm process
+#
+# ---------------------------------------------------------------------------------------
+# Copyright (c) 2019 Polytechnique Montreal <www.neuro.polymtl.ca>
+#
+# About the license: see the file LICENSE.TXT
+#########################################################################################
+
+from __future__ import absolute_import
+
+import sys
+import os
+import argparse
+
+from spinalcordtoolbox.utils import Metavar, SmartFormatter
+from spinalcordtoolbox import server
+
+import sct_utils as sct
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description='Run a local daemon that keeps python modules, deep learning models and templates in memory, to '
+                    'speed up SCT commands. While the daemon is running, SCT commands are forwarded to it (they fall '
+                    'back to running in a new process if the daemon cannot run them). Commands are run one at a '
+                    'time. The daemon communicates through a UNIX socket only accessible by the '
+                    'user; its path can be set with the environment variable SCT_SERVER_SOCKET.',
+        add_help=None,
+        formatter_class=SmartFormatter,
+        prog=os.path.basename(__file__).strip(".py"))
+
+    optional = parser.add_argument_group("OPTIONAL ARGUMENTS")
+    optional.add_argument(
+        "-h",
+        "--help",
+        action="help",
+        help="Show this help message and exit")
+    optional.add_argument(
+        "-stop",
+        action="store_true",
+        help="Stop the running daemon.")
+    optional.add_argument(
+        "-status",
+        action="store_true",
+        help="Check whether the daemon is running.")
+    optional.add_argument(
+        "-preload",
+        nargs="*",
+        choices=("deepseg", "template"),
+        default=["deepseg", "template"],
+        help="Items to load when starting the daemon: deep learning modules (deepseg) and PAM50 template (template). "
+             "Models are kept in memory once they have been used.")
+    optional.add_argument(
+        "-socket",
+        metavar=Metavar.file,
+        default=None,
+        help="Path of the UNIX socket. Default: $SCT_SERVER_SOCKET, or a per-user path in the temporary folder.")
+    optional.add_argument(
+        "-v",
+        type=int,
+        help="Verbose: 0 = no verbosity, 1 = verbose, 2 = debug (log each command).",
+        choices=(0, 1, 2),
+        default=1)
+
+    return parser
+
+
+def main(args=None):
+    if args is None:
+        args = sys.argv[1:]
+    parser = get_parser()
+    arguments = parser.parse_args(args=args)
+    sct.init_sct(log_level=arguments.v, update=True)  # Update log level
+
+    path_socket = arguments.socket or server.get_socket_path()
+
+    if arguments.status:
+        running = server.is_running(path_socket)
+        sct.printv("sct_server is {}running ({})".format("" if running else "not ", path_socket))
+        sys.exit(0 if running else 1)
+
+    if arguments.stop:
+        if not server.stop(path_socket):
+            sct.printv("sct_server is not running ({})".format(path_socket), type="warning")
+        return
+
+    server.preload(arguments.preload)
+    server.serve(path_socket)
+
+
+if __name__ == "__main__":
+    sct.init_sct()
+    main()
@@ -11,7 +11,7 @@
 
 from __future__ import print_function, absolute_import
 
-import sys, os, time, copy, shlex, importlib, multiprocessing, tempfile, shutil
+import sys, os, io, time, copy, shlex, importlib, multiprocessing, tempfile, shutil, subprocess, json
 import traceback
 import signal
 
@@ -19,6 +19,7 @@ import numpy as np
 from pandas import DataFrame
 
 import sct_utils as sct
+from spinalcordtoolbox import cpu
 
 sys.path.append(os.path.join(sct.__sct_dir__, 'testing'))
 
@@ -108,7 +109,7 @@ def get_parser():
         if jobs > 0:
             pass
         elif jobs == 0:
-            jobs = multiprocessing.cpu_count()
+            jobs = cpu.get_ncpu()
         else:
             raise ValueError()
         return jobs
@@ -128,7 +129,7 @@ def get_parser():
     )
     parser.add_argument("--jobs", "-j",
      type=arg_jobs,
-     help="# of simultaneous tests to run (jobs). 0 or unspecified means # of available CPU threads ({})".format(multiprocessing.cpu_count()),
+     help="# of simultaneous tests to run (jobs). 0 or unspecified means the CPU budget ({}, see SCT_NCPU)".format(cpu.get_ncpu()),
      default=arg_jobs(0),
     )
     parser.add_argument("--verbose", "-v",
@@ -149,6 +150,26 @@ def get_parser():
     parser.add_argument("--execution-folder",
      help="Folder where to run tests from (default. temporary)",
     )
+    parser.add_argument("--perf-save",
+     metavar="FILE",
+     help="Save the wall time and peak memory of each function and test case in this file (JSON), to be used as a"
+          " baseline with --perf-baseline.",
+    )
+    parser.add_argument("--perf-baseline",
+     metavar="FILE",
+     help="Compare the wall time and peak memory of each function and test case to this baseline (saved with"
+          " --perf-save), and fail if they increased by more than the tolerance.",
+    )
+    parser.add_argument("--perf-tolerance",
+     type=float,
+     default=0.25,
+     help="Relative increase of wall time or peak memory considered as a regression (default: 0.25, ie: 25%%).",
+    )
+    parser.add_argument("--perf-min-time",
+     type=float,
+     default=2.,
+     help="Durations shorter than this (in s) are too noisy to be compared (default: 2).",
+    )
 
     return parser
 
@@ -168,6 +189,7 @@ def process_function(fname, param):
     # loop over parameters to test
     list_status_function = []
     list_output = []
+    list_perf = []
     for i in range(0, len(param.args)):
         param_test = copy.deepcopy(param)
         param_test.default_args = param.args
@@ -190,8 +212,11 @@ def process_function(fname, param):
         else:
             list_status_function.append(param_test.status)
             list_output.append(param_test.output)
+            if param_test.status == 0:
+                list_perf.append((param_test.args, float(param_test.results['duration'].iloc[0]),
+                                  param_test.peak_rss_mb))
 
-    return list_output, list_status_function
+    return list_output, list_status_function, list_perf
 
 
 def process_function_multiproc(fname, param):
@@ -279,6 +304,7 @@ def main(args=None):
         print("- in parallel with {} jobs: {}".format(jobs, " ".join(functions_parallel)))
 
     list_status = []
+    perf = {}
     for name, functions in (
       ("serial", functions_serial),
       ("parallel", functions_parallel),
@@ -291,7 +317,9 @@ def main(args=None):
 
         try:
             if functions == functions_parallel and jobs != 1:
-                pool = multiprocessing.Pool(processes=jobs)
+                # the workers share the CPU budget
+                with cpu.split(jobs):
+                    pool = multiprocessing.Pool(processes=jobs)
 
                 results = list()
                 # loop across functions and run tests
@@ -322,7 +350,8 @@ def main(args=None):
                 else:
                     res = results[idx_function].get()
 
-                list_output, list_status_function = res
+                list_output, list_status_function, list_perf = res
+                perf[f] = perf_entry(list_perf)
                 # manage status
                 if any(list_status_function):
                     if 1 in list_status_function:
@@ -352,9 +381,30 @@ def main(args=None):
                 pool.terminate()
                 pool.join()
 
+    if arguments.perf_save:
+        with io.open(arguments.perf_save, "w", encoding="utf-8") as f:
+            f.write(u"{}".format(json.dumps({"sct_version": sct.__version__, "functions": perf}, indent=1,
+                                            sort_keys=True)))
+        sct.printv("Performance baseline saved to {}".format(arguments.perf_save))
+
+    if arguments.perf_baseline:
+        with io.open(arguments.perf_baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare_perf(baseline["functions"], perf, tolerance=arguments.perf_tolerance,
+                                   min_time=arguments.perf_min_time)
+        print("\nPerformance compared to {} (SCT {}):".format(arguments.perf_baseline, baseline["sct_version"]))
+        if regressions:
+            for (f, args, measure, value_baseline, value) in regressions:
+                print("- {} {}: {} {:.1f} -> {:.1f} (+{:.0f}%)".format(f, args or "(total)", measure, value_baseline,
+                                                                   value, 100. * (value / value_baseline - 1)))
+            for f in sorted(set(r[0] for r in regressions)):
+                list_status.append((f, 3))
+        else:
+            print("No regression.")
+
     print('status: ' + str([s for (f, s) in list_status]))
     if any([s for (f, s) in list_status]):
-        print("Failures: {}".format(" ".join([f for (f, s) in list_status if s])))
+        print("Failures: {}".format(" ".join(sorted(set([f for (f, s) in list_status if s])))))
 
     # display elapsed time
     elapsed_time = time.time() - start_time
@@ -525,9 +575,11 @@ def test_function(param_test):
     # param_test.args_with_path = parser.dictionary_to_string(dict_args_with_path)
     #
     # initialize panda dataframe
+    param_test.peak_rss_mb = None
     param_test.results = DataFrame(index=[subject_folder],
                                    data={'status': 0,
                                          'duration': 0,
+                                         'peak_rss_mb': None,
                                          'output': '',
                                          'path_data': param_test.path_data,
                                          'path_output': param_test.path_output})
@@ -572,9 +624,10 @@ def test_function(param_test):
         #     # in case of relative path, we want a subfolder too
         #     os.makedirs(param_test.path_output)
         # os.chdir(path_testing)
-        param_test.status, o = sct.run(cmd, verbose=0)
+        param_test.status, o, param_test.peak_rss_mb = run_measured(cmd)
+        param_test.results['peak_rss_mb'] = param_test.peak_rss_mb
         if param_test.status:
-            raise Exception
+            raise Exception(o)
     except Exception as err:
         param_test.status = 1
         param_test.output += str(err)
@@ -599,6 +652,74 @@ def test_function(param_test):
     return update_param(param_test)
 
 
+def run_measured(cmd):
+    """
+    Run a command like sct.run(), and measure the peak memory used by its processes.
+    The command runs in a new process (not on a sct_server daemon, whose memory would not be measured).
+    :return: status, output, peak RSS of the command in MB (None if it can't be measured on this platform)
+    """
+    if not hasattr(os, "wait4"):
+        status, output = sct.run(cmd, verbose=0, raise_exception=False)
+        return status, output, None
+    env = cpu.thread_env()
+    env["SCT_SERVER_SOCKET"] = os.path.join(tempfile.gettempdir(), "sct_testing-no-server", "socket")
+    process = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, env=env)
+    output = process.stdout.read().decode("utf-8", "replace")
+    process.stdout.close()
+    # wait4() returns the resource usage of the process, including the processes it waited for
+    _, status, rusage = os.wait4(process.pid, 0)
+    status = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -os.WTERMSIG(status)
+    process.returncode = status
+    maxrss = rusage.ru_maxrss
+    peak_rss_mb = maxrss / (1024. * 1024.) if sys.platform == "darwin" else maxrss / 1024.
+    return status, output.rstrip(), peak_rss_mb
+
+
+def perf_entry(list_perf):
+    """
+    :param list_perf: list of (arguments, duration, peak RSS) of the test cases of a function
+    :return: performance entry of a function: total duration, max peak RSS, and measures of each test case
+    """
+    rss = [m for (a, d, m) in list_perf if m is not None]
+    return {
+     "duration": sum(d for (a, d, m) in list_perf),
+     "peak_rss_mb": max(rss) if rss else None,
+     "cases": dict((a, {"duration": d, "peak_rss_mb": m}) for (a, d, m) in list_perf),
+    }
+
+
+def compare_perf(baseline, perf, tolerance=0.25, min_time=2.):
+    """
+    Find the functions and test cases that got slower or use more memory than in the baseline.
+    Functions or test cases missing from either side are ignored.
+    :param baseline: dict of function -> perf_entry()
+    :param perf: dict of function -> perf_entry()
+    :param tolerance: relative increase considered as a regression
+    :param min_time: durations shorter than this (in the baseline) are not compared
+    :return: list of (function, arguments (None for the whole function), measure, baseline value, value)
+    """
+    regressions = []
+
+    def compare(f, args, entry_baseline, entry):
+        for measure in ("duration", "peak_rss_mb"):
+            value_baseline, value = entry_baseline.get(measure, None), entry.get(measure, None)
+            if value_baseline is None or value is None:
+                continue
+            if measure == "duration" and value_baseline < min_time:
+                continue
+            if value > value_baseline * (1. + tolerance):
+                regressions.append((f, args, measure, value_baseline, value))
+
+    for f, entry in sorted(perf.items()):
+        if f not in baseline:
+            continue
+        compare(f, None, baseline[f], entry)
+        for args, entry_case in sorted(entry["cases"].items()):
+            if args in baseline[f].get("cases", {}):
+                compare(f, args, baseline[f]["cases"][args], entry_case)
+    return regressions
+
+
 def update_param(param):
     """
     Update field "results" in param class
@@ -613,7 +734,5 @@ def update_param(param):
 # ==========================================================================================
 if __name__ == "__main__":
     sct.init_sct()
-    # initialize parameters
-    param = Param()
     # call main function
     main()
@@ -15,12 +15,15 @@
 
 from __future__ import print_function, division, absolute_import
 
-import sys, io, os, re, time, datetime, platform
+import sys, io, os, re, ast, time, datetime, platform
 import errno
 import logging
 import shutil
 import subprocess
 import tempfile
+import threading
+import traceback
+import types
 
 import numpy as np
 
@@ -42,6 +45,8 @@ else:
 
 from spinalcordtoolbox import __version__, __sct_dir__, __data_dir__
 from spinalcordtoolbox.utils import check_exe
+from spinalcordtoolbox import trace
+from spinalcordtoolbox import cpu
 
 
 def init_sct(log_level=1, update=False):
@@ -81,6 +86,10 @@ def init_sct(log_level=1, update=False):
         init_error_client()
         if os.environ.get("SCT_TIMER", None) is not None:
             add_elapsed_time_counter()
+        if os.environ.get("SCT_TRACE", None) is not None:
+            import atexit
+            trace.start()
+            atexit.register(trace.finish)
 
         # Display SCT version
         logger.info('\n--\nSpinal Cord Toolbox ({})\n'.format(__version__))
@@ -286,19 +295,42 @@ def run(cmd, verbose=1, raise_exception=True, cwd=None, env=None, is_sct_binary=
     if verbose:
         printv("%s # in %s" % (cmdline, cwd), 1, 'code')
 
+    name = os.path.basename(cmd[0] if isinstance(cmd, list) else cmd.split(" ", 1)[0])
+
+    if not is_sct_binary and env is os.environ:
+        code = _get_entry_point(cmd)
+        if code is not None:
+            with trace.span(name, cat="run", cmdline=cmdline, inprocess=True):
+                if verbose == 2:
+                    # stream the output as it is produced, as for a subprocess
+                    stream = _OutputTee(sys.stdout)
+                    status, _ = run_inprocess(code, cmd[1:], cwd=cwd, stream=stream)
+                    output = _clean_output(stream.getvalue())
+                else:
+                    status, output = run_inprocess(code, cmd[1:], cwd=cwd)
+            if status != 0 and raise_exception:
+                raise RunError(output)
+            return status, output
+
     shell = isinstance(cmd, str)
 
-    process = subprocess.Popen(cmd, shell=shell, cwd=cwd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, env=env)
-    output_final = ''
-    while True:
-        # Watch out for deadlock!!!
-        output = process.stdout.readline().decode("utf-8")
-        if output == '' and process.poll() is not None:
-            break
-        if output:
-            if verbose == 2:
-                printv(output.strip())
-            output_final += output.strip() + '\n'
+    # the command uses the CPU budget of this process
+    env = cpu.thread_env(env=env)
+
+    # the span of a subprocess has the CPU time and peak RSS of the child processes; SCT commands record their own
+    # spans in the trace
+    with trace.span(name, cat="run", children=True, cmdline=cmdline):
+        process = subprocess.Popen(cmd, shell=shell, cwd=cwd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, env=env)
+        output_final = ''
+        while True:
+            # Watch out for deadlock!!!
+            output = process.stdout.readline().decode("utf-8")
+            if output == '' and process.poll() is not None:
+                break
+            if output:
+                if verbose == 2:
+                    printv(output.strip())
+                output_final += output.strip() + '\n'
 
     status = process.returncode
     output = output_final.rstrip()
@@ -313,6 +345,169 @@ def run(cmd, verbose=1, raise_exception=True, cwd=None, env=None, is_sct_binary=
     return status, output
 
 
+# Compiled SCT scripts that can be run in-process, indexed by path (None if not suitable)
+_entry_points = {}
+
+
+def _is_inprocess_script(source, path="<script>"):
+    """
+    Check whether the source of a script can be run in-process by :func:`run_inprocess`: it defines
+    ``main(args=None)``, and its ``if __name__ == "__main__":`` block only calls functions (eg: ``sct.init_sct()`` and
+    ``main()``). Scripts that also define globals in that block (eg: ``param = Param()``) are not suitable, as the block
+    is not executed in-process.
+    :param source: source code of the script
+    :param path: file name, for error messages
+    :return: bool
+    """
+    if not re.search(r"^def main\(args=None\):", source, re.MULTILINE):
+        return False
+    tree = compile(source, path, "exec", ast.PyCF_ONLY_AST)
+    for node in tree.body:
+        if isinstance(node, ast.If) and _is_main_guard(node.test):
+            return not node.orelse and all(isinstance(stmt, ast.Expr) and isinstance(stmt.value, ast.Call)
+                                           for stmt in node.body)
+    return False
+
+
+def _is_main_guard(test):
+    """
+    :return: True if the ast node is the test ``__name__ == "__main__"``
+    """
+    if not (isinstance(test, ast.Compare) and isinstance(test.left, ast.Name) and test.left.id == "__name__"
+            and len(test.comparators) == 1):
+        return False
+    # ast.Constant (python >= 3.8) or ast.Str
+    comparator = test.comparators[0]
+    return getattr(comparator, "value", getattr(comparator, "s", None)) == "__main__"
+
+
+def _get_entry_point(cmd):
+    """
+    Check whether a command calls an SCT python script that can be run in-process by :func:`run_inprocess`, i.e. a
+    script of the "scripts" folder defining ``main(args=None)``, see :func:`_is_inprocess_script`.
+    In-process dispatch is only done from the main thread (it changes the cwd and sys.argv of the process), and can be
+    disabled with the environment variable SCT_RUN_INPROCESS=0.
+    :param cmd: command, as passed to :func:`run`. Strings are always run in a shell.
+    :return: code object of the script, or None if the command must be run as a subprocess.
+    """
+    if not isinstance(cmd, list) or not cmd or os.environ.get("SCT_RUN_INPROCESS", "1") == "0":
+        return None
+    if not isinstance(threading.current_thread(), threading._MainThread):
+        return None
+    name = cmd[0]
+    if os.path.basename(name) != name:
+        return None
+    path = os.path.join(__sct_dir__, "scripts", "{}.py".format(name))
+    if path not in _entry_points:
+        code = None
+        if os.path.isfile(path):
+            with io.open(path, "r", encoding="utf-8") as f:
+                source = f.read()
+            if _is_inprocess_script(source, path):
+                code = compile(source, path, "exec")
+        _entry_points[path] = code
+    return _entry_points[path]
+
+
+def run_inprocess(code, args, cwd=None, stream=None):
+    """
+    Run the main() function of an SCT script in the current interpreter, as if it was called from the command line.
+
+    The script is executed in a fresh module (so that module-level parameters don't leak between calls), with
+    its own cwd, sys.argv and logging levels, which are restored afterwards. Its stdout/stderr and logging output are
+    captured.
+
+    :param code: code object of the script (see :func:`_get_entry_point`)
+    :param args: list of command-line arguments
+    :param cwd: working directory
+    :param stream: text file object to write the output to, instead of capturing it
+    :return: status, output: same as :func:`run` (output is empty if `stream` is set)
+    """
+    path = code.co_filename
+    path_scripts = os.path.dirname(path)
+    if path_scripts not in sys.path:
+        sys.path.append(path_scripts)
+
+    if stream is not None:
+        buf = stream
+    else:
+        buf = io.StringIO() if sys.hexversion >= 0x03000000 else io.BytesIO()
+    saved_cwd = os.getcwd()
+    saved_argv = sys.argv
+    saved_stdout, saved_stderr = sys.stdout, sys.stderr
+    saved_levels = logging.root.level, logger.level
+    handlers = [h for h in logging.root.handlers
+                if isinstance(h, logging.StreamHandler) and h.stream in (saved_stdout, saved_stderr)]
+    saved_streams = [h.stream for h in handlers]
+
+    module = types.ModuleType("sct_run_{}".format(os.path.splitext(os.path.basename(path))[0]))
+    module.__file__ = path
+    status = 0
+    try:
+        if cwd is not None:
+            os.chdir(cwd)
+        sys.argv = [path] + [str(x) for x in args]
+        sys.stdout = sys.stderr = buf
+        for h in handlers:
+            h.stream = buf
+        exec(code, module.__dict__)
+        module.main(args=sys.argv[1:])
+    except SystemExit as e:
+        if e.code is None:
+            status = 0
+        elif isinstance(e.code, int):
+            status = e.code % 256  # same as the exit status of a process
+        else:
+            buf.write(u"{}\n".format(e.code))
+            status = 1
+    except Exception:
+        buf.write(u"{}".format(traceback.format_exc()))
+        status = 1
+    finally:
+        for h, stream in zip(handlers, saved_streams):
+            h.stream = stream
+        sys.stdout, sys.stderr = saved_stdout, saved_stderr
+        sys.argv = saved_argv
+        os.chdir(saved_cwd)
+        logging.root.setLevel(saved_levels[0])
+        logger.setLevel(saved_levels[1])
+
+    if stream is not None:
+        return status, ''
+    return status, _clean_output(buf.getvalue())
+
+
+def _clean_output(text):
+    """
+    :return: output of a command, without blank lines and surrounding spaces (as returned by :func:`run`)
+    """
+    return "\n".join(line.strip() for line in text.splitlines() if line.strip())
+
+
+class _OutputTee(object):
+    """
+    Text stream writing to another stream (flushed at each write) while keeping a copy of the text
+    """
+    def __init__(self, stream):
+        self.stream = stream
+        self.buf = io.StringIO() if sys.hexversion >= 0x03000000 else io.BytesIO()
+
+    def write(self, text):
+        self.buf.write(text)
+        self.stream.write(text)
+        self.stream.flush()
+
+    def flush(self):
+        self.stream.flush()
+
+    def getvalue(self):
+        return self.buf.getvalue()
+
+    def __getattr__(self, name):
+        # eg: isatty, encoding
+        return getattr(self.stream, name)
+
+
 def display_open(file):
     """Print the syntax to open a file based on the platform."""
     if sys.platform == 'linux':
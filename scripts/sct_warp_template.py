@@ -16,6 +16,7 @@ from __future__ import absolute_import
 import sys, os
 
 import spinalcordtoolbox.metadata
+from spinalcordtoolbox.packed_labels import pack_labels
 from spinalcordtoolbox.reports.qc import generate_qc
 from msct_parser import Parser
 import sct_utils as sct
@@ -35,19 +36,26 @@ class Param:
         # self.warp_template = 1
         self.warp_atlas = 1
         self.warp_spinal_levels = 0
+        self.pack_atlas = 1
         self.list_labels_nn = ['_level.nii.gz', '_levels.nii.gz', '_csf.nii.gz', '_CSF.nii.gz', '_cord.nii.gz']  # list of files for which nn interpolation should be used. Default = linear.
         self.verbose = 1  # verbose
         self.path_qc = None
 
 
+# initialize parameters
+param = Param()
+
+
 class WarpTemplate:
-    def __init__(self, fname_src, fname_transfo, warp_atlas, warp_spinal_levels, folder_out, path_template, verbose):
+    def __init__(self, fname_src, fname_transfo, warp_atlas, warp_spinal_levels, folder_out, path_template, verbose,
+                 pack_atlas=1):
 
         # Initialization
         self.fname_src = fname_src
         self.fname_transfo = fname_transfo
         self.warp_atlas = warp_atlas
         self.warp_spinal_levels = warp_spinal_levels
+        self.pack_atlas = pack_atlas
         self.folder_out = folder_out
         self.path_template = path_template
         self.folder_template = param.folder_template
@@ -75,6 +83,10 @@ class WarpTemplate:
         if self.warp_atlas == 1:
             sct.printv('\nWARP ATLAS OF WHITE MATTER TRACTS:', self.verbose)
             warp_label(self.path_template, self.folder_atlas, param.file_info_label, self.fname_src, self.fname_transfo, self.folder_out)
+            if self.pack_atlas == 1:
+                sct.printv('\nPACK ATLAS:', self.verbose)
+                sct.printv('  ' + pack_labels(os.path.join(self.folder_out, self.folder_atlas), param.file_info_label),
+                           self.verbose)
 
         # Warp spinal levels
         if self.warp_spinal_levels == 1:
@@ -163,6 +175,13 @@ def get_parser():
                       mandatory=False,
                       default_value=str(param_default.warp_spinal_levels),
                       example=['0', '1'])
+    parser.add_option(name="-pack",
+                      type_value="multiple_choice",
+                      description="pack the warped atlas into a single file, read directly by sct_extract_metric and "
+                                  "sct_analyze_lesion.",
+                      mandatory=False,
+                      default_value=str(param_default.pack_atlas),
+                      example=['0', '1'])
     parser.add_option(name="-ofolder",
                       type_value="folder_creation",
                       description="name of output folder.",
@@ -205,6 +224,7 @@ def main(args=None):
     fname_transfo = arguments["-w"]
     warp_atlas = int(arguments["-a"])
     warp_spinal_levels = int(arguments["-s"])
+    pack_atlas = int(arguments["-pack"])
     folder_out = arguments['-ofolder']
     path_template = arguments['-t']
     verbose = int(arguments.get('-v'))
@@ -214,7 +234,8 @@ def main(args=None):
     qc_subject = arguments.get("-qc-subject", None)
 
     # call main function
-    w = WarpTemplate(fname_src, fname_transfo, warp_atlas, warp_spinal_levels, folder_out, path_template, verbose)
+    w = WarpTemplate(fname_src, fname_transfo, warp_atlas, warp_spinal_levels, folder_out, path_template, verbose,
+                     pack_atlas=pack_atlas)
 
     path_template = os.path.join(w.folder_out, w.folder_template)
 
@@ -247,5 +268,4 @@ def main(args=None):
 
 if __name__ == "__main__":
     sct.init_sct()
-    param = Param()
     main()
@@ -15,7 +15,7 @@ import csv
 import datetime
 import logging
 
-from spinalcordtoolbox.template import get_slices_from_vertebral_levels, get_vertebral_level_from_slice
+from spinalcordtoolbox.template import VertLevelIndex
 from spinalcordtoolbox.image import Image
 from spinalcordtoolbox.utils import __version__, parse_num_list_inv
 
@@ -85,21 +85,7 @@ def func_map(data, mask, map_clusters):
     # Check number of labels and map_clusters
     assert mask.shape[-1] == len(map_clusters)
 
-    # Iterate across all labels (excluding the first one) and generate cluster labels. Examples of input/output:
-    #   [[0], [0], [0], [1], [2], [0]] --> [0, 0, 0, 1, 2, 0]
-    #   [[0, 1], [0], [0], [1], [2]] --> [0, 0, 0, 0, 1]
-    #   [[0, 1], [0], [1], [2], [3]] --> [0, 0, 0, 1, 2]
-    possible_clusters = [map_clusters[0]]
-    id_clusters = [0]  # this one corresponds to the first cluster
-    for i_cluster in map_clusters[1:]:  # skip the first
-        found_index = False
-        for possible_cluster in possible_clusters:
-            if i_cluster[0] in possible_cluster:
-                id_clusters.append(possible_clusters.index(possible_cluster))
-                found_index = True
-        if not found_index:
-            possible_clusters.append(i_cluster)
-            id_clusters.append(possible_clusters.index([i_cluster[0]]))
+    id_clusters = _id_clusters(map_clusters)
 
     # Sum across each clustered labels, then concatenate to generate mask_clusters
     # mask_clusters has dimension: x, y, z, n_clustered_labels, with n_clustered_labels being equal to the number of
@@ -144,6 +130,29 @@ def func_map(data, mask, map_clusters):
     return beta[0], beta
 
 
+def _id_clusters(map_clusters):
+    """
+    Iterate across all labels (excluding the first one) and generate cluster labels. Examples of input/output:
+      [[0], [0], [0], [1], [2], [0]] --> [0, 0, 0, 1, 2, 0]
+      [[0, 1], [0], [0], [1], [2]] --> [0, 0, 0, 0, 1]
+      [[0, 1], [0], [1], [2], [3]] --> [0, 0, 0, 1, 2]
+    :param map_clusters: list of list of int: See func_map()
+    :return: list of int: cluster of each label
+    """
+    possible_clusters = [map_clusters[0]]
+    id_clusters = [0]  # this one corresponds to the first cluster
+    for i_cluster in map_clusters[1:]:  # skip the first
+        found_index = False
+        for possible_cluster in possible_clusters:
+            if i_cluster[0] in possible_cluster:
+                id_clusters.append(possible_clusters.index(possible_cluster))
+                found_index = True
+        if not found_index:
+            possible_clusters.append(i_cluster)
+            id_clusters.append(possible_clusters.index([i_cluster[0]]))
+    return id_clusters
+
+
 def func_ml(data, mask, map_clusters=None):
     """
     Compute maximum likelihood (ML) for the first label of mask.
@@ -209,8 +218,182 @@ def func_wa(data, mask=None, map_clusters=None):
     return np.average(data, weights=mask), None
 
 
+def _finite_mean(data, finite):
+    """
+    :return: mean of data (where non-finite values were set to 0) across its finite values
+    """
+    n = finite.sum()
+    return data.sum() / n if n else 0.
+
+
+class SliceSums:
+    """
+    Per-slice sums of a metric and of its mask, computed once, from which func_wa, func_bin, func_std, func_max and
+    func_sum are derived for any group of slices. Contiguous groups (eg: vertebral levels) use cumulative sums, so the
+    cost of a group does not depend on its number of slices. Non-finite values of the metric are ignored, as in
+    aggregate_per_slice_or_level(). If the normal equations (Xt.X and Xt.y) of each slice are also computed, func_ml
+    and func_map are solved for all the groups at once, see estimate().
+    """
+    def __init__(self, per_slice):
+        """
+        :param per_slice: dict of 1d arrays (one value per slice): 'size' (sum of the mask across all labels), 'total'
+            (same, for finite values of the metric), 'weight' and 'weight_bin' (sum of the weights of the first label,
+            binarized for the latter), 'wsum' and 'wsum_bin' (weighted sums of the metric), 'wsum_shifted' and
+            'wsum2_shifted' (weighted sums of the metric minus a constant, and of its square), 'sum' and 'max' (of the
+            metric). Optionally, 'xtx' (nz x nb_labels x nb_labels) and 'xty' (nz x nb_labels): normal equations of the
+            ML estimation.
+        """
+        self.per_slice = per_slice
+        self.nz = len(per_slice['sum'])
+        self.cumsum = dict((key, np.concatenate([np.zeros((1,) + np.shape(value)[1:]), np.cumsum(value, axis=0)]))
+                           for key, value in per_slice.items() if key != 'max')
+
+    @classmethod
+    def from_arrays(cls, data, mask=None, normal_equations=False):
+        """
+        :param data: nd-array: metric, the last dimension being the slices
+        :param mask: (n+1)d-array: mask, the last dimension being the labels. Optional.
+        :param normal_equations: Bool: also compute the normal equations of each slice, for func_ml and func_map.
+            Requires a mask.
+        :return: SliceSums
+        """
+        shape, nz = data.shape, data.shape[-1]
+        finite = np.isfinite(data).reshape(-1, nz)
+        data = np.where(finite, data.reshape(-1, nz), 0.).astype(np.float64)
+        if mask is None:
+            size = np.full(nz, np.nan)
+            total = weight = finite.sum(axis=0).astype(np.float64)
+            weight_bin = weight
+            w = finite.astype(np.float64)
+            w_bin = w
+        else:
+            if mask.shape[:-1] != shape:
+                raise ValueError("Dimensions of the mask {} and of the metric {} are inconsistent".format(mask.shape,
+                                                                                                        shape))
+            mask = mask.reshape(-1, nz, mask.shape[-1])
+            size = mask.sum(axis=(0, 2), dtype=np.float64)
+            total = (mask.sum(axis=2) * finite).sum(axis=0, dtype=np.float64)
+            w = mask[..., 0] * finite
+            w_bin = (w >= 0.5) * 1.
+            weight = w.sum(axis=0, dtype=np.float64)
+            weight_bin = w_bin.sum(axis=0, dtype=np.float64)
+        # Shift the metric by its mean before computing the squared sums, to avoid catastrophic cancellation in STD
+        data_shifted = (data - _finite_mean(data, finite)) * finite
+        per_slice = {}
+        if normal_equations and mask is not None:
+            # x [nb_vox x nb_labels] and y [nb_vox] of each slice, see func_ml()
+            x = mask * finite[..., np.newaxis].astype(np.float64)
+            per_slice['xtx'] = np.einsum('vzl,vzm->zlm', x, x)
+            per_slice['xty'] = np.einsum('vzl,vz->zl', x, data)
+        per_slice.update({
+            'size': size,
+            'total': total,
+            'weight': weight,
+            'weight_bin': weight_bin,
+            'wsum': (w * data).sum(axis=0),
+            'wsum_bin': (w_bin * data).sum(axis=0),
+            'wsum_shifted': (w * data_shifted).sum(axis=0),
+            'wsum2_shifted': (w * data_shifted ** 2).sum(axis=0),
+            'sum': data.sum(axis=0),
+            'max': data.max(axis=0),
+        })
+        return cls(per_slice)
+
+    @staticmethod
+    def supports(func):
+        """
+        :return: True if the aggregation of func can be derived from the per-slice sums
+        """
+        return func in (func_wa, func_bin, func_std, func_max, func_sum, func_ml, func_map)
+
+    def handles(self, func):
+        """
+        :return: True if the aggregation of func can be derived from these per-slice sums
+        """
+        return self.supports(func) and (func not in (func_ml, func_map) or 'xtx' in self.per_slice)
+
+    def contains(self, slicegroup):
+        """
+        :return: True if all the slices of the group are in the metric
+        """
+        return all(-self.nz <= i < self.nz for i in slicegroup)
+
+    def reduce(self, key, slicegroup):
+        """
+        :param key: per-slice quantity
+        :param slicegroup: tuple of slices
+        :return: sum (or max) of the quantity across the group
+        """
+        index = [i % self.nz for i in slicegroup]
+        if key == 'max':
+            return self.per_slice[key][index].max()
+        if len(index) == 1:
+            return self.per_slice[key][index[0]]
+        if index == list(range(index[0], index[-1] + 1)):
+            return self.cumsum[key][index[-1] + 1] - self.cumsum[key][index[0]]
+        return self.per_slice[key][index].sum(axis=0)
+
+    def estimate(self, func, slicegroups, map_clusters=None):
+        """
+        Solve func_ml or func_map for several groups of slices at once, from the sums of the per-slice normal equations.
+        :param func: func_ml or func_map
+        :param slicegroups: list of tuple of slices
+        :param map_clusters: list of list of int: See func_map()
+        :return: 1d array: beta of the first label for each group
+        """
+        if not slicegroups:
+            return np.zeros(0)
+        xtx = np.stack([self.reduce('xtx', slicegroup) for slicegroup in slicegroups])
+        xty = np.stack([self.reduce('xty', slicegroup) for slicegroup in slicegroups])
+        # pinv rather than solve, as in func_ml(): Xt.X is singular when a label is absent from the group of slices
+        if func is func_ml:
+            return np.einsum('glm,gm->gl', np.linalg.pinv(xtx), xty)[:, 0]
+        n_labels = xtx.shape[-1]
+        assert n_labels == len(map_clusters)
+        id_clusters = _id_clusters(map_clusters)
+        # Sum labels of each cluster: x_clusters = x . membership
+        membership = np.zeros((n_labels, len(set(id_clusters))))
+        for i, i_cluster in enumerate(list(set(id_clusters))):
+            membership[np.array(id_clusters) == i_cluster, i] = 1
+        xtx_clusters = np.einsum('lc,glm,md->gcd', membership, xtx, membership)
+        xty_clusters = np.einsum('lc,gl->gc', membership, xty)
+        beta_cluster = np.einsum('gcd,gd->gc', np.linalg.pinv(xtx_clusters), xty_clusters)
+        beta_0 = beta_cluster[:, id_clusters]
+        # beta = beta_0 + (Xt.X + 1)^(-1) . (Xt.y - Xt.X . beta_0), see func_map()
+        beta = beta_0 + np.einsum('glm,gm->gl', np.linalg.pinv(xtx + np.eye(n_labels)),
+                                  xty - np.einsum('glm,gm->gl', xtx, beta_0))
+        return beta[:, 0]
+
+    def aggregate(self, func, slicegroup, map_clusters=None):
+        """
+        :param func: one of func_wa, func_bin, func_std, func_max, func_sum, func_ml, func_map
+        :param slicegroup: tuple of slices
+        :param map_clusters: list of list of int: See func_map()
+        :return: result of func on the group of slices (None if the mask is empty)
+        """
+        if self.reduce('total', slicegroup) == 0:
+            return None
+        if func in (func_ml, func_map):
+            return self.estimate(func, [slicegroup], map_clusters)[0]
+        if func is func_max:
+            return self.reduce('max', slicegroup)
+        if func is func_sum:
+            return self.reduce('sum', slicegroup)
+        suffix = '_bin' if func is func_bin else ''
+        weight = self.reduce('weight' + suffix, slicegroup)
+        if weight == 0:
+            # same as np.average()
+            raise ZeroDivisionError("Weights sum to zero, can't be normalized")
+        if func is func_std:
+            mean = self.reduce('wsum_shifted', slicegroup) / weight
+            variance = max(self.reduce('wsum2_shifted', slicegroup) / weight - mean ** 2, 0.)
+            return math.sqrt(variance)
+        return self.reduce('wsum' + suffix, slicegroup) / weight
+
+
 def aggregate_per_slice_or_level(metric, mask=None, slices=[], levels=[], perslice=None, perlevel=False,
-                                 vert_level=None, group_funcs=(('MEAN', func_wa),), map_clusters=None):
+                                 vert_level=None, group_funcs=(('MEAN', func_wa),), map_clusters=None,
+                                 slice_sums=None):
     """
     The aggregation will be performed along the last dimension of 'metric' ndarray.
     :param metric: Class Metric(): data to aggregate.
@@ -219,10 +402,12 @@ def aggregate_per_slice_or_level(metric, mask=None, slices=[], levels=[], persli
     :param levels: List[int]: Vertebral levels to aggregate metric from. It has priority over "slices".
     :param Bool perslice: Aggregate per slice (True) or across slices (False)
     :param Bool perlevel: Aggregate per level (True) or across levels (False). Has priority over "perslice".
-    :param vert_level: Vertebral level. Could be either an Image or a file name.
+    :param vert_level: Vertebral level. Could be either an Image, a file name or a VertLevelIndex (to share it across
+      metrics).
     :param tuple group_funcs: Name and function to apply on metric. Example: (('MEAN', func_wa),)). Note, the function
       has special requirements in terms of i/o. See the definition to func_wa and use it as a template.
     :param map_clusters: list of list of int: See func_map()
+    :param slice_sums: SliceSums of metric and mask, if they were already computed (see extract_metric_multilabel())
     :return: Aggregated metric
     """
     # If user neither specified slices nor levels, set perslice=True, otherwise, the output will likely contain nan
@@ -240,9 +425,12 @@ def aggregate_per_slice_or_level(metric, mask=None, slices=[], levels=[], persli
 
     # aggregation based on levels
     if levels:
-        im_vert_level = Image(vert_level).change_orientation('RPI')
+        if isinstance(vert_level, VertLevelIndex):
+            vert_level_index = vert_level
+        else:
+            vert_level_index = VertLevelIndex(Image(vert_level).change_orientation('RPI'))
         # slicegroups = [(0, 1, 2), (3, 4, 5), (6, 7, 8)]
-        slicegroups = [tuple(get_slices_from_vertebral_levels(im_vert_level, level)) for level in levels]
+        slicegroups = [tuple(vert_level_index.get_slices(level)) for level in levels]
         if perlevel:
             # vertgroups = [(2,), (3,), (4,)]
             vertgroups = [tuple([level]) for level in levels]
@@ -250,7 +438,7 @@ def aggregate_per_slice_or_level(metric, mask=None, slices=[], levels=[], persli
             # slicegroups = [(0,), (1,), (2,), (3,), (4,), (5,), (6,), (7,), (8,)]
             slicegroups = [tuple([i]) for i in functools.reduce(operator.concat, slicegroups)]  # reduce to individual tuple
             # vertgroups = [(2,), (2,), (2,), (3,), (3,), (3,), (4,), (4,), (4,)]
-            vertgroups = [tuple([get_vertebral_level_from_slice(im_vert_level, i[0])]) for i in slicegroups]
+            vertgroups = [tuple([vert_level_index.get_level(i[0])]) for i in slicegroups]
         # output aggregate metric across levels
         else:
             # slicegroups = [(0, 1, 2, 3, 4, 5, 6, 7, 8)]
@@ -268,6 +456,29 @@ def aggregate_per_slice_or_level(metric, mask=None, slices=[], levels=[], persli
             slicegroups = [tuple(slices)]
     agg_metric = dict((slicegroup, dict()) for slicegroup in slicegroups)
 
+    # Per-slice sums shared by all slice groups, for the functions that can be derived from them
+    if slice_sums is None and any(SliceSums.supports(func) for _, func in group_funcs):
+        try:
+            slice_sums = SliceSums.from_arrays(
+                metric.data, None if mask is None else mask.data,
+                normal_equations=any(func in (func_ml, func_map) for _, func in group_funcs))
+        except Exception:
+            # eg: inconsistent dimensions or non-numeric data: the error is reported for each slice group below
+            pass
+
+    # ML and MAP estimations are solved for all the slice groups at once
+    estimates = {}
+    for _, func in group_funcs:
+        if func in (func_ml, func_map) and slice_sums is not None and slice_sums.handles(func):
+            slicegroups_func = [slicegroup for slicegroup in slicegroups if slice_sums.contains(slicegroup)
+                                and slice_sums.reduce('total', slicegroup) != 0]
+            try:
+                estimates[func] = dict(zip(slicegroups_func,
+                                           slice_sums.estimate(func, slicegroups_func, map_clusters)))
+            except Exception:
+                # the error is reported for each slice group below
+                pass
+
     # loop across slice group
     for slicegroup in slicegroups:
         # add level info
@@ -277,6 +488,23 @@ def aggregate_per_slice_or_level(metric, mask=None, slices=[], levels=[], persli
             agg_metric[slicegroup]['VertLevel'] = vertgroups[slicegroups.index(slicegroup)]
         # Loop across functions (e.g.: MEAN, STD)
         for (name, func) in group_funcs:
+            if slice_sums is not None and slice_sums.handles(func) and slice_sums.contains(slicegroup) \
+                    and (func not in (func_ml, func_map) or func in estimates):
+                if mask is not None:
+                    agg_metric[slicegroup]['Label'] = mask.label
+                    agg_metric[slicegroup]['Size [vox]'] = slice_sums.reduce('size', slicegroup)
+                try:
+                    if func in estimates:
+                        result = estimates[func].get(slicegroup)
+                    else:
+                        result = slice_sums.aggregate(func, slicegroup)
+                    if result is not None and np.isnan(result):
+                        result = None
+                    agg_metric[slicegroup]['{}({})'.format(name, metric.label)] = result
+                except Exception as e:
+                    logging.warning(e)
+                    agg_metric[slicegroup]['{}({})'.format(name, metric.label)] = str(e)
+                continue
             try:
                 data_slicegroup = metric.data[..., slicegroup]  # selection is done in the last dimension
                 if mask is not None:
@@ -419,6 +647,94 @@ def extract_metric(data, labels=None, slices=None, levels=None, perslice=True, p
                                         map_clusters=map_clusters)
 
 
+def extract_metric_multilabel(data, labels, slices=None, levels=None, perslice=True, perlevel=False, vert_level=None,
+                              method='wa', label_struc=None, ids_label=None):
+    """
+    Extract metric within several labels at once. Equivalent to calling extract_metric() for each label, for methods
+    that don't need the other labels ('wa', 'bin', 'max'): the labels are stored in a sparse (voxel x label) matrix, and
+    the per-slice sums of all labels (see SliceSums) are accumulated over its nonzero entries.
+    :param data: Class Metric(): Data (a.k.a. metric) of n-dimension to extract aggregated value from
+    :param labels: (n+1)d-array: Labels. The last dim encloses the labels. Can also be a scipy sparse matrix
+        (voxel x label), voxels being in C order (eg: packed_labels.PackedLabels.matrix()).
+    :param slices, levels, perslice, perlevel, vert_level: see aggregate_per_slice_or_level()
+    :param method: {'wa', 'bin', 'max'}
+    :param label_struc: LabelStruc class defined above
+    :param ids_label: list of int: IDs of labels to select
+    :return: list of aggregate_per_slice_or_level(), one per label
+    """
+    from scipy import sparse
+
+    group_funcs = {'wa': (('WA', func_wa), ('STD', func_std)),
+                   'bin': (('BIN', func_bin), ('STD', func_std)),
+                   'max': (('MAX', func_max),)}[method]
+    nz = data.data.shape[-1]
+    n_vox = data.data.size
+    if sparse.issparse(labels):
+        if labels.shape[0] != n_vox:
+            raise ValueError("Labels have {} voxels, expected {}".format(labels.shape[0], n_vox))
+        matrix_labels = labels.tocsc().astype(np.float64)
+    else:
+        matrix_labels = None
+    if any(not -nz <= i < nz for i in (slices or [])) or \
+            (matrix_labels is None and labels.shape[:-1] != data.data.shape):
+        if matrix_labels is not None:
+            labels = matrix_labels.toarray().reshape(data.data.shape + (-1,))
+        # errors are reported for each label, as in extract_metric()
+        return [extract_metric(data, labels=labels, slices=slices, levels=levels, perslice=perslice,
+                               perlevel=perlevel, vert_level=vert_level, method=method, label_struc=label_struc,
+                               id_label=id_label) for id_label in ids_label]
+
+    # Sparse matrix of weights: (voxel x label), then (voxel x selected label), combined labels being sums of labels
+    if matrix_labels is None:
+        matrix_labels = sparse.csc_matrix(labels.reshape(n_vox, labels.shape[-1]), dtype=np.float64)
+    matrix_selection = sparse.lil_matrix((matrix_labels.shape[1], len(ids_label)))
+    for k, id_label in enumerate(ids_label):
+        ids = label_struc[id_label].id
+        for i in (ids if isinstance(ids, list) else [ids]):
+            matrix_selection[i, k] += 1
+    weights = (matrix_labels * matrix_selection.tocsc()).tocoo()
+
+    # Per-slice sums for all labels, accumulated over the nonzero weights only (no (slice x voxel) matrix)
+    values = data.data.reshape(n_vox)
+    finite = np.isfinite(values)
+    values = np.where(finite, values, 0.).astype(np.float64)
+    values_shifted = (values - _finite_mean(values, finite)) * finite
+    n_label = len(ids_label)
+    rows, vals = weights.row, weights.data
+    index = (rows % nz) * n_label + weights.col  # the last dimension is the slices
+    vals_bin = (vals >= 0.5) * 1.
+
+    def _slice_sums(w, v=None):
+        return np.bincount(index, weights=w if v is None else w * v[rows], minlength=nz * n_label).reshape(nz, n_label)
+
+    size = _slice_sums(vals)
+    weight, weight_bin = _slice_sums(vals, finite), _slice_sums(vals_bin, finite)
+    wsum, wsum_bin = _slice_sums(vals, values), _slice_sums(vals_bin, values)
+    wsum_shifted, wsum2_shifted = _slice_sums(vals, values_shifted), _slice_sums(vals, values_shifted ** 2)
+    values = values.reshape(-1, nz)
+    values_sum, values_max = values.sum(axis=0), values.max(axis=0)
+
+    list_agg_metric = []
+    for k, id_label in enumerate(ids_label):
+        slice_sums = SliceSums({
+            'size': size[:, k],
+            'total': weight[:, k],
+            'weight': weight[:, k],
+            'weight_bin': weight_bin[:, k],
+            'wsum': wsum[:, k],
+            'wsum_bin': wsum_bin[:, k],
+            'wsum_shifted': wsum_shifted[:, k],
+            'wsum2_shifted': wsum2_shifted[:, k],
+            'sum': values_sum,
+            'max': values_max,
+        })
+        list_agg_metric.append(
+            aggregate_per_slice_or_level(data, mask=Metric(label=label_struc[id_label].name), slices=slices,
+                                         levels=levels, perslice=perslice, perlevel=perlevel, vert_level=vert_level,
+                                         group_funcs=group_funcs, slice_sums=slice_sums))
+    return list_agg_metric
+
+
 def make_a_string(item):
     """Convert tuple or list or None to a string. Important: elements in tuple or list are separated with ; (not ,)
     for compatibility with csv."""
@@ -0,0 +1,251 @@
+#!/usr/bin/env python
+# -*- coding: utf-8
+# Cache of processing steps, shared across runs
+#
+# The outputs of a step (straightening, registration step, segmentation...) are stored in a content-addressed store,
+# keyed by the content of the step's input files and by its parameters. Re-running a pipeline where only some
+# inputs/parameters changed only recomputes the affected steps.
+#
+# The store is size-bounded: the least recently used entries are evicted.
+#
+# Environment variables:
+#
+# - SCT_CACHE: set to 0 to disable the cache
+# - SCT_CACHE_DIR: location of the store (default: ~/.cache/spinalcordtoolbox/steps)
+# - SCT_CACHE_SIZE: maximum size of the store, in MB (default: 4096)
+
+from __future__ import absolute_import
+
+import os
+import io
+import json
+import errno
+import shutil
+import hashlib
+import logging
+import tempfile
+
+from spinalcordtoolbox.utils import __version__
+
+logger = logging.getLogger(__name__)
+
+# Hashes of input files, indexed by (path, size, mtime), to avoid reading files several times
+_file_hashes = {}
+
+
+def hash_file(path):
+    """
+    :return: sha256 of the file content (hex string)
+    """
+    st = os.stat(path)
+    key = (os.path.abspath(path), st.st_size, st.st_mtime)
+    if key not in _file_hashes:
+        h = hashlib.sha256()
+        with io.open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                h.update(chunk)
+        _file_hashes[key] = h.hexdigest()
+    return _file_hashes[key]
+
+
+class StepCache(object):
+    """
+    Content-addressed, size-bounded store of step outputs.
+
+    Example:
+
+    .. code:: python
+
+       with get_step_cache().step("straightening", input_files=[fname_seg], params={"algo": "bspline"},
+                                  outputs=["warp_curve2straight.nii.gz", "straight_ref.nii.gz"]) as step:
+           if not step.cached:
+               straighten(fname_seg)  # produces the outputs
+
+    If the outputs are only known once the step has run, set `step.outputs` (and optionally `step.result`, any JSON
+    serializable value returned to the next callers) in the body. Outputs are restored at the same path (relative to
+    the working directory if it's a relative path).
+    Nothing is stored if the body raises an exception.
+    """
+    def __init__(self, path, max_size=4096 * 1024 * 1024, enabled=True):
+        """
+        :param path: folder of the store
+        :param max_size: maximum size of the store, in bytes
+        :param enabled: if False, steps are never cached
+        """
+        self.path = path
+        self.max_size = max_size
+        self.enabled = enabled
+
+    def key(self, name, input_files=(), params=None):
+        """
+        :return: key of a step (hex string)
+        """
+        h = hashlib.sha256()
+        h.update(json.dumps([__version__, name, params], sort_keys=True, default=repr).encode("utf-8"))
+        for path in input_files:
+            h.update(hash_file(path).encode("utf-8"))
+        return h.hexdigest()
+
+    def _path_entry(self, key):
+        return os.path.join(self.path, key[:2], key)
+
+    def fetch(self, key, outputs=None):
+        """
+        Copy the outputs of a cached step.
+        :param key: key of the step
+        :param outputs: destination paths of the outputs (default: paths they were stored with)
+        :return: manifest of the entry (dict with "outputs", "result" and "size"), or None if it is not cached
+        """
+        if not self.enabled:
+            return None
+        path_entry = self._path_entry(key)
+        path_manifest = os.path.join(path_entry, "manifest.json")
+        try:
+            with io.open(path_manifest, "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+            if outputs is None:
+                outputs = manifest["outputs"]
+            if len(outputs) != len(manifest["outputs"]):
+                return None
+            for i, path_out in enumerate(outputs):
+                shutil.copyfile(os.path.join(path_entry, str(i)), path_out)
+            os.utime(path_manifest, None)  # mark as recently used
+        except (IOError, OSError, ValueError) as e:
+            if getattr(e, "errno", None) != errno.ENOENT:
+                logger.warning("Could not use cache entry {}: {}".format(path_entry, e))
+            return None
+        return manifest
+
+    def store(self, key, outputs, result=None, evict=True):
+        """
+        Store the outputs of a step, then evict old entries if the store is too big.
+        :param key: key of the step
+        :param outputs: paths of the output files
+        :param result: JSON serializable value stored with the outputs
+        :param evict: if False, old entries are not evicted (call evict() once many entries are stored)
+        """
+        if not self.enabled:
+            return
+        size = sum(os.path.getsize(p) for p in outputs)
+        if result is not None:
+            # entries can hold a result only (eg: per-slice properties)
+            size += len(json.dumps(result))
+        if size > self.max_size:
+            return
+        path_entry = self._path_entry(key)
+        if os.path.exists(path_entry):
+            return
+        if not os.path.isdir(os.path.dirname(path_entry)):
+            try:
+                os.makedirs(os.path.dirname(path_entry))
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+        # Write in a temporary folder, moved atomically, so that concurrent processes never see partial entries
+        path_tmp = tempfile.mkdtemp(prefix="tmp-", dir=os.path.dirname(path_entry))
+        try:
+            for i, path_out in enumerate(outputs):
+                shutil.copyfile(path_out, os.path.join(path_tmp, str(i)))
+            with io.open(os.path.join(path_tmp, "manifest.json"), "w", encoding="utf-8") as f:
+                f.write(u"{}".format(json.dumps({"outputs": list(outputs), "result": result, "size": size})))
+            os.rename(path_tmp, path_entry)
+        except OSError:
+            # another process stored the same step
+            pass
+        finally:
+            if os.path.exists(path_tmp):
+                shutil.rmtree(path_tmp)
+        if evict:
+            self.evict()
+
+    def entries(self):
+        """
+        :return: list of (last use time, size, path) of the entries of the store
+        """
+        res = []
+        if not os.path.isdir(self.path):
+            return res
+        for prefix in os.listdir(self.path):
+            path_prefix = os.path.join(self.path, prefix)
+            if not os.path.isdir(path_prefix):
+                continue
+            for key in os.listdir(path_prefix):
+                path_manifest = os.path.join(path_prefix, key, "manifest.json")
+                try:
+                    with io.open(path_manifest, "r", encoding="utf-8") as f:
+                        size = json.load(f)["size"]
+                    res.append((os.path.getmtime(path_manifest), size, os.path.join(path_prefix, key)))
+                except (IOError, OSError, ValueError, KeyError):
+                    pass
+        return res
+
+    def evict(self, max_size=None):
+        """
+        Remove the least recently used entries, until the store is smaller than `max_size` (default: self.max_size)
+        """
+        max_size = self.max_size if max_size is None else max_size
+        entries = sorted(self.entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, path_entry in entries:
+            if total <= max_size:
+                break
+            shutil.rmtree(path_entry, ignore_errors=True)
+            total -= size
+
+    def step(self, name, input_files=(), params=None, outputs=None):
+        """
+        :param name: name of the step
+        :param input_files: files the step depends on
+        :param params: parameters the step depends on (JSON serializable)
+        :param outputs: output files of the step (can also be set in the body of the with statement)
+        :return: context manager, see class documentation
+        """
+        return CachedStep(self, name, input_files, params, outputs)
+
+
+class CachedStep(object):
+    """
+    Context manager returned by :meth:`StepCache.step`.
+
+    :ivar cached: True if the outputs were restored from the cache (the step must not be run)
+    :ivar outputs: output files of the step
+    :ivar result: value stored with the outputs
+    """
+    def __init__(self, cache, name, input_files, params, outputs):
+        self.cache = cache
+        self.name = name
+        self.outputs = outputs
+        self.result = None
+        self.cached = False
+        self.key = cache.key(name, input_files, params) if cache.enabled else None
+
+    def __enter__(self):
+        if self.key is not None:
+            manifest = self.cache.fetch(self.key, self.outputs)
+            if manifest is not None:
+                logger.info("Reusing cached outputs of step {}".format(self.name))
+                self.cached = True
+                self.outputs = self.outputs or manifest["outputs"]
+                self.result = manifest["result"]
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if exc_type is None and self.key is not None and not self.cached and self.outputs:
+            try:
+                self.cache.store(self.key, self.outputs, self.result)
+            except (IOError, OSError) as e:
+                logger.warning("Could not cache step {}: {}".format(self.name, e))
+        return False
+
+
+def get_step_cache():
+    """
+    :return: step cache configured by the environment (see module documentation)
+    """
+    path = os.environ.get("SCT_CACHE_DIR", None)
+    if path is None:
+        path = os.path.join(os.environ.get("XDG_CACHE_HOME", os.path.expanduser(os.path.join("~", ".cache"))),
+                            "spinalcordtoolbox", "steps")
+    max_size = int(float(os.environ.get("SCT_CACHE_SIZE", 4096)) * 1024 * 1024)
+    enabled = os.environ.get("SCT_CACHE", "1") != "0"
+    return StepCache(path, max_size=max_size, enabled=enabled)
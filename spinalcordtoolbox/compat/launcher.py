@@ -1,7 +1,9 @@
 #!/usr/bin/env python
 # Compatibility layer to launch old scripts
 
-import sys, os, subprocess, multiprocessing
+import sys, os, subprocess
+
+from spinalcordtoolbox import cpu
 
 def main():
 	"""
@@ -16,19 +18,32 @@ def main():
 		# No DISPLAY, set suitable default matplotlib backend as pyplot is used
 		env["MPLBACKEND"] = "Agg"
 
-	if "ITK_GLOBAL_DEFAULT_NUMBER_OF_THREADS" not in os.environ:
-		env["ITK_GLOBAL_DEFAULT_NUMBER_OF_THREADS"] = str(multiprocessing.cpu_count())
+	# CPU budget of the command (SCT_NCPU), applied to ITK, OpenMP and BLAS threads
+	env = cpu.thread_env(env=env)
+
+	args = sys.argv[1:]
+	if "--trace" in args[:-1]:
+		# Record a timing/memory trace of the command (see spinalcordtoolbox.trace)
+		i = args.index("--trace")
+		env["SCT_TRACE"] = os.path.abspath(args[i+1])
+		args = args[:i] + args[i+2:]
 
 	command = os.path.basename(sys.argv[0])
 	sct_dir = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
 	script = os.path.join(sct_dir, "scripts", "{}.py".format(command))
 	assert os.path.exists(script)
-	cmd = [sys.executable, script] + sys.argv[1:]
+	cmd = [sys.executable, script] + args
 
 	mpi_flags = os.environ.get("SCT_MPI_MODE", None)
 	if mpi_flags is not None:
 		if mpi_flags == "yes": # compat
 			mpi_flags = "-n 1"
 		cmd = ["mpiexec"] + mpi_flags.split() + cmd
+	elif command != "sct_server":
+		# Forward the command to the sct_server daemon, if it is running
+		from spinalcordtoolbox import server
+		status = server.forward(command, args, env=env)
+		if status is not None:
+			sys.exit(status)
 
 	os.execvpe(cmd[0], cmd[0:], env)
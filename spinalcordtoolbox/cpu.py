@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+# -*- coding: utf-8
+# CPU budget shared by nested SCT commands
+#
+# The number of CPUs a command may use is set by the environment variable SCT_NCPU (default: all the CPUs of the
+# machine). It is propagated to everything that runs threads: ITK (ANTs binaries), OpenMP/BLAS, TensorFlow and
+# SCT process pools. A command running N parallel workers splits its budget between them (see split()), so nested
+# parallelism never uses more than the allotted CPUs.
+#
+# This module is used by the launcher, so it must not import heavy modules.
+
+from __future__ import absolute_import
+
+import os
+import contextlib
+import multiprocessing
+
+# Environment variables setting the number of threads of the libraries used by SCT
+THREAD_ENV_VARS = (
+ "ITK_GLOBAL_DEFAULT_NUMBER_OF_THREADS",
+ "OMP_NUM_THREADS",
+ "OPENBLAS_NUM_THREADS",
+ "MKL_NUM_THREADS",
+)
+
+
+# Whether the threads of TensorFlow have been configured, see configure_keras()
+_keras_configured = False
+
+
+def get_ncpu():
+    """
+    :return: number of CPUs allotted to this process: $SCT_NCPU, or the number of CPUs of the machine
+    """
+    ncpu = os.environ.get("SCT_NCPU", None)
+    if ncpu is not None:
+        try:
+            return max(1, int(ncpu))
+        except ValueError:
+            pass
+    return multiprocessing.cpu_count()
+
+
+def thread_env(ncpu=None, env=None):
+    """
+    Environment of a process allotted `ncpu` CPUs: SCT_NCPU and the number of threads of the libraries.
+    Thread counts set lower by the user are kept.
+    :param ncpu: number of CPUs (default: get_ncpu())
+    :param env: base environment (default: os.environ)
+    :return: new environment (dict)
+    """
+    ncpu = get_ncpu() if ncpu is None else ncpu
+    env = dict(os.environ if env is None else env)
+    env["SCT_NCPU"] = str(ncpu)
+    for name in THREAD_ENV_VARS:
+        try:
+            if 0 < int(env.get(name, "")) <= ncpu:
+                continue
+        except ValueError:
+            pass
+        env[name] = str(ncpu)
+    return env
+
+
+def pool_size(jobs=None):
+    """
+    :param jobs: number of parallel jobs requested (default: as many as possible)
+    :return: number of workers that fits in the CPU budget
+    """
+    ncpu = get_ncpu()
+    return ncpu if not jobs or jobs <= 0 else min(int(jobs), ncpu)
+
+
+@contextlib.contextmanager
+def split(nb_workers):
+    """
+    Split the CPU budget of this process between `nb_workers` parallel workers.
+    While in the context, os.environ is the environment of one worker (processes started in the context, including
+    the workers of process pools, inherit it), and the budget of this process is one share.
+
+    Example:
+
+    .. code:: python
+
+       nb_workers = cpu.pool_size(jobs)
+       with cpu.split(nb_workers):
+           pool = multiprocessing.Pool(nb_workers)
+           ...
+
+    :param nb_workers: number of parallel workers
+    :return: number of CPUs of each worker
+    """
+    share = max(1, get_ncpu() // max(1, nb_workers))
+    saved = dict((name, os.environ.get(name, None)) for name in ("SCT_NCPU",) + THREAD_ENV_VARS)
+    env = thread_env(share)
+    for name in saved:
+        os.environ[name] = env[name]
+    try:
+        yield share
+    finally:
+        for name, value in saved.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+
+def configure_keras():
+    """
+    Limit the threads of the TensorFlow backend of Keras to the CPU budget. Must be called before models are created;
+    only the first call has an effect (models already loaded are bound to the TensorFlow session).
+    """
+    global _keras_configured
+    if _keras_configured:
+        return
+    _keras_configured = True
+    ncpu = get_ncpu()
+    import tensorflow as tf
+    if hasattr(tf, "ConfigProto"):
+        # TensorFlow 1.x
+        from keras import backend as K
+        config = tf.ConfigProto(intra_op_parallelism_threads=ncpu, inter_op_parallelism_threads=1)
+        K.set_session(tf.Session(config=config))
+    else:
+        tf.config.threading.set_intra_op_parallelism_threads(ncpu)
+        tf.config.threading.set_inter_op_parallelism_threads(1)
@@ -32,9 +32,10 @@ except Exception as e:
 else:
     sys.stderr = original_stderr
 
-from spinalcordtoolbox import resampling
+from spinalcordtoolbox import resampling, cpu
 from . import model
-from ..utils import __data_dir__
+from ..utils import __data_dir__, get_resident
+from ..trace import traced
 
 
 # Suppress warnings and TensorFlow logging
@@ -200,6 +201,7 @@ def threshold_predictions(predictions, thr=0.999):
     return thresholded_preds
 
 
+@traced(cat="deepseg")
 def segment_volume(ninput_volume, model_name,
                    threshold=0.999, use_tta=False):
     """Segment a nifti volume.
@@ -211,6 +213,7 @@ def segment_volume(ninput_volume, model_name,
                     should be used or not.
     :return: segmented slices.
     """
+    cpu.configure_keras()
     gmseg_model_challenge = DataResource('deepseg_gm_models')
     model_path, metadata_path = model.MODELS[model_name]
 
@@ -228,11 +231,16 @@ def segment_volume(ninput_volume, model_name,
         # larger sizer, crop at 200x200
         net_input_size = (SMALL_INPUT_SIZE, SMALL_INPUT_SIZE)
 
-    deepgmseg_model = model.create_model(metadata['filters'],
-                                         net_input_size)
-
     model_abs_path = gmseg_model_challenge.get_file_path(model_path)
-    deepgmseg_model.load_weights(model_abs_path)
+
+    def load_model():
+        deepgmseg_model = model.create_model(metadata['filters'],
+                                             net_input_size)
+        deepgmseg_model.load_weights(model_abs_path)
+        return deepgmseg_model
+
+    deepgmseg_model = get_resident(('deepseg_gm', model_abs_path, tuple(net_input_size)), load_model,
+                                   files=[model_abs_path, metadata_abs_path])
 
     volume_data = ninput_volume.get_data()
     axial_slices = []
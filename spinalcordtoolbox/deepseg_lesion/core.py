@@ -13,7 +13,9 @@ import sct_utils as sct
 import spinalcordtoolbox.image as msct_image
 from spinalcordtoolbox.image import Image
 from spinalcordtoolbox.deepseg_sc.core import find_centerline, crop_image_around_centerline, uncrop_image, _normalize_data
-from spinalcordtoolbox import resampling
+from spinalcordtoolbox import resampling, cpu
+from spinalcordtoolbox.utils import get_resident
+from spinalcordtoolbox.trace import traced
 
 logger = logging.getLogger(__name__)
 
@@ -74,6 +76,7 @@ def apply_intensity_normalization(img, contrast):
     return img_normalized
 
 
+@traced(cat="deepseg")
 def segment_3d(model_fname, contrast_type, im):
     """Perform segmentation with 3D convolutions."""
     from spinalcordtoolbox.deepseg_sc.cnn_models_3d import load_trained_model
@@ -82,7 +85,8 @@ def segment_3d(model_fname, contrast_type, im):
                     't2s': {'size': (48, 48, 48), 'mean': 1011.31, 'std': 678.985}}
 
     # load 3d model
-    seg_model = load_trained_model(model_fname)
+    seg_model = get_resident(('deepseg_lesion_3d', model_fname), lambda: load_trained_model(model_fname),
+                             files=[model_fname])
 
     out_data = np.zeros(im.data.shape)
 
@@ -125,6 +129,7 @@ def deep_segmentation_MSlesion(im_image, contrast_type, ctr_algo='svm', ctr_file
     :param remove_temp_files:
     :return:
     """
+    cpu.configure_keras()
 
     # create temporary folder with intermediate results
     tmp_folder = sct.TempFolder(verbose=verbose)
@@ -10,7 +10,9 @@ from skimage.exposure import rescale_intensity
 from scipy.ndimage import distance_transform_edt
 import nibabel as nib
 
-from spinalcordtoolbox import resampling
+from spinalcordtoolbox import resampling, cpu
+from spinalcordtoolbox.utils import get_resident
+from spinalcordtoolbox.trace import traced
 from .cnn_models import nn_architecture_seg, nn_architecture_ctr
 from .postprocessing import post_processing_volume_wise, post_processing_slice_wise
 from spinalcordtoolbox.image import Image, empty_like, change_type, zeros_like
@@ -71,18 +73,23 @@ def find_centerline(algo, image_fname, contrast_type, brain_bool, folder_output,
 
         # load model
         ctr_model_fname = os.path.join(sct.__sct_dir__, 'data', 'deepseg_sc_models', '{}_ctr.h5'.format(contrast_type))
-        ctr_model = nn_architecture_ctr(height=dct_patch_ctr[contrast_type]['size'][0],
-                                        width=dct_patch_ctr[contrast_type]['size'][1],
-                                        channels=1,
-                                        classes=1,
-                                        features=dct_params_ctr[contrast_type]['features'],
-                                        depth=2,
-                                        temperature=1.0,
-                                        padding='same',
-                                        batchnorm=True,
-                                        dropout=0.0,
-                                        dilation_layers=dct_params_ctr[contrast_type]['dilation_layers'])
-        ctr_model.load_weights(ctr_model_fname)
+
+        def load_ctr_model():
+            ctr_model = nn_architecture_ctr(height=dct_patch_ctr[contrast_type]['size'][0],
+                                            width=dct_patch_ctr[contrast_type]['size'][1],
+                                            channels=1,
+                                            classes=1,
+                                            features=dct_params_ctr[contrast_type]['features'],
+                                            depth=2,
+                                            temperature=1.0,
+                                            padding='same',
+                                            batchnorm=True,
+                                            dropout=0.0,
+                                            dilation_layers=dct_params_ctr[contrast_type]['dilation_layers'])
+            ctr_model.load_weights(ctr_model_fname)
+            return ctr_model
+
+        ctr_model = get_resident(('deepseg_sc_ctr', ctr_model_fname), load_ctr_model, files=[ctr_model_fname])
 
         # compute the heatmap
         im_heatmap, z_max = heatmap(im=im,
@@ -221,6 +228,7 @@ def scan_slice(z_slice, model, mean_train, std_train, coord_lst, patch_shape, z_
     return z_slice_out, x_CoM, y_CoM, coord_lst
 
 
+@traced(cat="deepseg")
 def heatmap(im, model, patch_shape, mean_train, std_train, brain_bool=True):
     """Compute the heatmap with CNN_1 representing the SC localization."""
     data_im = im.data.astype(np.float32)
@@ -327,15 +335,20 @@ def _normalize_data(data, mean, std):
     return data
 
 
+@traced(cat="deepseg")
 def segment_2d(model_fname, contrast_type, input_size, im_in):
     """Segment data using 2D convolutions."""
-    seg_model = nn_architecture_seg(height=input_size[0],
-                                    width=input_size[1],
-                                    depth=2 if contrast_type != 't2' else 3,
-                                    features=32,
-                                    batchnorm=False,
-                                    dropout=0.0)
-    seg_model.load_weights(model_fname)
+    def load_seg_model():
+        seg_model = nn_architecture_seg(height=input_size[0],
+                                        width=input_size[1],
+                                        depth=2 if contrast_type != 't2' else 3,
+                                        features=32,
+                                        batchnorm=False,
+                                        dropout=0.0)
+        seg_model.load_weights(model_fname)
+        return seg_model
+
+    seg_model = get_resident(('deepseg_sc_2d', model_fname, tuple(input_size)), load_seg_model, files=[model_fname])
 
     seg_crop = zeros_like(im_in, dtype=np.uint8)
 
@@ -371,6 +384,7 @@ def uncrop_image(ref_in, data_crop, x_crop_lst, y_crop_lst, z_crop_lst):
     return seg_unCrop
 
 
+@traced(cat="deepseg")
 def segment_3d(model_fname, contrast_type, im_in):
     """Perform segmentation with 3D convolutions."""
     from spinalcordtoolbox.deepseg_sc.cnn_models_3d import load_trained_model
@@ -378,7 +392,8 @@ def segment_3d(model_fname, contrast_type, im_in):
                        't2s': {'size': (96, 96, 48), 'mean': 87.0212, 'std': 64.425},
                        't1': {'size': (64, 64, 48), 'mean': 88.5001, 'std': 66.275}}
     # load 3d model
-    seg_model = load_trained_model(model_fname)
+    seg_model = get_resident(('deepseg_sc_3d', model_fname), lambda: load_trained_model(model_fname),
+                             files=[model_fname])
 
     out = zeros_like(im_in, dtype=np.uint8)
 
@@ -419,6 +434,8 @@ def segment_3d(model_fname, contrast_type, im_in):
 def deep_segmentation_spinalcord(im_image, contrast_type, ctr_algo='cnn', ctr_file=None, brain_bool=True,
                                  kernel_size='2d', remove_temp_files=1, verbose=1):
     """Pipeline"""
+    cpu.configure_keras()
+
     # create temporary folder with intermediate results
     tmp_folder = sct.TempFolder(verbose=verbose)
     tmp_folder_path = tmp_folder.get_path()
@@ -453,8 +470,10 @@ def deep_segmentation_spinalcord(im_image, contrast_type, ctr_algo='cnn', ctr_fi
                                                     centerline_fname=file_ctr)
 
     if ctr_algo == 'file':
+        # Only the neighborhood of the centerline is resampled, on the same grid as the image
         im_ctl = \
-            resampling.resample_nib(im_ctl, new_size=[0.5, 0.5, im_image.dim[6]], new_size_type='mm', interpolation='linear')
+            resampling.resample_nib(im_ctl, new_size=[0.5, 0.5, im_image.dim[6]], new_size_type='mm',
+                                    interpolation='linear', roi=im_ctl, roi_margin=1., roi_crop=False)
 
     # crop image around the spinal cord centerline
     logger.info("Cropping the image around the spinal cord...")
@@ -499,9 +518,10 @@ def deep_segmentation_spinalcord(im_image, contrast_type, ctr_algo='cnn', ctr_fi
 
     # Change type uint8 --> float32 otherwise resampling will produce binary output (even with linear interpolation)
     im_seg.change_type(np.float32)
-    # resample to initial resolution
+    # resample to initial resolution (the segmentation is zero away from the cord: only its neighborhood is resampled)
     logger.info("Resampling the segmentation to the native image resolution using linear interpolation...")
-    im_seg_r = resampling.resample_nib(im_seg, image_dest=im_image, interpolation='linear')
+    im_seg_r = resampling.resample_nib(im_seg, image_dest=im_image, interpolation='linear',
+                                       roi=im_seg, roi_margin=1., roi_crop=False)
 
     if ctr_algo == 'viewer':  # for debugging
         im_labels_viewer.save(sct.add_suffix(fname_orient, '_labels-viewer'))
@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+# -*- coding: utf-8
+# Multi-threaded gzip writer, used to save .nii.gz files
+
+from __future__ import absolute_import
+
+import io
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+from spinalcordtoolbox.cpu import get_ncpu
+
+# Default compression levels: fast for intermediate files, max for final outputs
+COMPRESSION_LEVEL_TMP = 1
+COMPRESSION_LEVEL_FINAL = 9
+
+
+def _compress_block(block, level):
+    """
+    :return: block compressed as a complete gzip member
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(block) + compressor.flush()
+
+
+class ParallelGzipWriter(io.RawIOBase):
+    """
+    Write-only file object producing a gzip stream, whose blocks are compressed in parallel.
+
+    The written bytes are cut into blocks of `block_size` bytes, each block being compressed as an
+    independent gzip member. Per RFC 1952, the concatenation of gzip members is a valid gzip file
+    (readable by nibabel, python's gzip, zlib's gzread, ITK, FSL...).
+    zlib releases the GIL while compressing, so threads are enough to use several cores.
+    Memory usage is bounded: at most 2 blocks per thread are pending.
+
+    Example:
+
+    .. code:: python
+
+       with io.open("data.nii.gz", "wb") as f, ParallelGzipWriter(f, level=1) as gz:
+           gz.write(b"...")
+
+    """
+    def __init__(self, fileobj, level=COMPRESSION_LEVEL_FINAL, nb_threads=None, block_size=4 * 1024 * 1024):
+        """
+        :param fileobj: binary file object to write the compressed stream to
+        :param level: zlib compression level, from 1 (fastest) to 9 (smallest)
+        :param nb_threads: number of compression threads (default: CPU budget, see spinalcordtoolbox.cpu)
+        :param block_size: size of the (uncompressed) blocks, in bytes
+        """
+        super(ParallelGzipWriter, self).__init__()
+        self._fileobj = fileobj
+        self._level = level
+        self._block_size = block_size
+        self._nb_threads = nb_threads or get_ncpu()
+        self._executor = ThreadPoolExecutor(max_workers=self._nb_threads)
+        self._pending = []
+        self._buffer = bytearray()
+        self._pos = 0
+
+    def writable(self):
+        return True
+
+    def seekable(self):
+        return False
+
+    def tell(self):
+        """
+        :return: position in the uncompressed stream
+        """
+        return self._pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        """
+        Only supports "seeking" to the current position (nibabel does that before writing)
+        """
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence != io.SEEK_SET:
+            raise io.UnsupportedOperation("Can't seek from the end of a gzip stream being written")
+        if offset != self._pos:
+            raise io.UnsupportedOperation("Can't seek in a gzip stream being written")
+        return self._pos
+
+    def write(self, data):
+        if self.closed:
+            raise ValueError("write to closed file")
+        self._buffer += data
+        self._pos += len(data)
+        while len(self._buffer) >= self._block_size:
+            block = bytes(self._buffer[:self._block_size])
+            del self._buffer[:self._block_size]
+            self._submit(block)
+        return len(data)
+
+    def _submit(self, block):
+        self._pending.append(self._executor.submit(_compress_block, block, self._level))
+        # Write finished blocks in order, and wait if too many blocks are pending (bounded memory)
+        while self._pending and (self._pending[0].done() or len(self._pending) > 2 * self._nb_threads):
+            self._fileobj.write(self._pending.pop(0).result())
+
+    def flush(self):
+        """
+        Compress and write the buffered data. Note: this ends the current gzip member.
+        """
+        if self.closed:
+            return
+        if self._buffer:
+            self._submit(bytes(self._buffer))
+            self._buffer = bytearray()
+        while self._pending:
+            self._fileobj.write(self._pending.pop(0).result())
+        self._fileobj.flush()
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            if self._pos == 0:
+                # Empty stream: still write a valid gzip file
+                self._submit(b"")
+            self.flush()
+        finally:
+            self._executor.shutdown()
+            super(ParallelGzipWriter, self).close()
@@ -13,17 +13,20 @@
 
 from __future__ import division, absolute_import
 
-import sys, os, itertools, warnings, logging
+import sys, io, os, itertools, warnings, logging, tempfile
 
 import nibabel
+import nibabel.fileholders
 import nibabel.orientations
 
 import numpy as np
 from scipy.ndimage import map_coordinates
 
 import transforms3d.affines as affines
-from spinalcordtoolbox.types import Coordinate
+from spinalcordtoolbox.types import CoordinateArray
+from spinalcordtoolbox.gzip_writer import ParallelGzipWriter, COMPRESSION_LEVEL_TMP, COMPRESSION_LEVEL_FINAL
 from spinalcordtoolbox.utils import __sct_dir__
+from spinalcordtoolbox.trace import traced
 
 sys.path.append(os.path.join(__sct_dir__, 'scripts'))
 import sct_utils as sct
@@ -52,6 +55,60 @@ def _get_permutations(im_src_orientation, im_dst_orientation):
     return perm, inversion
 
 
+def _get_mmap_filename(data):
+    """
+    :return: path of the file memory-mapped by data (or by the array it is a view of), None if there is none
+    """
+    while data is not None:
+        if isinstance(data, np.memmap) and data.filename is not None:
+            return data.filename
+        data = getattr(data, "base", None)
+    return None
+
+
+def _is_tmp_path(path):
+    """
+    :return: whether path is within a temporary folder created by sct.tmp_create()
+    """
+    tmpdir = os.path.realpath(tempfile.gettempdir())
+    path = os.path.realpath(path)
+    if not path.startswith(tmpdir + os.sep):
+        return False
+    return any(x.startswith("sct-") for x in os.path.relpath(path, tmpdir).split(os.sep)[:-1])
+
+
+def _permute_data(data, perm, inversion):
+    """
+    :param data: array whose 3 first axes are to be permuted (no copy is made)
+    :param perm: list of axes permutations, see _get_permutations()
+    :param inversion: list of axes inversions, see _get_permutations()
+    :return: a view on data, with the axes flipped and transposed
+    """
+    # axes inversion (flip)
+    data = data[::inversion[0], ::inversion[1], ::inversion[2]]
+
+    # axes manipulations (transpose)
+    if perm == [1, 0, 2]:
+        data = np.swapaxes(data, 0, 1)
+    elif perm == [2, 1, 0]:
+        data = np.swapaxes(data, 0, 2)
+    elif perm == [0, 2, 1]:
+        data = np.swapaxes(data, 1, 2)
+    elif perm == [2, 0, 1]:
+        data = np.swapaxes(data, 0, 2)  # transform [2, 0, 1] to [1, 0, 2]
+        data = np.swapaxes(data, 0, 1)  # transform [1, 0, 2] to [0, 1, 2]
+    elif perm == [1, 2, 0]:
+        data = np.swapaxes(data, 0, 2)  # transform [1, 2, 0] to [0, 2, 1]
+        data = np.swapaxes(data, 1, 2)  # transform [0, 2, 1] to [0, 1, 2]
+    elif perm == [0, 1, 2]:
+        # do nothing
+        pass
+    else:
+        raise NotImplementedError()
+
+    return data
+
+
 class Slicer(object):
     """
     Provides a sliced view onto original image data.
@@ -87,31 +144,17 @@ class Slicer(object):
 
         perm, inversion = _get_permutations(im.orientation, orientation)
 
-        # axes inversion (flip)
-        data = im.data[::inversion[0], ::inversion[1], ::inversion[2]]
-
-        # axes manipulations (transpose)
-        if perm == [1, 0, 2]:
-            data = np.swapaxes(data, 0, 1)
-        elif perm == [2, 1, 0]:
-            data = np.swapaxes(data, 0, 2)
-        elif perm == [0, 2, 1]:
-            data = np.swapaxes(data, 1, 2)
-        elif perm == [2, 0, 1]:
-            data = np.swapaxes(data, 0, 2)  # transform [2, 0, 1] to [1, 0, 2]
-            data = np.swapaxes(data, 0, 1)  # transform [1, 0, 2] to [0, 1, 2]
-        elif perm == [1, 2, 0]:
-            data = np.swapaxes(data, 0, 2)  # transform [1, 2, 0] to [0, 2, 1]
-            data = np.swapaxes(data, 1, 2)  # transform [0, 2, 1] to [0, 1, 2]
-        elif perm == [0, 1, 2]:
-            # do nothing
-            pass
-        else:
-            raise NotImplementedError()
-
-        self._data = data
+        self._perm, self._inversion = perm, inversion
         self._orientation = orientation
-        self._nb_slices = data.shape[2]
+
+        if im.is_lazy:
+            # Lazy image: slices are read from disk on demand, see __getitem__()
+            self._im = im
+            self._data = None
+            self._nb_slices = im._get_data_shape()[perm.index(2)]
+        else:
+            self._data = _permute_data(im.data, perm, inversion)
+            self._nb_slices = self._data.shape[2]
 
     def __len__(self):
        return self._nb_slices
@@ -127,6 +170,14 @@ class Slicer(object):
        if idx >= self._nb_slices:
            raise IndexError("I just have {} slices!".format(self._nb_slices))
 
+       if self._data is None:
+           # Only read the source slab corresponding to this slice, then reorient it
+           axis = self._perm.index(2)
+           idx_src = idx if self._inversion[axis] == 1 else self._nb_slices - 1 - idx
+           slicer = [slice(None)] * 3
+           slicer[axis] = slice(idx_src, idx_src + 1)
+           return _permute_data(self._im.read_slab(tuple(slicer)), self._perm, self._inversion)[:,:,0]
+
        return self._data[:,:,idx]
 
 
@@ -184,7 +235,7 @@ class SlicerOneAxis(object):
        if self.direction == -1:
            idx = self.nb_slices - 1 - idx
 
-       return self.im.data[self._slice(idx)]
+       return self.im.read_slab(self._slice(idx))
 
 
 class SlicerMany(object):
@@ -219,11 +270,18 @@ class Image(object):
 
     """
 
-    def __init__(self, param=None, hdr=None, orientation=None, absolutepath=None, dim=None, verbose=1):
+    def __init__(self, param=None, hdr=None, orientation=None, absolutepath=None, dim=None, verbose=1, lazy=False):
+        """
+        :param lazy: when loading from a file, do not read the data until it is accessed. Until then,
+                     read_slab(), Slicer, SlicerOneAxis and spatial_crop() only read the region they need.
+                     Accessing `data` loads the whole array (memory-mapped if the file is uncompressed).
+        """
         from nibabel import Nifti1Header
 
         # initialization of all parameters
+        self._metadata_cache = {}
         self.im_file = None
+        self._dataobj = None
         self.data = None
         self._path = None
         self.ext = ""
@@ -240,7 +298,7 @@ class Image(object):
 
         # load an image from file
         if isinstance(param, str) or (sys.hexversion < 0x03000000 and isinstance(param, unicode)):
-            self.loadFromPath(param, verbose)
+            self.loadFromPath(param, verbose, lazy=lazy)
         # copy constructor
         elif isinstance(param, type(self)):
             self.copy(param)
@@ -262,13 +320,67 @@ class Image(object):
         #     self.hdr.set_qform(self.hdr.get_qform(), code=0)
         #     self.header.set_qform(self.hdr.get_qform(), code=0)
 
+    @property
+    def data(self):
+        if self._data is None and self._dataobj is not None:
+            # Lazy image: load the data now. For uncompressed files, nibabel returns a (copy-on-write) memory map.
+            self._data = np.asanyarray(self._dataobj)
+            self._dataobj = None
+        return self._data
+
+    @data.setter
+    def data(self, value):
+        self._data = value
+        self._dataobj = None
+        self._metadata_cache = {}
+
+    @property
+    def is_lazy(self):
+        """
+        Whether the data is still on disk (lazy image whose `data` was not accessed yet)
+        """
+        return self._data is None and self._dataobj is not None
+
+    def _get_data_shape(self):
+        return self._dataobj.shape if self.is_lazy else self.data.shape
+
+    def read_slab(self, slicer):
+        """
+        :param slicer: tuple of slices and/or integers (basic indexing)
+        :return: the data sub-array data[slicer]. For a lazy image, only this sub-array is read from disk.
+        """
+        if self.is_lazy:
+            return self._dataobj[slicer]
+        return self.data[slicer]
+
+    def _get_metadata(self, name, func):
+        """
+        :return: func(self), cached until the header is replaced or modified, or the data is assigned
+
+        Note: header modifications are detected by comparing the binary header (a few hundred bytes),
+        which is much cheaper than decoding it, and also catches in-place modifications (eg. hdr.set_qform()).
+        """
+        key = self.hdr.binaryblock if self.hdr is not None else None
+        if self._metadata_cache.get('key') != key:
+            self._metadata_cache = {'key': key}
+        if name not in self._metadata_cache:
+            self._metadata_cache[name] = func(self)
+        return self._metadata_cache[name]
+
     @property
     def dim(self):
-        return get_dimension(self)
+        return self._get_metadata('dim', get_dimension)
 
     @property
     def orientation(self):
-        return get_orientation(self)
+        return self._get_metadata('orientation', get_orientation)
+
+    @property
+    def affine(self):
+        """
+        Voxel to world affine matrix (the "best" one, from the header's sform or qform)
+        """
+        return self._get_metadata('affine', lambda im: im.hdr.get_best_affine()).copy()
 
     @property
     def absolutepath(self):
@@ -299,6 +411,15 @@ class Image(object):
             value = os.path.abspath(value)
         self._path = value
 
+    @property
+    def hdr(self):
+        return self._hdr
+
+    @hdr.setter
+    def hdr(self, value):
+        self._hdr = value
+        self._metadata_cache = {}
+
     @property
     def header(self):
         return self.hdr
@@ -309,13 +430,19 @@ class Image(object):
 
     def __deepcopy__(self, memo):
         from copy import deepcopy
+        if self.is_lazy:
+            # The on-disk data is read-only: share it rather than loading it
+            return type(self)(self)
         return type(self)(deepcopy(self.data, memo), deepcopy(self.hdr, memo), deepcopy(self.orientation, memo), deepcopy(self.absolutepath, memo), deepcopy(self.dim, memo))
 
     def copy(self, image=None):
         from copy import deepcopy
         if image is not None:
             self.im_file = deepcopy(image.im_file)
-            self.data = deepcopy(image.data)
+            if image.is_lazy:
+                self._dataobj = image._dataobj
+            else:
+                self.data = deepcopy(image.data)
             self.hdr = deepcopy(image.hdr)
             self._path = deepcopy(image._path)
         else:
@@ -333,10 +460,12 @@ class Image(object):
         self.hdr.set_sform(im_ref.hdr.get_sform())
         self.hdr._structarr['sform_code'] = im_ref.hdr._structarr['sform_code']
 
-    def loadFromPath(self, path, verbose):
+    @traced(cat="io")
+    def loadFromPath(self, path, verbose, lazy=False):
         """
         This function load an image from an absolute path using nibabel library
         :param path: path of the file from which the image will be loaded
+        :param lazy: only keep a proxy to the on-disk data, see Image()
         :return:
         """
 
@@ -344,13 +473,17 @@ class Image(object):
             self.im_file = nibabel.load(path)
         except nibabel.spatialimages.ImageFileError:
             sct.printv('Error: make sure ' + path + ' is an image.', 1, 'error')
-        self.data = self.im_file.get_data()
+        if lazy:
+            self._data = None
+            self._dataobj = self.im_file.dataobj
+        else:
+            self.data = self.im_file.get_data()
         self.hdr = self.im_file.header
         self.absolutepath = path
         if path != self.absolutepath:
-            logger.debug("Loaded %s (%s) orientation %s shape %s", path, self.absolutepath, self.orientation, self.data.shape)
+            logger.debug("Loaded %s (%s) orientation %s shape %s", path, self.absolutepath, self.orientation, self._get_data_shape())
         else:
-            logger.debug("Loaded %s orientation %s shape %s", path, self.orientation, self.data.shape)
+            logger.debug("Loaded %s orientation %s shape %s", path, self.orientation, self._get_data_shape())
 
     def change_shape(self, shape, generate_path=False):
         """
@@ -416,7 +549,8 @@ class Image(object):
             self._path = None
         return self
 
-    def save(self, path=None, dtype=None, verbose=1, mutable=False):
+    @traced(cat="io")
+    def save(self, path=None, dtype=None, verbose=1, mutable=False, compression_level=None):
         """
         Write an image in a nifti file
 
@@ -443,6 +577,10 @@ class Image(object):
                         (2048, 'complex256', _complex256t, "NIFTI_TYPE_COMPLEX256"),
 
         :param mutable: whether to update members with newly created path or dtype
+
+        :param compression_level: zlib compression level (1: fastest, 9: smallest) when saving
+                                  a .nii.gz file. If not set, fast compression is used for files
+                                  within SCT temporary folders, and max compression otherwise.
         """
 
         if path is None and self.absolutepath is None:
@@ -467,11 +605,15 @@ class Image(object):
         if hdr:
             hdr.set_data_shape(data.shape)
 
-        # nb. that copy() is important because if it were a memory map, save()
-        # would corrupt it
-        img = Nifti1Image(data.copy(), None, hdr)
         if os.path.isfile(path):
             sct.printv('WARNING: File ' + path + ' already exists. Will overwrite it.', verbose, 'warning')
+            # nb. that copy() is important if the data is a memory map of the file to
+            # overwrite, because save() would corrupt it
+            mmap_filename = _get_mmap_filename(data)
+            if mmap_filename is not None and os.path.exists(mmap_filename) and os.path.samefile(mmap_filename, path):
+                data = data.copy()
+
+        img = Nifti1Image(data, None, hdr)
 
         # save file
         if os.path.isabs(path):
@@ -481,7 +623,14 @@ class Image(object):
             logger.debug("Saving image to %s (%s) orientation %s shape %s",
              path, os.path.abspath(path), self.orientation, data.shape)
 
-        nibabel.save(img, path)
+        if path.endswith(".gz"):
+            # Stream the data to a multi-threaded gzip writer
+            if compression_level is None:
+                compression_level = COMPRESSION_LEVEL_TMP if _is_tmp_path(path) else COMPRESSION_LEVEL_FINAL
+            with io.open(path, "wb") as f, ParallelGzipWriter(f, level=compression_level) as fileobj:
+                img.to_file_map({'image': nibabel.fileholders.FileHolder(fileobj=fileobj)})
+        else:
+            nibabel.save(img, path)
 
         if mutable:
             self.absolutepath = path
@@ -497,6 +646,7 @@ class Image(object):
         This function return all the non-zero coordinates that the image contains.
         Coordinate list can also be sorted by x, y, z, or the value with the parameter sorting='x', sorting='y', sorting='z' or sorting='value'
         If reverse_coord is True, coordinate are sorted from larger to smaller.
+        :return: CoordinateArray (which behaves as a list of Coordinate, or of CoordinateValue if coordValue is True)
         """
         n_dim = 1
         if self.dim[3] == 1:
@@ -509,70 +659,41 @@ class Image(object):
         try:
             if n_dim == 3:
                 X, Y, Z = (self.data > 0).nonzero()
-                list_coordinates = [Coordinate([X[i], Y[i], Z[i], self.data[X[i], Y[i], Z[i]]]) for i in range(0, len(X))]
+                values = self.data[X, Y, Z]
             elif n_dim == 2:
-                try:
-                    X, Y = (self.data > 0).nonzero()
-                    list_coordinates = [Coordinate([X[i], Y[i], 0, self.data[X[i], Y[i]]]) for i in range(0, len(X))]
-                except ValueError:
-                    X, Y, Z = (self.data > 0).nonzero()
-                    list_coordinates = [Coordinate([X[i], Y[i], 0, self.data[X[i], Y[i], 0]]) for i in range(0, len(X))]
+                data = self.data[:, :, 0] if self.data.ndim == 3 else self.data
+                X, Y = (data > 0).nonzero()
+                Z = np.zeros_like(X)
+                values = data[X, Y]
         except Exception as e:
             sct.printv('ERROR: Exception ' + str(e) + ' caught while geting non Zeros coordinates', 1, 'error')
 
         if coordValue:
             from spinalcordtoolbox.types import CoordinateValue
-            if n_dim == 3:
-                list_coordinates = [CoordinateValue([X[i], Y[i], Z[i], self.data[X[i], Y[i], Z[i]]]) for i in range(0, len(X))]
-            else:
-                list_coordinates = [CoordinateValue([X[i], Y[i], 0, self.data[X[i], Y[i]]]) for i in range(0, len(X))]
+            list_coordinates = CoordinateArray(X, Y, Z, values, coord_class=CoordinateValue)
+        else:
+            list_coordinates = CoordinateArray(X, Y, Z, values)
+
         if sorting is not None:
             if reverse_coord not in [True, False]:
                 raise ValueError('reverse_coord parameter must be a boolean')
-
-            if sorting == 'x':
-                list_coordinates = sorted(list_coordinates, key=lambda obj: obj.x, reverse=reverse_coord)
-            elif sorting == 'y':
-                list_coordinates = sorted(list_coordinates, key=lambda obj: obj.y, reverse=reverse_coord)
-            elif sorting == 'z':
-                list_coordinates = sorted(list_coordinates, key=lambda obj: obj.z, reverse=reverse_coord)
-            elif sorting == 'value':
-                list_coordinates = sorted(list_coordinates, key=lambda obj: obj.value, reverse=reverse_coord)
-            else:
-                raise ValueError("sorting parameter must be either 'x', 'y', 'z' or 'value'")
+            list_coordinates = list_coordinates.sort(sorting, reverse=reverse_coord)
 
         return list_coordinates
 
     def getCoordinatesAveragedByValue(self):
         """
         This function computes the mean coordinate of group of labels in the image. This is especially useful for label's images.
-        :return: list of coordinates that represent the center of mass of each group of value.
+        :return: CoordinateArray of coordinates that represent the center of mass of each group of value, sorted by value.
         """
-        # 1. Extraction of coordinates from all non-null voxels in the image. Coordinates are sorted by value.
-        coordinates = self.getNonZeroCoordinates(sorting='value')
-
-        # 2. Separate all coordinates into groups by value
-        groups = dict()
-        for coord in coordinates:
-            if coord.value in groups:
-                groups[coord.value].append(coord)
-            else:
-                groups[coord.value] = [coord]
-
-        # 3. Compute the center of mass of each group of voxels and write them into the output image
-        averaged_coordinates = []
-        for value, list_coord in groups.items():
-            averaged_coordinates.append(sum(list_coord) / float(len(list_coord)))
+        return self.getNonZeroCoordinates().average_by_value()
 
-        averaged_coordinates = sorted(averaged_coordinates, key=lambda obj: obj.value, reverse=False)
-        return averaged_coordinates
-
-
-    def transfo_pix2phys(self, coordi=None):
+    def transfo_pix2phys(self, coordi=None, dtype=np.float64):
         """
         This function returns the physical coordinates of all points of 'coordi'.
 
         :param coordi: sequence of (nb_points x 3) values containing the pixel coordinate of points.
+        :param dtype: data type of the computation and output (use np.float32 to halve memory usage)
         :return: sequence with the physical coordinates of the points in the space of the image.
 
         Example:
@@ -583,45 +704,38 @@ class Image(object):
 
         """
 
-        m_p2f = self.hdr.get_best_affine()
-        aug = np.hstack((np.asarray(coordi), np.ones((len(coordi), 1))))
-        ret = np.empty_like(coordi, dtype=np.float64)
-        for idx_coord, coord in enumerate(aug):
-            phys = np.matmul(m_p2f, coord)
-            ret[idx_coord] = phys[:3]
-        return ret
+        m_p2f = self.affine
+        return apply_affine(m_p2f, coordi, dtype=dtype)
 
 
-    def transfo_phys2pix(self, coordi, real=True):
+    def transfo_phys2pix(self, coordi, real=True, dtype=np.float64):
         """
         This function returns the pixels coordinates of all points of 'coordi'
 
         :param coordi: sequence of (nb_points x 3) values containing the pixel coordinate of points.
         :param real: whether to return real pixel coordinates
+        :param dtype: data type of the computation and output, if real is False
         :return: sequence with the physical coordinates of the points in the space of the image.
         """
 
-        m_p2f = self.hdr.get_best_affine()
+        m_p2f = self.affine
         m_f2p = np.linalg.inv(m_p2f)
-        aug = np.hstack((np.asarray(coordi), np.ones((len(coordi), 1))))
-        ret = np.empty_like(coordi, dtype=np.float64)
-        for idx_coord, coord in enumerate(aug):
-            phys = np.matmul(m_f2p, coord)
-            ret[idx_coord] = phys[:3]
+        ret = apply_affine(m_f2p, coordi, dtype=dtype)
         if real:
             return np.int32(np.round(ret))
         else:
             return ret
 
 
-    def get_values(self, coordi=None, interpolation_mode=0, border='constant', cval=0.0):
+    def get_values(self, coordi=None, interpolation_mode=0, border='constant', cval=0.0, dtype=np.float32):
         """
         This function returns the intensity value of the image at the position coordi (can be a list of coordinates).
         :param coordi: continuouspix
         :param interpolation_mode: 0=nearest neighbor, 1= linear, 2= 2nd-order spline, 3= 2nd-order spline, 4= 2nd-order spline, 5= 5th-order spline
+        :param dtype: data type of the output
         :return: intensity values at continuouspix with interpolation_mode
         """
-        return map_coordinates(self.data, coordi, output=np.float32, order=interpolation_mode, mode=border, cval=cval)
+        return map_coordinates(self.data, coordi, output=dtype, order=interpolation_mode, mode=border, cval=cval)
 
     def get_transform(self, im_ref, mode='affine'):
         aff_im_self = self.im_file.affine
@@ -689,7 +803,7 @@ class Image(object):
         T_self, R_self, Sc_self, Sh_self = affines.decompose44(direction_matrix)
         return R_self[0:3, 0], R_self[0:3, 1], R_self[0:3, 2]
 
-    def interpolate_from_image(self, im_ref, fname_output=None, interpolation_mode=1, border='constant'):
+    def interpolate_from_image(self, im_ref, fname_output=None, interpolation_mode=1, border='constant', chunk_size=2**20):
         """
         This function interpolates an image by following the grid of a reference image.
         Example of use:
@@ -702,33 +816,72 @@ class Image(object):
         :param im_ref: reference Image that contains the grid on which interpolate.
         :param border: Points outside the boundaries of the input are filled according
         to the given mode ('constant', 'nearest', 'reflect' or 'wrap')
-        :return: a new image that has the same dimensions/grid of the reference image but the data of self image.
+        :param chunk_size: approximate number of reference grid points interpolated at once
+        :return: a new image that has the same dimensions/grid of the reference image but the data of self image. Its
+        data has the type of the data of self image with nearest neighbour interpolation (interpolation_mode=0), and
+        float32 otherwise.
         """
         nx, ny, nz, nt, px, py, pz, pt = im_ref.dim
-        x, y, z = np.mgrid[0:nx, 0:ny, 0:nz]
-        indexes_ref = np.array(list(zip(x.ravel(), y.ravel(), z.ravel())))
-        physical_coordinates_ref = im_ref.transfo_pix2phys(indexes_ref)
 
         # TODO: add optional transformation from reference space to image space to physical coordinates of ref grid.
         # TODO: add choice to do non-full transorm: translation, (rigid), affine
         # 1. get transformation
         # 2. apply transformation on coordinates
 
-        coord_im = self.transfo_phys2pix(physical_coordinates_ref, real=False)
-        interpolated_values = self.get_values(np.array([coord_im[:, 0], coord_im[:, 1], coord_im[:, 2]]), interpolation_mode=interpolation_mode, border=border)
+        # Transformation from the voxel grid of the reference image to the voxel grid of this image
+        m_ref2im = np.matmul(np.linalg.inv(self.affine), im_ref.affine)
+
+        # Process the reference grid by slabs of slices, to bound memory usage.
+        # Note: spline interpolation pre-filters the whole input at each call, so it is done at once.
+        if interpolation_mode > 1:
+            nz_slab = nz
+        else:
+            nz_slab = max(1, chunk_size // (nx * ny))
+        x, y = np.mgrid[0:nx, 0:ny]
+        # Nearest neighbour interpolation copies values of the image: keep their type
+        dtype = self.data.dtype if interpolation_mode == 0 else np.float32
+        interpolated_values = np.empty((nx, ny, nz), dtype=dtype)
+        for z0 in range(0, nz, nz_slab):
+            z1 = min(nz, z0 + nz_slab)
+            indexes_ref = np.empty((nx, ny, z1 - z0, 3))
+            indexes_ref[..., 0] = x[..., None]
+            indexes_ref[..., 1] = y[..., None]
+            indexes_ref[..., 2] = np.arange(z0, z1)
+            coord_im = apply_affine(m_ref2im, indexes_ref.reshape(-1, 3))
+            interpolated_values[..., z0:z1] = self.get_values(coord_im.T, interpolation_mode=interpolation_mode, border=border, dtype=dtype).reshape((nx, ny, z1 - z0))
 
         im_output = Image(im_ref)
         if interpolation_mode == 0:
             im_output.change_type('int32')
         else:
             im_output.change_type('float32')
-        im_output.data = np.reshape(interpolated_values, (nx, ny, nz))
+        im_output.data = interpolated_values
         if fname_output is not None:
             im_output.absolutepath = fname_output
             im_output.save()
         return im_output
 
 
+def apply_affine(affine, coordi, dtype=np.float64, chunk_size=2**20):
+    """
+    Apply an affine transformation to a batch of points
+
+    :param affine: 4x4 affine matrix
+    :param coordi: sequence of (nb_points x 3) coordinates
+    :param dtype: data type of the computation and output
+    :param chunk_size: number of points transformed at once, to bound the size of temporaries
+    :return: (nb_points x 3) array of transformed coordinates
+    """
+    coordi = np.asarray(coordi, dtype=dtype)
+    affine = np.asarray(affine, dtype=dtype)
+    rot, trans = affine[:3, :3].T, affine[:3, 3]
+    ret = np.empty(coordi.shape, dtype=dtype)
+    for i in range(0, len(coordi), chunk_size):
+        np.dot(coordi[i:i + chunk_size], rot, out=ret[i:i + chunk_size])
+        ret[i:i + chunk_size] += trans
+    return ret
+
+
 def compute_dice(image1, image2, mode='3d', label=1, zboundaries=False):
     """
     This function computes the Dice coefficient between two binary images.
@@ -943,6 +1096,17 @@ def orientation_string_nib2sct(s):
 orientation_string_sct2nib = orientation_string_nib2sct
 
 
+def _copy_header_only(im_src, data):
+    """
+    :return: a new Image with a copy of the header of im_src, and `data` as data (not copied)
+
+    Use this instead of Image.copy() when the data of the copy is to be replaced anyway.
+    """
+    im_dst = type(im_src)(data, hdr=im_src.hdr.copy())
+    im_dst._path = None
+    return im_dst
+
+
 def change_shape(im_src, shape, im_dst=None):
     """
     :return: an image with changed shape
@@ -951,20 +1115,22 @@ def change_shape(im_src, shape, im_dst=None):
     Notes:
 
     - the resulting image has no path
+    - whenever possible, the resulting data is a view on the source data (no copy)
     """
 
-    if im_dst is None:
-        im_dst = im_src.copy()
-        im_dst._path = None
-
     if im_src.data.flags.f_contiguous:
-        im_dst.data = im_src.data.reshape(shape, order="F")
+        data = im_src.data.reshape(shape, order="F")
     elif im_src.data.flags.c_contiguous:
         warnings.warn("Encountered an array with C order, strange!")
-        im_dst.data = im_src.data.reshape(shape, order="C")
+        data = im_src.data.reshape(shape, order="C")
     else:
-        # image data may be a view
-        im_dst_data = im_src.data.copy().reshape(shape, order="F")
+        # image data may be a view (eg. after change_orientation()), numpy only copies it if it has to
+        data = im_src.data.reshape(shape, order="F")
+
+    if im_dst is None:
+        im_dst = _copy_header_only(im_src, data)
+    else:
+        im_dst.data = data
 
     pair = nibabel.nifti1.Nifti1Pair(im_dst.data, im_dst.hdr.get_best_affine(), im_dst.hdr)
     im_dst.hdr = pair.header
@@ -986,6 +1152,8 @@ def change_orientation(im_src, orientation, im_dst=None, inverse=False, data_onl
 
     - the resulting image has no path member set
     - if the source image is < 3D, it is reshaped to 3D and the destination is 3D
+    - the resulting data is a strided view on the source data (no copy), so that
+      reorienting costs no memory; use Image.copy() if you need independent data
     """
 
     # TODO: make sure to cover all cases for setorient-data
@@ -1008,37 +1176,13 @@ def change_orientation(im_src, orientation, im_dst=None, inverse=False, data_onl
 
     perm, inversion = _get_permutations(im_src_orientation, im_dst_orientation)
 
-    if im_dst is None:
-        im_dst = im_src.copy()
-        im_dst._path = None
-
     im_src_data = im_src.data
     if len(im_src_data.shape) < 3:
         im_src_data = im_src_data.reshape(tuple(list(im_src_data.shape) + ([1]*(3-len(im_src_data.shape)))))
 
     # Update data by performing inversions and swaps
 
-    # axes inversion (flip)
-    data = im_src_data[::inversion[0], ::inversion[1], ::inversion[2]]
-
-    # axes manipulations (transpose)
-    if perm == [1, 0, 2]:
-        data = np.swapaxes(data, 0, 1)
-    elif perm == [2, 1, 0]:
-        data = np.swapaxes(data, 0, 2)
-    elif perm == [0, 2, 1]:
-        data = np.swapaxes(data, 1, 2)
-    elif perm == [2, 0, 1]:
-        data = np.swapaxes(data, 0, 2)  # transform [2, 0, 1] to [1, 0, 2]
-        data = np.swapaxes(data, 0, 1)  # transform [1, 0, 2] to [0, 1, 2]
-    elif perm == [1, 2, 0]:
-        data = np.swapaxes(data, 0, 2)  # transform [1, 2, 0] to [0, 2, 1]
-        data = np.swapaxes(data, 1, 2)  # transform [0, 2, 1] to [0, 1, 2]
-    elif perm == [0, 1, 2]:
-        # do nothing
-        pass
-    else:
-        raise NotImplementedError()
+    data = _permute_data(im_src_data, perm, inversion)
 
     # Update header
 
@@ -1048,11 +1192,15 @@ def change_orientation(im_src, orientation, im_dst=None, inverse=False, data_onl
      im_src_data.shape)
     im_dst_aff = np.matmul(im_src_aff, aff)
 
+    if im_dst is None:
+        im_dst = _copy_header_only(im_src, data)
+    else:
+        im_dst.data = data
+
     if not data_only:
         im_dst.header.set_qform(im_dst_aff)
         im_dst.header.set_sform(im_dst_aff)
         im_dst.header.set_data_shape(data.shape)
-    im_dst.data = data
 
     return im_dst
 
@@ -1224,7 +1372,7 @@ def spatial_crop(im_src, spec, im_dst=None):
     """
 
     # Compute bounds
-    bounds = [ (0, x-1) for x in im_src.data.shape ]
+    bounds = [ (0, x-1) for x in im_src._get_data_shape() ]
     for k, v in spec.items():
         bounds[k] = v
 
@@ -1232,8 +1380,8 @@ def spatial_crop(im_src, spec, im_dst=None):
 
     bounds = np.array(bounds)
 
-    # Crop data
-    new_data = im_src.data[bounds_ndslice]
+    # Crop data (for a lazy image, only the cropped region is read)
+    new_data = im_src.read_slab(bounds_ndslice)
 
     # Update header
     #
@@ -0,0 +1,303 @@
+#!/usr/bin/env python
+# -*- coding: utf-8
+# Job queue in a shared folder, for workers running on several nodes of a cluster
+#
+# Jobs are files moved between the sub-folders of the queue:
+#
+# - todo/: jobs waiting for a worker
+# - running/: jobs leased by a worker. A worker leases a job by renaming it from todo/ to a unique temporary name
+#   (rename is atomic, so only one worker gets it), then writes it to running/, and touches it periodically
+#   (heartbeat) while the job runs.
+# - done/: completed jobs, with their result
+# - failed/: jobs that failed `max_attempts` times
+#
+# A job whose heartbeat stopped for `lease_timeout` seconds (worker killed, node down) is moved back to todo/ by the
+# first idle worker that notices it, so idle workers take over the work of dead ones. Submitting jobs that are
+# already in the queue does nothing, so a run is resumed by submitting the same jobs again: only incomplete jobs run.
+#
+# The modification times of the job files are set by the file server, so lease_timeout must be much larger than the
+# clock drift between nodes.
+
+from __future__ import absolute_import
+
+import os
+import io
+import json
+import time
+import uuid
+import errno
+import pickle
+import socket
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+FOLDERS = ("todo", "running", "done", "failed", "tmp")
+
+
+class Job(object):
+    """
+    Job of the queue
+    :ivar id: identifier of the job (unique in the queue, usable as a file name)
+    :ivar args: arguments of the job (JSON serializable)
+    :ivar attempts: number of times the job was leased
+    """
+    def __init__(self, id, args, attempts=0, worker=None, error=None):
+        self.id = id
+        self.args = args
+        self.attempts = attempts
+        self.worker = worker
+        self.error = error
+
+    def to_dict(self):
+        return {"id": self.id, "args": self.args, "attempts": self.attempts, "worker": self.worker,
+                "error": self.error}
+
+
+class JobQueue(object):
+    """
+    Job queue in a shared folder, see module documentation.
+
+    Example (on each node):
+
+    .. code:: python
+
+       queue = JobQueue("/shared/queue")
+       queue.submit({"sub-01": ["sub-01"], "sub-02": ["sub-02"]})
+       queue.work(process_subject)  # process_subject(args) -> result (picklable)
+       results = dict(queue.results())
+    """
+    def __init__(self, path, lease_timeout=600., max_attempts=3, worker=None):
+        """
+        :param path: folder of the queue (created if needed)
+        :param lease_timeout: time (s) after which a job whose worker stopped sending heartbeats is run again
+        :param max_attempts: number of times a job is run before it is considered failed
+        :param worker: name of this worker (default: hostname-pid)
+        """
+        self.path = path
+        self.lease_timeout = lease_timeout
+        self.max_attempts = max_attempts
+        self.worker = worker or "{}-{}".format(socket.gethostname(), os.getpid())
+        for folder in FOLDERS:
+            try:
+                os.makedirs(os.path.join(path, folder))
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+
+    def _path(self, folder, job_id, ext=".json"):
+        return os.path.join(self.path, folder, job_id + ext)
+
+    def _write(self, path, content, binary=False):
+        """
+        Write a file atomically (through a temporary file in the same file system)
+        """
+        path_tmp = os.path.join(self.path, "tmp", uuid.uuid4().hex)
+        if binary:
+            with io.open(path_tmp, "wb") as f:
+                f.write(content)
+        else:
+            with io.open(path_tmp, "w", encoding="utf-8") as f:
+                f.write(u"{}".format(json.dumps(content)))
+        os.rename(path_tmp, path)
+
+    def _read(self, path):
+        with io.open(path, "r", encoding="utf-8") as f:
+            d = json.load(f)
+        return Job(d["id"], d["args"], d.get("attempts", 0), d.get("worker", None), d.get("error", None))
+
+    def _move(self, src, dst):
+        """
+        :return: True if this process moved the file (False if another process moved it first)
+        """
+        try:
+            os.rename(src, dst)
+            return True
+        except OSError as e:
+            if e.errno == errno.ENOENT:
+                return False
+            raise
+
+    def submit(self, jobs):
+        """
+        Add jobs to the queue. Jobs already in the queue (waiting, running, done or failed) are ignored.
+        :param jobs: dict of job id -> arguments (JSON serializable)
+        :return: number of jobs added
+        """
+        count = 0
+        for job_id, args in sorted(jobs.items()):
+            if any(os.path.exists(self._path(folder, job_id)) for folder in ("todo", "running", "done", "failed")):
+                continue
+            self._write(self._path("todo", job_id), Job(job_id, args).to_dict())
+            count += 1
+        return count
+
+    def retry_failed(self):
+        """
+        Move the failed jobs back to the queue
+        :return: number of jobs moved
+        """
+        count = 0
+        for fname in os.listdir(os.path.join(self.path, "failed")):
+            job_id = fname[:-len(".json")]
+            path = self._path("failed", job_id)
+            job = self._read(path)
+            job.attempts = 0
+            self._write(path, job.to_dict())
+            count += self._move(path, self._path("todo", job_id))
+        return count
+
+    def reclaim_stale(self):
+        """
+        Move back to the queue the running jobs whose worker stopped sending heartbeats
+        :return: number of jobs moved
+        """
+        count = 0
+        now = time.time()
+        for fname in os.listdir(os.path.join(self.path, "running")):
+            job_id = fname[:-len(".json")]
+            path = self._path("running", job_id)
+            try:
+                if now - os.path.getmtime(path) < self.lease_timeout:
+                    continue
+            except OSError:
+                continue
+            # move it to a unique path first, so that only one worker reclaims it
+            path_tmp = os.path.join(self.path, "tmp", uuid.uuid4().hex)
+            if not self._move(path, path_tmp):
+                continue
+            job = self._read(path_tmp)
+            logger.warning("Job {} of worker {} timed out".format(job_id, job.worker))
+            job.error = "lease of worker {} expired".format(job.worker)
+            self._write(path_tmp, job.to_dict())
+            os.rename(path_tmp, self._path("todo" if job.attempts < self.max_attempts else "failed", job_id))
+            count += 1
+        return count
+
+    def lease(self):
+        """
+        Take a job from the queue
+        :return: Job, or None if there is no job waiting
+        """
+        for fname in sorted(os.listdir(os.path.join(self.path, "todo"))):
+            job_id = fname[:-len(".json")]
+            # lease it through a unique path, so that the job only appears in running/ once it is updated (a renamed
+            # file keeps its modification time, and reclaim_stale() would take it as a timed out job)
+            path_tmp = os.path.join(self.path, "tmp", uuid.uuid4().hex)
+            if not self._move(self._path("todo", job_id), path_tmp):
+                continue
+            if os.path.exists(self._path("done", job_id)):
+                # completed by a worker whose lease had expired
+                os.remove(path_tmp)
+                continue
+            job = self._read(path_tmp)
+            job.attempts += 1
+            job.worker = self.worker
+            self._write(path_tmp, job.to_dict())
+            os.rename(path_tmp, self._path("running", job_id))
+            return job
+        return None
+
+    def complete(self, job, result):
+        """
+        Store the result of a job and remove it from the running jobs
+        """
+        self._write(self._path("done", job.id, ".pickle"), pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL),
+                    binary=True)
+        self._write(self._path("done", job.id), job.to_dict())
+        try:
+            os.remove(self._path("running", job.id))
+        except OSError:
+            pass
+
+    def fail(self, job, error):
+        """
+        Put a job that raised an exception back in the queue, or in the failed jobs after `max_attempts` attempts
+        :return: False if the job is not leased by this worker anymore (its lease expired), in which case it is left
+            where it is
+        """
+        path = self._path("running", job.id)
+        path_tmp = os.path.join(self.path, "tmp", uuid.uuid4().hex)
+        if not self._move(path, path_tmp):
+            return False
+        job_leased = self._read(path_tmp)
+        if (job_leased.worker, job_leased.attempts) != (job.worker, job.attempts):
+            # leased again since it was reclaimed
+            os.rename(path_tmp, path)
+            return False
+        job.error = error
+        self._write(path_tmp, job.to_dict())
+        os.rename(path_tmp, self._path("todo" if job.attempts < self.max_attempts else "failed", job.id))
+        return True
+
+    def heartbeat(self, job):
+        """
+        Mark a job as alive
+        :return: False if the job is not leased anymore
+        """
+        try:
+            os.utime(self._path("running", job.id), None)
+            return True
+        except OSError:
+            return False
+
+    def status(self):
+        """
+        :return: number of jobs in each state (dict with keys "todo", "running", "done", "failed")
+        """
+        return dict((folder, len([f for f in os.listdir(os.path.join(self.path, folder)) if f.endswith(".json")]))
+                    for folder in ("todo", "running", "done", "failed"))
+
+    def results(self):
+        """
+        :return: iterator of (job id, result) of the completed jobs
+        """
+        for fname in sorted(os.listdir(os.path.join(self.path, "done"))):
+            if fname.endswith(".pickle"):
+                with io.open(os.path.join(self.path, "done", fname), "rb") as f:
+                    yield fname[:-len(".pickle")], pickle.load(f)
+
+    def work(self, function, wait=True, poll=1.):
+        """
+        Run jobs until the queue is empty.
+        :param function: function called with the arguments of each job, returning its result (picklable)
+        :param wait: if True, also wait for the jobs running on other workers (taking them over if they time out)
+        :param poll: time (s) between checks of the queue while waiting
+        :return: number of jobs run by this worker
+        """
+        count = 0
+        while True:
+            job = self.lease()
+            if job is None:
+                self.reclaim_stale()
+                job = self.lease()
+            if job is None:
+                if wait and self.status()["running"]:
+                    time.sleep(poll)
+                    continue
+                return count
+
+            logger.info("Worker {}: job {} (attempt {})".format(self.worker, job.id, job.attempts))
+            stop = threading.Event()
+            thread = threading.Thread(target=self._heartbeat_loop, args=(job, stop))
+            thread.daemon = True
+            thread.start()
+            try:
+                result = function(job.args)
+            except Exception as e:
+                logger.exception(e)
+                stop.set()
+                thread.join()
+                self.fail(job, repr(e))
+            else:
+                stop.set()
+                thread.join()
+                self.complete(job, result)
+            count += 1
+
+    def _heartbeat_loop(self, job, stop):
+        while not stop.wait(self.lease_timeout / 4.):
+            if not self.heartbeat(job):
+                logger.warning("Job {} was taken over by another worker".format(job.id))
+                return
@@ -0,0 +1,205 @@
+#!/usr/bin/env python
+# -*- coding: utf-8
+# SQLite database of aggregated metrics, an alternative to the csv files written by save_as_csv()
+#
+# Each aggregated value (output of aggregate_per_slice_or_level()) is one row of the table "metrics": subject, input
+# file, slices, vertebral levels, label, function (eg: MEAN), metric (eg: area) and value, so that the results of a
+# whole study are queried at once, eg: mean CSA at C2-C3 across all subjects:
+#
+#   SELECT AVG(value) FROM metrics WHERE metric = 'area' AND function = 'MEAN' AND vert_levels = '2:3'
+#
+# Several processes (eg: one per subject) can write to the same database: each write is a single transaction, which
+# waits for the other writers (up to TIMEOUT seconds). The database uses write-ahead logging when the filesystem
+# supports it, so that readers do not block writers.
+
+from __future__ import absolute_import
+
+import os
+import re
+import datetime
+import sqlite3
+import logging
+
+import numpy as np
+import pandas as pd
+
+from spinalcordtoolbox.utils import __version__, parse_num_list_inv
+
+logger = logging.getLogger(__name__)
+
+try:
+    _string_types = basestring
+except NameError:  # python 3
+    _string_types = str
+
+EXTENSIONS = ('.sqlite', '.db')
+TIMEOUT = 600.
+
+SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS metrics (
+        id INTEGER PRIMARY KEY,
+        timestamp TEXT,
+        sct_version TEXT,
+        subject TEXT,
+        filename TEXT,
+        slices TEXT,
+        slice_min INTEGER,
+        slice_max INTEGER,
+        vert_levels TEXT,
+        label TEXT,
+        size REAL,
+        function TEXT,
+        metric TEXT,
+        value REAL,
+        error TEXT
+    )""",
+    "CREATE INDEX IF NOT EXISTS metrics_metric ON metrics (metric, function, vert_levels)",
+    "CREATE INDEX IF NOT EXISTS metrics_label ON metrics (label, function, vert_levels)",
+    "CREATE INDEX IF NOT EXISTS metrics_file ON metrics (subject, filename)",
+]
+
+COLUMNS = ('id', 'timestamp', 'sct_version', 'subject', 'filename', 'slices', 'slice_min', 'slice_max', 'vert_levels',
+           'label', 'size', 'function', 'metric', 'value', 'error')
+
+# Fields of agg_metric that are not aggregated values
+FIELDS = ('VertLevel', 'Label', 'Size [vox]')
+
+
+def is_metrics_db(fname):
+    """
+    :return: True if fname is a database of metrics, based on its extension
+    """
+    return os.path.splitext(fname)[1].lower() in EXTENSIONS
+
+
+def connect(fname, timeout=TIMEOUT):
+    """
+    Open (and create, if needed) a database of metrics.
+    :param fname: database file
+    :param timeout: float: time to wait for other writers, in seconds
+    :return: sqlite3.Connection, with transactions handled explicitly (see save_as_sqlite())
+    """
+    db = sqlite3.connect(fname, timeout=timeout, isolation_level=None)
+    try:
+        # Not supported by some network filesystems, in which case the default (rollback journal) is kept
+        db.execute("PRAGMA journal_mode=WAL")
+    except sqlite3.OperationalError as e:
+        logger.debug("Write-ahead logging not enabled for %s: %s", fname, e)
+    db.execute("BEGIN IMMEDIATE")
+    try:
+        for query in SCHEMA:
+            db.execute(query)
+        db.execute("COMMIT")
+    except Exception:
+        db.execute("ROLLBACK")
+        db.close()
+        raise
+    return db
+
+
+def connect_readonly(fname, timeout=TIMEOUT):
+    """
+    Open an existing database of metrics for reading: unlike connect(), the schema is not created and the database is
+    not locked for writing (queries that would modify it are rejected), so that it can be read while other processes
+    write to it, or from a read-only location.
+    :param fname: database file (must exist, otherwise an empty database is created)
+    :param timeout: float: time to wait for other writers (only without write-ahead logging), in seconds
+    :return: sqlite3.Connection
+    """
+    db = sqlite3.connect(fname, timeout=timeout)
+    db.execute("PRAGMA query_only = ON")
+    return db
+
+
+def _value(value):
+    """
+    :return: (value, error) to store for an aggregated value, which is a number, None or an error message
+    """
+    if value is None:
+        return None, None
+    if isinstance(value, _string_types):
+        return None, value
+    value = float(value)
+    return (value, None) if np.isfinite(value) else (None, None)
+
+
+def _rows(agg_metric, fname_in, subject, timestamp):
+    """
+    :return: list of rows of the table "metrics" for the output of aggregate_per_slice_or_level()
+    """
+    rows = []
+    for slicegroup in sorted(agg_metric.keys()):
+        agg = agg_metric[slicegroup]
+        vert_levels = agg.get('VertLevel')
+        if vert_levels is not None and None in vert_levels:
+            vert_levels = None
+        size = agg.get('Size [vox]')
+        for key in agg:
+            if key in FIELDS:
+                continue
+            # eg: MEAN(area) -> MEAN, area
+            match = re.match(r'^(.*)\((.*)\)$', key)
+            function, metric = match.groups() if match else (key, '')
+            value, error = _value(agg[key])
+            rows.append((
+                timestamp, __version__, subject, fname_in,
+                parse_num_list_inv(slicegroup),
+                int(min(slicegroup)) if slicegroup else None, int(max(slicegroup)) if slicegroup else None,
+                parse_num_list_inv(vert_levels) or None,
+                agg.get('Label'), float(size) if size is not None else None,
+                function, metric, value, error))
+    return rows
+
+
+def save_as_sqlite(agg_metric, fname_out, fname_in=None, subject=None, append=False):
+    """
+    Write metric structure into a database of metrics (created if it does not exist).
+    :param agg_metric: output of aggregate_per_slice_or_level()
+    :param fname_out: database file
+    :param fname_in: input file to be listed in the database (e.g., segmentation file which produced the results).
+    :param subject: subject to be listed in the database
+    :param append: Bool: Keep the results of previous runs on the same subject and input file instead of replacing them.
+    :return:
+    """
+    rows = _rows(agg_metric, fname_in, subject, datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+    db = connect(fname_out)
+    try:
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            if not append:
+                db.execute("DELETE FROM metrics WHERE subject IS ? AND filename IS ?", (subject, fname_in))
+            db.executemany("INSERT INTO metrics (timestamp, sct_version, subject, filename, slices, slice_min, "
+                           "slice_max, vert_levels, label, size, function, metric, value, error) "
+                           "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            db.execute("COMMIT")
+        except Exception:
+            db.execute("ROLLBACK")
+            raise
+    finally:
+        db.close()
+
+
+def read_metrics(fname, **filters):
+    """
+    Read the rows of a database of metrics.
+    :param fname: database file
+    :param filters: column=value (or list of values), eg: metric='area', function='MEAN', vert_levels=['2', '3']
+    :return: DataFrame
+    """
+    where, params = [], []
+    for column, value in sorted(filters.items()):
+        if column not in COLUMNS:
+            raise ValueError("Unknown column: {}".format(column))
+        values = value if isinstance(value, (list, tuple)) else [value]
+        where.append("{} IN ({})".format(column, ", ".join("?" * len(values))))
+        params.extend(values)
+    if not os.path.isfile(fname):
+        raise IOError("No such file: {}".format(fname))
+    query = "SELECT * FROM metrics"
+    if where:
+        query += " WHERE " + " AND ".join(where)
+    db = connect_readonly(fname)
+    try:
+        return pd.read_sql_query(query + " ORDER BY id", db, params=params)
+    finally:
+        db.close()
@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+# -*- coding: utf-8
+# Packed label folders (eg: atlas of white matter tracts)
+#
+# A label folder (info_label.txt + one NIfTI file per label) is packed into a single file, which stores the nonzero
+# partial-volume weights of all the labels in a sparse layout, in RPI orientation, along with info_label.txt. The
+# file is memory-mapped when read: tools extracting metrics within the labels don't have to decompress, reorient and
+# stack each label file.
+#
+# File layout:
+#
+# - 8 bytes: magic string
+# - 8 bytes: length of the header (little-endian uint64)
+# - header: JSON, utf-8
+# - arrays, each aligned on 64 bytes: the weights are stored as a CSC (voxel x label) matrix: `indptr` (nb_labels+1),
+#   `indices` (voxel indices of the nonzero weights, in C order of the RPI volume) and `data` (weights).
+
+from __future__ import absolute_import
+
+import io
+import os
+import json
+import struct
+import logging
+
+import numpy as np
+
+from spinalcordtoolbox.image import Image
+from spinalcordtoolbox.metadata import InfoLabel
+
+logger = logging.getLogger(__name__)
+
+PACKED_LABELS_FILE = 'labels.sctpack'
+MAGIC = b'SCTPACK1'
+ALIGNMENT = 64
+
+
+def _source_stamp(path):
+    """
+    :return: [size, mtime] of a file, used to check that a packed file is up to date
+    """
+    st = os.stat(path)
+    return [st.st_size, st.st_mtime]
+
+
+def pack_labels(path_label, file_info_label='info_label.txt', fname_out=None):
+    """
+    Pack a label folder into a single file.
+    :param path_label: folder containing file_info_label and the label files
+    :param file_info_label: name of the info_label file
+    :param fname_out: output file (default: PACKED_LABELS_FILE in path_label)
+    :return: fname_out
+    """
+    if fname_out is None:
+        fname_out = os.path.join(path_label, PACKED_LABELS_FILE)
+    fname_info_label = os.path.join(path_label, file_info_label)
+    il = InfoLabel()
+    il.load(fname_info_label)
+    with io.open(fname_info_label, 'rb') as f:
+        info_label = f.read().decode('utf-8')
+
+    shape, affine, dtype = None, None, None
+    indptr, indices, data = [0], [], []
+    sources = {file_info_label: _source_stamp(fname_info_label)}
+    for _id, _name, _filename in il._indiv_labels:
+        fname_label = os.path.join(path_label, _filename)
+        im_label = Image(fname_label).change_orientation('RPI')
+        if shape is None:
+            shape, affine = im_label.data.shape, im_label.hdr.get_best_affine()
+        elif im_label.data.shape != shape:
+            raise ValueError("Label {} has dimensions {}, expected {}".format(fname_label, im_label.data.shape, shape))
+        data_label = np.asarray(im_label.data).reshape(-1)
+        index = np.flatnonzero(data_label)
+        indices.append(index)
+        data.append(data_label[index])
+        indptr.append(indptr[-1] + len(index))
+        dtype = data_label.dtype if dtype is None else np.promote_types(dtype, data_label.dtype)
+        sources[_filename] = _source_stamp(fname_label)
+
+    n_vox = int(np.prod(shape))
+    arrays = [
+        ('indptr', np.array(indptr, dtype=np.int64)),
+        ('indices', np.concatenate(indices).astype(np.int32 if n_vox < 2 ** 31 else np.int64)),
+        ('data', np.concatenate(data).astype(dtype)),
+    ]
+    header = {
+        'shape': list(shape),
+        'affine': np.asarray(affine).tolist(),
+        'orientation': 'RPI',
+        'labels': [list(label) for label in il._indiv_labels],
+        'file_info_label': file_info_label,
+        'info_label': info_label,
+        'sources': sources,
+        'arrays': {},
+    }
+    offset = 0
+    for name, array in arrays:
+        header['arrays'][name] = {'offset': offset, 'dtype': array.dtype.str, 'shape': list(array.shape)}
+        offset += -(-array.nbytes // ALIGNMENT) * ALIGNMENT
+    header = json.dumps(header).encode('utf-8')
+
+    # Write to a temporary file, renamed at the end, so that readers never see a partial file
+    fname_tmp = fname_out + '.tmp{}'.format(os.getpid())
+    with io.open(fname_tmp, 'wb') as f:
+        f.write(MAGIC + struct.pack('<Q', len(header)) + header)
+        f.write(b'\0' * (_data_start(len(header)) - f.tell()))
+        for name, array in arrays:
+            start = f.tell()
+            f.write(array.tobytes())
+            f.write(b'\0' * (-(f.tell() - start) % ALIGNMENT))
+    os.rename(fname_tmp, fname_out)
+    return fname_out
+
+
+def _data_start(len_header):
+    """
+    :return: offset of the arrays in a packed file
+    """
+    return -(-(len(MAGIC) + 8 + len_header) // ALIGNMENT) * ALIGNMENT
+
+
+class PackedLabels(object):
+    """
+    Memory-mapped packed label folder, see pack_labels().
+
+    :ivar shape: shape of the label volumes (RPI orientation)
+    :ivar affine: affine of the label volumes (RPI orientation)
+    :ivar labels: list of (id, name, filename) of the individual labels, as in info_label.txt
+    """
+    def __init__(self, fname):
+        """
+        :param fname: packed file
+        """
+        self.fname = fname
+        with io.open(fname, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError("{} is not a packed label file".format(fname))
+            len_header, = struct.unpack('<Q', f.read(8))
+            self._header = json.loads(f.read(len_header).decode('utf-8'))
+        self.shape = tuple(self._header['shape'])
+        self.affine = np.array(self._header['affine'])
+        self.labels = [tuple(label) for label in self._header['labels']]
+        self._arrays = {}
+        for name, desc in self._header['arrays'].items():
+            dtype, shape = np.dtype(desc['dtype']), tuple(desc['shape'])
+            if np.prod(shape) == 0:
+                self._arrays[name] = np.zeros(shape, dtype=dtype)
+            else:
+                self._arrays[name] = np.memmap(fname, dtype=dtype, mode='r', shape=shape,
+                                               offset=_data_start(len_header) + desc['offset'])
+
+    @property
+    def info_label(self):
+        """
+        :return: InfoLabel of the packed folder
+        """
+        il = InfoLabel()
+        il.load(io.BytesIO(self._header['info_label'].encode('utf-8')), verify=False)
+        return il
+
+    def is_up_to_date(self, path_label):
+        """
+        :param path_label: folder the labels were packed from
+        :return: False if a file of the folder was modified after packing
+        """
+        for filename, stamp in self._header['sources'].items():
+            path = os.path.join(path_label, filename)
+            if os.path.exists(path) and _source_stamp(path) != stamp:
+                return False
+        return True
+
+    def matrix(self):
+        """
+        :return: scipy.sparse.csc_matrix (voxel x label) of the weights, voxels being in C order of the RPI volume
+        """
+        from scipy import sparse
+        return sparse.csc_matrix((self._arrays['data'], self._arrays['indices'], self._arrays['indptr']),
+                                 shape=(int(np.prod(self.shape)), len(self.labels)))
+
+    def label_data(self, i):
+        """
+        :param i: index of the label in self.labels
+        :return: ndarray of the weights of the label (RPI orientation)
+        """
+        start, stop = self._arrays['indptr'][i:i + 2]
+        data = np.zeros(int(np.prod(self.shape)), dtype=self._arrays['data'].dtype)
+        data[self._arrays['indices'][start:stop]] = self._arrays['data'][start:stop]
+        return data.reshape(self.shape)
+
+    def dense(self):
+        """
+        :return: ndarray (x, y, z, label) of the weights of all the labels (RPI orientation)
+        """
+        return np.stack([self.label_data(i) for i in range(len(self.labels))], axis=-1)
+
+
+def open_packed_labels(path_label):
+    """
+    :param path_label: label folder
+    :return: PackedLabels of the folder, or None if it was not packed or if it changed since
+    """
+    fname = os.path.join(path_label, PACKED_LABELS_FILE)
+    if not os.path.isfile(fname):
+        return None
+    try:
+        packed = PackedLabels(fname)
+    except (IOError, OSError, ValueError) as e:
+        logger.warning("Could not read {}: {}".format(fname, e))
+        return None
+    if not packed.is_up_to_date(path_label):
+        logger.warning("{} is outdated, the label files are used instead".format(fname))
+        return None
+    return packed
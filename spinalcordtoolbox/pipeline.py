@@ -0,0 +1,365 @@
+#!/usr/bin/env python
+# -*- coding: utf-8
+# Incremental multi-subject pipelines
+#
+# A pipeline is a list of steps (segmentation, vertebral labeling, registration to the template...), each declaring
+# the files it reads and writes. The steps of each subject are scheduled as a DAG (a step runs once the steps
+# producing its inputs are done), and the steps of all the subjects run in parallel in a process pool.
+#
+# Like make, a step is skipped if its outputs are up to date: the outputs exist and neither the command nor the
+# content of the inputs changed since the step last ran. The state of each subject (hashes of the inputs of each
+# step) is saved after each step, in <subject>/.sct_pipeline/, so an interrupted run resumes where it stopped, and
+# re-running a study after changing one step only re-executes that step and the steps downstream of it (only if its
+# outputs changed).
+
+from __future__ import absolute_import
+
+import os
+import io
+import json
+import time
+import shlex
+import hashlib
+import logging
+import collections
+import concurrent.futures
+
+from spinalcordtoolbox import cpu
+from spinalcordtoolbox.utils import __sct_dir__, __data_dir__
+
+logger = logging.getLogger(__name__)
+
+# Folder, in each subject folder, where the state and the logs of the steps are stored
+FOLDER_STATE = ".sct_pipeline"
+
+# Status of the tasks (step of a subject)
+STATUS_UPTODATE = "up-to-date"
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+STATUS_SKIPPED = "skipped"  # a step it depends on failed
+STATUS_OUTDATED = "outdated"  # dry run: the step would run
+
+TaskResult = collections.namedtuple("TaskResult", ["subject", "step", "status", "duration", "message"])
+
+
+class Step(object):
+    """
+    Step of a pipeline.
+
+    The command, inputs and outputs are formatted with the variables of the pipeline (eg: "{data_dir}"), and with
+    "{subject}" (name of the subject).
+
+    Example:
+
+    .. code:: python
+
+       Step("segment", "sct_deepseg_sc -i t2.nii.gz -c t2", inputs=["t2.nii.gz"], outputs=["t2_seg.nii.gz"],
+            folder="t2")
+    """
+    def __init__(self, name, cmd, inputs=(), outputs=(), folder=".", after=()):
+        """
+        :param name: name of the step (unique in the pipeline)
+        :param cmd: command line
+        :param inputs: files read by the step, relative to `folder`
+        :param outputs: files written by the step, relative to `folder`
+        :param folder: folder where the command runs, relative to the subject folder
+        :param after: names of steps that must run before this one, in addition to those producing its inputs
+        """
+        self.name = name
+        self.cmd = cmd
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.folder = folder
+        self.after = list(after)
+
+    def resolve(self, variables):
+        """
+        :param variables: values of the variables of the command, inputs and outputs
+        :return: command, and paths of the inputs and outputs relative to the subject folder
+        """
+        folder = self.folder.format(**variables)
+
+        def path(p):
+            return os.path.normpath(os.path.join(folder, p.format(**variables)))
+
+        return self.cmd.format(**variables), [path(p) for p in self.inputs], [path(p) for p in self.outputs]
+
+
+class Pipeline(object):
+    """
+    Pipeline applied to each subject of a dataset, see module documentation.
+    """
+    def __init__(self, steps, variables=None):
+        """
+        :param steps: list of Step
+        :param variables: values of the variables used in the steps (in addition to "sct_dir", "data_dir" and
+                          "subject")
+        """
+        self.steps = list(steps)
+        self.variables = {"sct_dir": __sct_dir__, "data_dir": __data_dir__}
+        self.variables.update(variables or {})
+
+        names = [step.name for step in self.steps]
+        duplicates = set(name for name in names if names.count(name) > 1)
+        if duplicates:
+            raise ValueError("Duplicate steps: {}".format(", ".join(sorted(duplicates))))
+        self.dependencies = self._get_dependencies()
+
+    def _get_dependencies(self):
+        """
+        :return: names of the steps each step depends on (dict)
+        """
+        variables = dict(self.variables, subject="subject")
+        producers = {}
+        for step in self.steps:
+            for path in step.resolve(variables)[2]:
+                producers[path] = step.name
+
+        names = [step.name for step in self.steps]
+        dependencies = {}
+        for step in self.steps:
+            deps = set(producers[path] for path in step.resolve(variables)[1] if path in producers)
+            for name in step.after:
+                if name not in names:
+                    raise ValueError("Step {}: unknown step {}".format(step.name, name))
+                deps.add(name)
+            deps.discard(step.name)
+            dependencies[step.name] = deps
+
+        # check that there is no cycle
+        done = set()
+        while len(done) < len(self.steps):
+            ready = [name for name, deps in dependencies.items() if name not in done and deps <= done]
+            if not ready:
+                raise ValueError("Cycle between steps: {}".format(", ".join(sorted(set(dependencies) - done))))
+            done.update(ready)
+        return dependencies
+
+    def downstream(self, names):
+        """
+        :return: names of the steps depending (directly or not) on the steps `names`, including them
+        """
+        res = set(names)
+        changed = True
+        while changed:
+            changed = False
+            for name, deps in self.dependencies.items():
+                if name not in res and deps & res:
+                    res.add(name)
+                    changed = True
+        return res
+
+    def run(self, path_data, subjects=None, jobs=None, force=(), dry_run=False):
+        """
+        Run the pipeline on a dataset.
+
+        :param path_data: folder of the dataset
+        :param subjects: names of the subject folders (default: all the folders of the dataset)
+        :param jobs: number of parallel processes (default: CPU budget, see spinalcordtoolbox.cpu)
+        :param force: names of the steps to run even if they are up to date
+        :param dry_run: don't run anything, report the steps that would run
+        :return: list of TaskResult, in order of completion
+        """
+        if subjects is None:
+            subjects = sorted(d for d in os.listdir(path_data)
+                              if os.path.isdir(os.path.join(path_data, d)) and not d.startswith("."))
+        steps = dict((step.name, step) for step in self.steps)
+        states = dict((subject, _SubjectState(os.path.join(path_data, subject))) for subject in subjects)
+        # remaining dependencies of each task (subject, step name)
+        waiting = dict(((subject, name), set(deps)) for subject in subjects for name, deps in self.dependencies.items())
+        results = []
+        outdated = set()
+
+        def complete(task, status, duration=0., message=""):
+            results.append(TaskResult(task[0], task[1], status, duration, message))
+            logger.info("{} {}: {}{}".format(task[0], task[1], status, " ({})".format(message) if message else ""))
+            if status == STATUS_OUTDATED:
+                outdated.add(task)
+            if status == STATUS_FAILED:
+                for name in self.downstream([task[1]]) - set([task[1]]):
+                    if (task[0], name) in waiting:
+                        del waiting[task[0], name]
+                        results.append(TaskResult(task[0], name, STATUS_SKIPPED, 0., "{} failed".format(task[1])))
+            else:
+                for other, deps in waiting.items():
+                    if other[0] == task[0]:
+                        deps.discard(task[1])
+
+        nb_workers = cpu.pool_size(jobs)
+        with cpu.split(nb_workers):
+            executor = concurrent.futures.ProcessPoolExecutor(nb_workers)
+            running = {}
+            try:
+                while waiting or running:
+                    for task in sorted(t for t, deps in waiting.items() if not deps):
+                        del waiting[task]
+                        subject, name = task
+                        state = states[subject]
+                        variables = dict(self.variables, subject=subject)
+                        cmd, inputs, outputs = steps[name].resolve(variables)
+                        missing = [p for p in inputs if not os.path.exists(os.path.join(state.path, p))]
+                        if missing and not dry_run:
+                            complete(task, STATUS_FAILED, message="missing input {}".format(", ".join(missing)))
+                            continue
+                        signature = None if missing else state.signature(cmd, inputs)
+                        if name not in force and state.is_uptodate(name, signature, outputs):
+                            complete(task, STATUS_UPTODATE)
+                        elif dry_run or any((subject, d) in outdated for d in self.dependencies[name]):
+                            complete(task, STATUS_OUTDATED)
+                        else:
+                            cwd = os.path.join(state.path, steps[name].folder.format(**variables))
+                            future = executor.submit(_run_step, cmd, cwd, state.path_log(name))
+                            running[future] = (task, signature, outputs, time.time())
+
+                    if not running:
+                        continue
+                    finished, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+                    for future in finished:
+                        task, signature, outputs, t0 = running.pop(future)
+                        state = states[task[0]]
+                        try:
+                            status, _ = future.result()
+                        except Exception as e:
+                            logger.warning("{} {}: {!r}".format(task[0], task[1], e))
+                            status = 1
+                        missing = [p for p in outputs if not os.path.exists(os.path.join(state.path, p))]
+                        if status != 0:
+                            complete(task, STATUS_FAILED, time.time() - t0,
+                                     "status {}, see {}".format(status, state.path_log(task[1])))
+                        elif missing:
+                            complete(task, STATUS_FAILED, time.time() - t0,
+                                     "outputs not created: {}".format(", ".join(missing)))
+                        else:
+                            state.update(task[1], signature)
+                            complete(task, STATUS_DONE, time.time() - t0)
+            except KeyboardInterrupt:
+                logger.warning("Interrupted, waiting for the running steps")
+                for future in running:
+                    future.cancel()
+                raise
+            finally:
+                executor.shutdown()
+        return results
+
+
+class _SubjectState(object):
+    """
+    State of the steps of a subject: signature of the inputs of each step when it last ran, and hashes of the files
+    (indexed by size and modification time, so that unchanged files are not read again).
+    """
+    def __init__(self, path):
+        self.path = path
+        self.path_state = os.path.join(path, FOLDER_STATE, "state.json")
+        self.steps = {}
+        self.files = {}
+        if os.path.isfile(self.path_state):
+            try:
+                with io.open(self.path_state, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                self.steps, self.files = data["steps"], data["files"]
+            except (IOError, ValueError, KeyError) as e:
+                logger.warning("Ignoring invalid state {}: {}".format(self.path_state, e))
+
+    def path_log(self, name):
+        return os.path.join(self.path, FOLDER_STATE, "{}.log".format(name))
+
+    def hash_file(self, path):
+        path_abs = os.path.join(self.path, path)
+        st = os.stat(path_abs)
+        entry = self.files.get(path)
+        if entry is None or entry[:2] != [st.st_size, st.st_mtime]:
+            h = hashlib.sha256()
+            with io.open(path_abs, "rb") as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                    h.update(chunk)
+            entry = self.files[path] = [st.st_size, st.st_mtime, h.hexdigest()]
+        return entry[2]
+
+    def signature(self, cmd, inputs):
+        """
+        :return: signature of a step: hash of its command and of the content of its inputs
+        """
+        h = hashlib.sha256(cmd.encode("utf-8"))
+        for path in inputs:
+            h.update(self.hash_file(path).encode("utf-8"))
+        return h.hexdigest()
+
+    def is_uptodate(self, name, signature, outputs):
+        return (signature is not None and self.steps.get(name) == signature
+                and all(os.path.exists(os.path.join(self.path, p)) for p in outputs))
+
+    def update(self, name, signature):
+        """
+        Record that a step ran, and save the state (atomically, so that it's never corrupted by an interruption)
+        """
+        self.steps[name] = signature
+        if not os.path.isdir(os.path.dirname(self.path_state)):
+            os.makedirs(os.path.dirname(self.path_state))
+        path_tmp = self.path_state + ".tmp"
+        with io.open(path_tmp, "w", encoding="utf-8") as f:
+            f.write(u"{}".format(json.dumps({"steps": self.steps, "files": self.files})))
+        os.rename(path_tmp, self.path_state)
+
+
+def _run_step(cmd, cwd, path_log):
+    """
+    Run the command of a step (in a worker process), and write its output in the log file
+    :return: status, output
+    """
+    import sct_utils as sct
+    folder_log = os.path.dirname(path_log)
+    if not os.path.isdir(folder_log):
+        os.makedirs(folder_log)
+    status, output = sct.run(shlex.split(cmd), cwd=cwd, verbose=0, raise_exception=False)
+    with io.open(path_log, "w", encoding="utf-8") as f:
+        f.write(u"{}\n{}\n".format(cmd, output))
+    return status, output
+
+
+def example_pipeline():
+    """
+    :return: pipeline processing the t2 and t2s data of sct_example_data (same as the first part of
+             batch_processing.sh): segmentation, vertebral labeling, registration to the PAM50 template, warping of the
+             template and extraction of the cross-sectional areas
+    """
+    return Pipeline([
+     # t2
+     Step("t2_segment", "sct_deepseg_sc -i t2.nii.gz -c t2",
+          inputs=["t2.nii.gz"], outputs=["t2_seg.nii.gz"], folder="t2"),
+     Step("t2_label_vertebrae", "sct_label_vertebrae -i t2.nii.gz -s t2_seg.nii.gz -c t2",
+          inputs=["t2.nii.gz", "t2_seg.nii.gz"], outputs=["t2_seg_labeled.nii.gz"], folder="t2"),
+     Step("t2_labels", "sct_label_utils -i t2_seg_labeled.nii.gz -vert-body 2,5 -o labels_vert.nii.gz",
+          inputs=["t2_seg_labeled.nii.gz"], outputs=["labels_vert.nii.gz"], folder="t2"),
+     Step("t2_register_to_template",
+          "sct_register_to_template -i t2.nii.gz -s t2_seg.nii.gz -l labels_vert.nii.gz -c t2",
+          inputs=["t2.nii.gz", "t2_seg.nii.gz", "labels_vert.nii.gz"],
+          outputs=["warp_template2anat.nii.gz", "warp_anat2template.nii.gz"], folder="t2"),
+     Step("t2_warp_template", "sct_warp_template -d t2.nii.gz -w warp_template2anat.nii.gz -a 0",
+          inputs=["t2.nii.gz", "warp_template2anat.nii.gz"],
+          outputs=["label/template/PAM50_levels.nii.gz"], folder="t2"),
+     Step("t2_csa", "sct_process_segmentation -i t2_seg.nii.gz -vert 2:3 -o csa_c2c3.csv",
+          inputs=["t2_seg.nii.gz", "label/template/PAM50_levels.nii.gz"], outputs=["csa_c2c3.csv"], folder="t2"),
+     # t2s
+     Step("t2s_segment", "sct_deepseg_sc -i t2s.nii.gz -c t2s",
+          inputs=["t2s.nii.gz"], outputs=["t2s_seg.nii.gz"], folder="t2s"),
+     Step("t2s_segment_gm", "sct_deepseg_gm -i t2s.nii.gz",
+          inputs=["t2s.nii.gz"], outputs=["t2s_gmseg.nii.gz"], folder="t2s"),
+     Step("t2s_register_template",
+          "sct_register_multimodal -i {data_dir}/PAM50/template/PAM50_t2s.nii.gz "
+          "-iseg {data_dir}/PAM50/template/PAM50_cord.nii.gz -d t2s.nii.gz -dseg t2s_seg.nii.gz "
+          "-param step=1,type=seg,algo=centermass:step=2,type=seg,algo=bsplinesyn,slicewise=1,iter=3:"
+          "step=3,type=im,algo=syn,slicewise=1,iter=1,metric=CC "
+          "-initwarp ../t2/warp_template2anat.nii.gz -initwarpinv ../t2/warp_anat2template.nii.gz",
+          inputs=["t2s.nii.gz", "t2s_seg.nii.gz", "../t2/warp_template2anat.nii.gz",
+                  "../t2/warp_anat2template.nii.gz"],
+          outputs=["warp_PAM50_t2s2t2s.nii.gz", "warp_t2s2PAM50_t2s.nii.gz"], folder="t2s"),
+     Step("t2s_warp_template", "sct_warp_template -d t2s.nii.gz -w warp_PAM50_t2s2t2s.nii.gz",
+          inputs=["t2s.nii.gz", "warp_PAM50_t2s2t2s.nii.gz"],
+          outputs=["label/template/PAM50_levels.nii.gz"], folder="t2s"),
+     Step("t2s_wmseg", "sct_maths -i t2s_seg.nii.gz -sub t2s_gmseg.nii.gz -o t2s_wmseg.nii.gz",
+          inputs=["t2s_seg.nii.gz", "t2s_gmseg.nii.gz"], outputs=["t2s_wmseg.nii.gz"], folder="t2s"),
+     Step("t2s_csa_wm", "sct_process_segmentation -i t2s_wmseg.nii.gz -vert 2:5 -perlevel 1 -o csa_wm.csv",
+          inputs=["t2s_wmseg.nii.gz", "label/template/PAM50_levels.nii.gz"], outputs=["csa_wm.csv"], folder="t2s"),
+     Step("t2s_csa_gm", "sct_process_segmentation -i t2s_gmseg.nii.gz -vert 2:5 -perlevel 1 -o csa_gm.csv",
+          inputs=["t2s_gmseg.nii.gz", "label/template/PAM50_levels.nii.gz"], outputs=["csa_gm.csv"], folder="t2s"),
+    ])
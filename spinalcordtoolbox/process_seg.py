@@ -5,20 +5,34 @@
 from __future__ import absolute_import
 
 import math
+import hashlib
 import platform
+import multiprocessing
+import concurrent.futures
 import numpy as np
 from skimage import measure, transform
 from tqdm import tqdm
 import logging
 import nibabel
 
+from spinalcordtoolbox import cpu
 from spinalcordtoolbox.image import Image
 from spinalcordtoolbox.aggregate_slicewise import Metric
 from spinalcordtoolbox.centerline.core import ParamCenterline, get_centerline
 from spinalcordtoolbox.resampling import resample_nib
+from spinalcordtoolbox.trace import traced
 
+# Number of slices sent at once to a worker process by compute_shape()
+SLICES_PER_CHUNK = 16
+# Margin (mm) around the segmentation in the axial plane, when resampling it in compute_shape()
+ROI_MARGIN = 5.
+# Precision (rad) of the angles used to identify a slice in the cache of compute_shape(): refitting the centerline
+# after editing a few slices slightly changes the angles of all the slices
+ANGLE_PRECISION = 1e-4
 
-def compute_shape(segmentation, angle_correction=True, param_centerline=None, verbose=1):
+
+@traced(cat="process_seg")
+def compute_shape(segmentation, angle_correction=True, param_centerline=None, verbose=1, jobs=None, cache=None):
     """
     Compute morphometric measures of the spinal cord in the transverse (axial) plane from the segmentation.
     The segmentation could be binary or weighted for partial volume [0,1].
@@ -26,6 +40,10 @@ def compute_shape(segmentation, angle_correction=True, param_centerline=None, ve
     :param angle_correction:
     :param param_centerline: see centerline.core.ParamCenterline()
     :param verbose:
+    :param jobs: number of processes computing the slices in parallel (default: CPU budget, see cpu.get_ncpu())
+    :param cache: cache.StepCache: if provided, the shape properties of the slices are stored in it (one entry per batch
+        of SLICES_PER_CHUNK slices), and reused for the batches whose content and angles did not change (eg: when
+        re-running after editing a few slices).
     :return metrics: Dict of class Metric(). If a metric cannot be calculated, its value will be nan.
     :return fit_results: class centerline.core.FitResults()
     """
@@ -45,8 +63,10 @@ def compute_shape(segmentation, angle_correction=True, param_centerline=None, ve
     # Getting image dimensions. x, y and z respectively correspond to RL, PA and IS.
     nx, ny, nz, nt, px, py, pz, pt = im_seg.dim
     pr = min([px, py])
-    # Resample to isotropic resolution in the axial plane. Use the minimum pixel dimension as target dimension.
-    im_segr = resample_nib(im_seg, new_size=[pr, pr, pz], new_size_type='mm', interpolation='linear')
+    # Resample to isotropic resolution in the axial plane. Use the minimum pixel dimension as target dimension. Only
+    # the region around the cord is resampled: all the slices are kept, so that slice indices are not changed.
+    im_segr = resample_nib(im_seg, new_size=[pr, pr, pz], new_size_type='mm', interpolation='linear',
+                           roi=im_seg, roi_margin=[ROI_MARGIN, ROI_MARGIN, np.inf])
 
     # Update dimensions from resampled image.
     nx, ny, nz, nt, px, py, pz, pt = im_segr.dim
@@ -66,73 +86,169 @@ def compute_shape(segmentation, angle_correction=True, param_centerline=None, ve
         # here, param_centerline.minmax needs to be False because we need to retrieve the total number of input slices
         _, arr_ctl, arr_ctl_der, fit_results = get_centerline(im_segr, param=param_centerline, verbose=verbose)
 
-    # Loop across z and compute shape analysis
-    for iz in tqdm(range(min_z_index, max_z_index + 1), unit='iter', unit_scale=False, desc="Compute shape analysis",
-                   ascii=True, ncols=80):
-        # Extract 2D patch
-        current_patch = im_segr.data[:, :, iz]
+    # Angles between the centerline and the normal to the slices, computed for all slices at once
+    if angle_correction:
+        angles_AP_rad, angles_RL_rad = _angles_from_derivatives(arr_ctl_der, px, py, pz)
+    else:
+        angles_AP_rad = angles_RL_rad = np.zeros(max_z_index - min_z_index + 1)
+
+    # Only non-empty slices are processed
+    list_iz = [iz for iz in range(min_z_index, max_z_index + 1) if data_seg[:, :, iz].any()]
+    for iz in set(range(min_z_index, max_z_index + 1)) - set(list_iz):
+        logging.debug('Empty slice: {}'.format(iz))
+
+    # Slices are processed (and cached) in batches of consecutive slices
+    batches = {}
+    for iz in list_iz:
+        batches.setdefault(iz // SLICES_PER_CHUNK, []).append(iz)
+    chunks = [batches[i] for i in sorted(batches)]
+
+    # Reuse the shape properties of the batches of slices that were already computed
+    chunk_results = []
+    if cache is not None and cache.enabled:
+        keys = {}
+        for chunk in chunks:
+            params = [_slice_key(data_seg[:, :, iz], angles_AP_rad[iz - min_z_index], angles_RL_rad[iz - min_z_index],
+                                 [px, py, pz], angle_correction) for iz in chunk]
+            keys[chunk[0]] = cache.key('process_seg.slices', params=params)
+        chunks_todo = []
+        for chunk in chunks:
+            manifest = cache.fetch(keys[chunk[0]], outputs=[])
+            if manifest is None:
+                chunks_todo.append(chunk)
+                continue
+            for iz, shape_property in zip(chunk, manifest["result"]):
+                if shape_property is not None:
+                    # the angles are only known up to ANGLE_PRECISION in the cache
+                    shape_property.update(_angle_properties(angles_AP_rad[iz - min_z_index],
+                                                            angles_RL_rad[iz - min_z_index], pz))
+            chunk_results.append((chunk, manifest["result"]))
+        if len(chunks_todo) < len(chunks):
+            logging.info('Reusing cached shape properties of {} slices out of {}'.format(
+                len(list_iz) - sum(len(chunk) for chunk in chunks_todo), len(list_iz)))
+        chunks = chunks_todo
+        list_iz = [iz for chunk in chunks for iz in chunk]
+
+    # Compute shape analysis of the slices, in chunks distributed across processes
+    nb_workers = cpu.pool_size(jobs)
+    if multiprocessing.current_process().daemon:
+        # workers of a multiprocessing.Pool can't have children
+        nb_workers = 1
+    chunk_args = [(data_seg[:, :, chunk], angles_AP_rad[np.array(chunk, dtype=int) - min_z_index],
+                   angles_RL_rad[np.array(chunk, dtype=int) - min_z_index], [px, py, pz], angle_correction)
+                  for chunk in chunks]
+    with tqdm(total=len(list_iz), unit='iter', unit_scale=False, desc="Compute shape analysis", ascii=True,
+              ncols=80) as pbar:
+        if nb_workers > 1 and len(chunks) > 1:
+            with cpu.split(nb_workers):
+                with concurrent.futures.ProcessPoolExecutor(min(nb_workers, len(chunks))) as executor:
+                    futures = dict((executor.submit(_properties_slices, *args), chunk)
+                                   for args, chunk in zip(chunk_args, chunks))
+                    for future in concurrent.futures.as_completed(futures):
+                        chunk_results.append((futures[future], future.result()))
+                        pbar.update(len(futures[future]))
+        else:
+            for args, chunk in zip(chunk_args, chunks):
+                chunk_results.append((chunk, _properties_slices(*args)))
+                pbar.update(len(chunk))
+
+    if cache is not None and cache.enabled and chunks:
+        # One entry per batch of slices. Eviction scans the whole store: only do it once all the batches are stored
+        for chunk, list_shape_property in chunk_results[len(chunk_results) - len(chunks):]:
+            cache.store(keys[chunk[0]], [], result=list_shape_property, evict=False)
+        cache.evict()
+
+    for chunk, list_shape_property in chunk_results:
+        for iz, shape_property in zip(chunk, list_shape_property):
+            if shape_property is not None:
+                # Loop across properties and assign values for function output
+                for property_name in property_list:
+                    shape_properties[property_name][iz] = shape_property[property_name]
+            else:
+                logging.warning('\nNo properties for slice: {}'.format(iz))
+
+    metrics = {}
+    for key, value in shape_properties.items():
+        # Making sure all entries added to metrics have results
+        if not value == []:
+            metrics[key] = Metric(data=np.array(value), label=key)
+
+    return metrics, fit_results
+
+
+def _angles_from_derivatives(arr_ctl_der, px, py, pz):
+    """
+    Compute the angles between the centerline and the normal vector to the axial slices.
+    :param arr_ctl_der: derivatives of the centerline along x and y, for each slice (see centerline.core.get_centerline)
+    :param px, py, pz: pixel dimensions (mm)
+    :return: angle_AP_rad, angle_RL_rad: 1d arrays of angles about the AP and RL axes (rad)
+    """
+    # Tangent vector to the centerline in physical space. atan2 does not depend on its norm, so it is not normalized.
+    tx = np.asarray(arr_ctl_der[0], dtype=np.double) * px
+    ty = np.asarray(arr_ctl_der[1], dtype=np.double) * py
+    # Angle about AP axis (resp. RL axis) between [tx, tz] (resp. [ty, tz]) and the normal vector [0, 1]
+    angle_AP_rad = np.arctan2(tx, pz)
+    angle_RL_rad = np.arctan2(ty, pz)
+    return angle_AP_rad, angle_RL_rad
+
+
+def _properties_slices(data, angles_AP_rad, angles_RL_rad, dim, angle_correction):
+    """
+    Compute shape properties of axial slices, accounting for the angle between the centerline and the slices. Run in
+    the worker processes of compute_shape().
+    :param data: 3d array of the slices (x, y, slice)
+    :param angles_AP_rad, angles_RL_rad: angles of the centerline for each slice (rad)
+    :param dim: [px, py, pz]: pixel dimensions (mm)
+    :param angle_correction: if False, slices are not corrected for the angles
+    :return: list of dict of shape properties (None for slices without properties, see _properties2d)
+    """
+    px, py, pz = dim
+    list_properties = []
+    for i in range(data.shape[2]):
+        current_patch = data[:, :, i]
+        angle_AP_rad, angle_RL_rad = angles_AP_rad[i], angles_RL_rad[i]
         if angle_correction:
-            # Extract tangent vector to the centerline (i.e. its derivative)
-            tangent_vect = np.array([arr_ctl_der[0][iz - min_z_index] * px,
-                                     arr_ctl_der[1][iz - min_z_index] * py,
-                                     pz])
-            # Normalize vector by its L2 norm
-            tangent_vect = tangent_vect / np.linalg.norm(tangent_vect)
-            # Compute the angle about AP axis between the centerline and the normal vector to the slice
-            v0 = [tangent_vect[0], tangent_vect[2]]
-            v1 = [0, 1]
-            angle_AP_rad = np.math.atan2(np.linalg.det([v0, v1]), np.dot(v0, v1))
-            # Compute the angle about RL axis between the centerline and the normal vector to the slice
-            v0 = [tangent_vect[1], tangent_vect[2]]
-            v1 = [0, 1]
-            angle_RL_rad = np.math.atan2(np.linalg.det([v0, v1]), np.dot(v0, v1))
             # Apply affine transformation to account for the angle between the centerline and the normal to the patch
             tform = transform.AffineTransform(scale=(np.cos(angle_RL_rad), np.cos(angle_AP_rad)))
             # Convert to float64, to avoid problems in image indexation causing issues when applying transform.warp
             current_patch = current_patch.astype(np.float64)
             # TODO: make sure pattern does not go extend outside of image border
-            current_patch_scaled = transform.warp(current_patch,
-                                                  tform.inverse,
-                                                  output_shape=current_patch.shape,
-                                                  order=1,
-                                                  )
-        else:
-            current_patch_scaled = current_patch
-            angle_AP_rad, angle_RL_rad = 0.0, 0.0
+            current_patch = transform.warp(current_patch, tform.inverse, output_shape=current_patch.shape, order=1)
         # compute shape properties on 2D patch
-        shape_property = _properties2d(current_patch_scaled, [px, py])
+        shape_property = _properties2d(current_patch, [px, py])
         if shape_property is not None:
             # Add custom fields
-            shape_property['angle_AP'] = angle_AP_rad * 180.0 / math.pi
-            shape_property['angle_RL'] = angle_RL_rad * 180.0 / math.pi
-            shape_property['length'] = pz / (np.cos(angle_AP_rad) * np.cos(angle_RL_rad))
-            # Loop across properties and assign values for function output
-            for property_name in property_list:
-                shape_properties[property_name][iz] = shape_property[property_name]
-        else:
-            logging.warning('\nNo properties for slice: {}'.format(iz))
-
-        """ DEBUG
-        from matplotlib.backends.backend_agg import FigureCanvasAgg as FigureCanvas
-        from matplotlib.figure import Figure
-        fig = Figure()
-        FigureCanvas(fig)
-        ax = fig.add_subplot(111)
-        ax.imshow(current_patch_scaled)
-        ax.grid()
-        ax.set_xlabel('y')
-        ax.set_ylabel('x')
-        fig.savefig('tmp_fig.png')
-        """
-    metrics = {}
-    for key, value in shape_properties.items():
-        # Making sure all entries added to metrics have results
-        if not value == []:
-            metrics[key] = Metric(data=np.array(value), label=key)
+            shape_property.update(_angle_properties(angle_AP_rad, angle_RL_rad, pz))
+        list_properties.append(shape_property)
+    return list_properties
 
-    return metrics, fit_results
+
+def _angle_properties(angle_AP_rad, angle_RL_rad, pz):
+    """
+    :return: dict of the properties of a slice that only depend on the angles of the centerline
+    """
+    return {'angle_AP': float(angle_AP_rad) * 180.0 / math.pi,
+            'angle_RL': float(angle_RL_rad) * 180.0 / math.pi,
+            'length': float(pz / (np.cos(angle_AP_rad) * np.cos(angle_RL_rad)))}
+
+
+def _slice_key(data, angle_AP_rad, angle_RL_rad, dim, angle_correction):
+    """
+    :return: parameters identifying the shape properties of a slice in the cache of compute_shape() (JSON
+        serializable), see _properties_slices()
+    """
+    data = np.ascontiguousarray(data)
+    params = {'data': hashlib.sha256(data.tobytes()).hexdigest(),
+              'shape': data.shape,
+              'dtype': data.dtype.str,
+              'dim': [float(p) for p in dim],
+              'angle_correction': bool(angle_correction)}
+    if angle_correction:
+        params['angles'] = [int(np.round(a / ANGLE_PRECISION)) for a in (angle_AP_rad, angle_RL_rad)]
+    return params
 
 
+@traced(cat="process_seg")
 def _properties2d(image, dim):
     """
     Compute shape property of the input 2D image. Accounts for partial volume information.
@@ -38,6 +38,10 @@ class Slice(object):
 
     __metaclass__ = abc.ABCMeta
 
+    # Margin (mm) around the segmentation of the region that is resampled, along each axis (SAL). None: resample the
+    # whole images.
+    roi_margin = None
+
     def __init__(self, images, p_resample=0.6):
         """
         :param images: list of 3D volumes to be separated into slices.
@@ -45,6 +49,8 @@ class Slice(object):
         logger.info('Resample images to {}x{} mm'.format(p_resample, p_resample))
         self._images = list()
         image_ref = None  # first pass: we don't have a reference image to resample to
+        # Only resample the region around the segmentation (last volume), if this view only displays that region
+        roi = images[-1] if self.roi_margin is not None else None
         for i, image in enumerate(images):
             img = image.copy()
             img.change_orientation('SAL')
@@ -55,7 +61,7 @@ class Slice(object):
                 else:
                     # Otherwise it's an image: use spline interpolation
                     type_img = 'im'
-                img_r = self._resample_slicewise(img, p_resample, type_img=type_img, image_ref=image_ref)
+                img_r = self._resample_slicewise(img, p_resample, type_img=type_img, image_ref=image_ref, roi=roi)
             else:
                 img_r = img.copy()
             self._images.append(img_r)
@@ -291,7 +297,7 @@ class Slice(object):
     def aspect(self):
         return [self.get_aspect(x) for x in self._images]
 
-    def _resample_slicewise(self, image, p_resample, type_img, image_ref=None):
+    def _resample_slicewise(self, image, p_resample, type_img, image_ref=None, roi=None):
         """
         Resample at a fixed resolution to make sure the cord always appears with similar scale, regardless of the native
         resolution of the image. Assumes SAL orientation.
@@ -299,6 +305,8 @@ class Slice(object):
         :param p_resample: float: Resampling resolution in mm
         :param type_img: {'im', 'seg'}: If im, interpolate using spline. If seg, interpolate using linear then binarize.
         :param image_ref: Destination Image() to resample image to.
+        :param roi: Image(): if provided, only the region around its nonzero voxels (see roi_margin) is resampled, the
+            rest of the resampled image is set to zero.
         :return:
         """
         dict_interp = {'im': 'spline', 'seg': 'linear'}
@@ -308,12 +316,14 @@ class Slice(object):
         if image_ref is None:
             # Resample to px x p_resample x p_resample mm (orientation is SAL by convention in QC module)
             nii_r = resample_nib(nii, new_size=[image.dim[4], p_resample, p_resample], new_size_type='mm',
-                                 interpolation=dict_interp[type_img])
+                                 interpolation=dict_interp[type_img], roi=roi, roi_margin=self.roi_margin,
+                                 roi_crop=False)
         # Otherwise, resampling to the space of the reference image
         else:
             # Create nibabel object for reference image
             nii_ref = Nifti1Image(image_ref.data, image_ref.hdr.get_best_affine())
-            nii_r = resample_nib(nii, image_dest=nii_ref, interpolation=dict_interp[type_img])
+            nii_r = resample_nib(nii, image_dest=nii_ref, interpolation=dict_interp[type_img], roi=roi,
+                                 roi_margin=self.roi_margin, roi_crop=False)
         # If resampled image is a segmentation, binarize using threshold at 0.5
         if type_img == 'seg':
             img_r_data = (nii_r.get_data() > 0.5) * 1
@@ -327,6 +337,10 @@ class Slice(object):
 
 class Axial(Slice):
     """The axial representation of a slice"""
+
+    # The mosaic only shows the neighborhood of the cord (by default 15 voxels of 0.6 mm around its center of mass)
+    roi_margin = [np.inf, 20., 20.]
+
     def get_name(self):
         return Axial.__name__
 
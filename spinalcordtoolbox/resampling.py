@@ -19,13 +19,16 @@ import nibabel as nib
 from nibabel.processing import resample_from_to
 
 from spinalcordtoolbox.image import Image
+from spinalcordtoolbox.trace import traced
 
 import sct_utils as sct
 
 logger = logging.getLogger(__name__)
 
 
-def resample_nib(image, new_size=None, new_size_type=None, image_dest=None, interpolation='linear', mode='nearest'):
+@traced(cat="resampling")
+def resample_nib(image, new_size=None, new_size_type=None, image_dest=None, interpolation='linear', mode='nearest',
+                 roi=None, roi_margin=0., roi_crop=True):
     """
     Resample a nibabel or Image object based on a specified resampling factor.
     Can deal with 2d, 3d or 4d image objects.
@@ -40,6 +43,14 @@ def resample_nib(image, new_size=None, new_size_type=None, image_dest=None, inte
         are ignored
     :param interpolation: {'nn', 'linear', 'spline'}. The interpolation type
     :param mode: Outside values are filled with 0 ('constant') or nearest value ('nearest').
+    :param roi: mask (nibabel or Image object, in the same physical space as the input image but not necessarily on the
+        same grid, or array on the grid of the input image): only the part of the output grid covering its nonzero
+        voxels is interpolated, which is much faster when the region is small (eg: the spinal cord).
+    :param roi_margin: float or list of 3 floats: margin (mm) added around the region, along each axis of the output
+        grid. Use np.inf to keep a whole axis. The support of the interpolation (half an input voxel for 'nn', one for
+        'linear') is always added, so that the output values that depend on the region are the same as without roi.
+    :param roi_crop: if True, the output image is cropped to the region (its affine accounts for the crop). Otherwise it
+        has the whole output grid, with zeros outside of the region.
     :return: The resampled nibabel or Image image (depending on the input object type).
     """
 
@@ -99,6 +110,15 @@ def resample_nib(image, new_size=None, new_size_type=None, image_dest=None, inte
         else:
             raise Exception(TypeError)
 
+    if roi is not None and img.ndim in [3, 4]:
+        if img.ndim == 4:
+            reference = (shape_r[:-1], affine_r)
+        reference_full = reference
+        img, reference, offset = _crop_to_roi(img, reference, roi, roi_margin, dict_interp[interpolation])
+        if img.ndim == 4:
+            shape_r, affine_r = tuple(reference[0]) + (shape_r[-1],), reference[1]
+            affine = img.affine
+
     if img.ndim == 3:
         # we use mode 'nearest' to overcome issue #2453
         img_r = resample_from_to(
@@ -119,6 +139,14 @@ def resample_nib(image, new_size=None, new_size_type=None, image_dest=None, inte
         # Create 4d nibabel Image
         img_r = nib.nifti1.Nifti1Image(data4d, affine_r)
 
+    if roi is not None and img.ndim in [3, 4] and not roi_crop:
+        # Put the region back in the whole output grid
+        shape_full, affine_full = _grid(reference_full)
+        data_r = img_r.get_data()
+        data_full = np.zeros(tuple(shape_full[:3]) + data_r.shape[3:], dtype=data_r.dtype)
+        data_full[tuple(slice(o, o + n) for o, n in zip(offset, data_r.shape[:3]))] = data_r
+        img_r = nib.nifti1.Nifti1Image(data_full, affine_full)
+
     # Convert back to proper type
     if type(image) == nib.nifti1.Nifti1Image:
         return img_r
@@ -126,6 +154,87 @@ def resample_nib(image, new_size=None, new_size_type=None, image_dest=None, inte
         return Image(img_r.get_data(), hdr=img_r.header, orientation=image.orientation, dim=img_r.header.get_data_shape())
 
 
+def _grid(reference):
+    """
+    :param reference: nibabel image or tuple (shape, affine)
+    :return: shape, affine of the spatial grid of the reference
+    """
+    if isinstance(reference, tuple):
+        shape, affine = reference
+    else:
+        shape, affine = reference.shape, reference.affine
+    return tuple(int(n) for n in shape[:3]), np.array(affine, dtype=np.float64)
+
+
+def _bbox_corners(lo, hi):
+    """
+    :return: array (4, 8) of the homogeneous voxel coordinates of the corners of the box [lo, hi]
+    """
+    return np.array([[x, y, z, 1.] for x in (lo[0], hi[0]) for y in (lo[1], hi[1]) for z in (lo[2], hi[2])]).T
+
+
+def _crop_to_roi(img, reference, roi, roi_margin, order):
+    """
+    Crop the output grid of resample_nib() to a region, and the input image to the part needed to interpolate it.
+    :param img: input nibabel image
+    :param reference: output grid: nibabel image or tuple (shape, affine)
+    :param roi: mask, see resample_nib()
+    :param roi_margin: margin (mm), see resample_nib(). The support of the interpolation in the input image is added.
+    :param order: order of the interpolation
+    :return: cropped input image, cropped output grid (shape, affine), offset of the cropped grid in the output grid
+    """
+    shape_ref, affine_ref = _grid(reference)
+    if isinstance(roi, Image):
+        data_roi, affine_roi = roi.data, roi.hdr.get_best_affine()
+    elif isinstance(roi, nib.nifti1.Nifti1Image):
+        data_roi, affine_roi = np.asanyarray(roi.dataobj), roi.affine
+    else:
+        data_roi, affine_roi = np.asanyarray(roi), img.affine
+    data_roi = data_roi.reshape(data_roi.shape[:3] + (-1,)).any(axis=3)
+
+    # Bounding box of the region in voxels of the mask (one projection per axis, to avoid listing the voxels)
+    lo, hi = [], []
+    for axis in range(3):
+        index = np.flatnonzero(data_roi.any(axis=tuple(a for a in range(3) if a != axis)))
+        if not len(index):
+            logger.warning("The region to resample is empty: resampling the whole image.")
+            return img, reference, (0, 0, 0)
+        lo.append(index[0])
+        hi.append(index[-1])
+
+    # Bounding box in voxels of the input image, extended by the support of the interpolation (nearest neighbour: half
+    # a voxel, linear: one voxel), so that the output values that depend on the region are all in the cropped grid
+    coords = np.dot(np.linalg.inv(img.affine), np.dot(affine_roi, _bbox_corners(lo, hi)))[:3]
+    support = (order + 1) / 2.
+    coords = _bbox_corners(coords.min(axis=1) - support, coords.max(axis=1) + support)
+
+    # Bounding box in voxels of the output grid, extended by the margin
+    coords = np.dot(np.linalg.inv(affine_ref), np.dot(img.affine, coords))[:3]
+    margin = np.broadcast_to(np.asarray(roi_margin, dtype=np.float64), (3,))
+    margin = margin / np.linalg.norm(affine_ref[:3, :3], axis=0)
+    start = np.clip(np.floor(coords.min(axis=1) - margin), 0, np.array(shape_ref) - 1).astype(int)
+    stop = np.clip(np.ceil(coords.max(axis=1) + margin), start, np.array(shape_ref) - 1).astype(int) + 1
+    affine_crop = affine_ref.copy()
+    affine_crop[:3, 3] = np.dot(affine_ref, np.append(start, 1.))[:3]
+
+    # Part of the input image needed to interpolate the cropped grid (spline interpolation needs a larger neighborhood
+    # to be close to the interpolation of the whole image)
+    pad = order + 2 if order <= 1 else 10
+    coords = np.dot(np.linalg.inv(img.affine), np.dot(affine_crop, _bbox_corners([0, 0, 0], stop - start - 1)))[:3]
+    start_in = np.clip(np.floor(coords.min(axis=1)) - pad, 0, np.array(img.shape[:3])).astype(int)
+    stop_in = np.clip(np.ceil(coords.max(axis=1)) + pad + 1, start_in, np.array(img.shape[:3])).astype(int)
+    if np.any(stop_in <= start_in):
+        # the region is outside of the input image: keep one voxel, the output is set by the mode
+        start_in = np.minimum(start_in, np.array(img.shape[:3]) - 1)
+        stop_in = start_in + 1
+    affine_in = np.array(img.affine, dtype=np.float64)
+    affine_in[:3, 3] = np.dot(affine_in, np.append(start_in, 1.))[:3]
+    data_in = np.asanyarray(img.dataobj)[tuple(slice(a, b) for a, b in zip(start_in, stop_in))]
+    img_crop = nib.nifti1.Nifti1Image(data_in, affine_in, header=img.header)
+
+    return img_crop, (tuple(stop - start), affine_crop), tuple(start)
+
+
 def resample_file(fname_data, fname_out, new_size, new_size_type, interpolation, verbose, fname_ref=None):
     """This function will resample the specified input
     image file to the target size.
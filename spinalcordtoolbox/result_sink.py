@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+# -*- coding: utf-8
+# Append-only storage of results (pandas DataFrames), written as they are produced
+#
+# Results are appended to a part file of a results folder, one part per run (or per process), so that nothing is
+# kept in memory and everything produced so far is kept if the run dies. Parts are Arrow IPC streams when pyarrow
+# is installed (readable up to the last complete batch, unlike Parquet files whose footer is only written when the
+# file is closed), or SQLite databases otherwise (one transaction per append).
+# read_results() reads all the parts of a folder, eg: the results of several partial runs.
+
+from __future__ import absolute_import
+
+import os
+import io
+import glob
+import time
+import sqlite3
+import logging
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+logger = logging.getLogger(__name__)
+
+# Columns added to each row
+COLUMN_INDEX = "_index"
+COLUMN_RUN = "_run"
+
+
+class ResultSink(object):
+    """
+    Writer of one part of a results folder.
+
+    Example:
+
+    .. code:: python
+
+       with ResultSink("results") as sink:
+           for future in concurrent.futures.as_completed(futures):
+               sink.append(future.result())
+       df = read_results("results")
+    """
+    def __init__(self, path, run=None, format=None):
+        """
+        :param path: results folder (created if needed)
+        :param run: name of the run, stored with each row (default: time and pid)
+        :param format: "arrow" or "sqlite" (default: arrow if pyarrow is installed)
+        """
+        self.path = path
+        self.run = run or "{}-{}".format(time.strftime("%Y%m%d%H%M%S"), os.getpid())
+        self.format = format or ("arrow" if pa is not None else "sqlite")
+        if self.format == "arrow" and pa is None:
+            raise ImportError("pyarrow is needed to write results in Arrow format")
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self.count = 0
+        self._writer = None
+        self._file = None
+        self._schema = None
+        self._nb_parts = 0
+        self._db = None
+        self._columns = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+        return False
+
+    def append(self, df):
+        """
+        Append the rows of a DataFrame (its index is stored in the column "_index")
+        """
+        df = df.reset_index(drop=True).assign(**{COLUMN_INDEX: df.index, COLUMN_RUN: self.run})
+        if self.format == "arrow":
+            self._append_arrow(df)
+        else:
+            self._append_sqlite(df)
+        self.count += len(df)
+
+    def _append_arrow(self, df):
+        # objects (eg: lists, mixed types) are stored as strings
+        for column in df.columns:
+            if df[column].dtype == object:
+                df[column] = [v if v is None or isinstance(v, str) else str(v) for v in df[column]]
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        if self._writer is None or not table.schema.equals(self._schema):
+            # a stream has a single schema: rows with other columns go to a new part
+            self._close_arrow()
+            fname = "{}-{:03d}.arrows".format(self.run, self._nb_parts)
+            self._file = io.open(os.path.join(self.path, fname), "wb")
+            self._writer = pa.ipc.new_stream(self._file, table.schema)
+            self._schema = table.schema
+            self._nb_parts += 1
+        self._writer.write_table(table)
+        self._file.flush()
+
+    def _close_arrow(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._file.close()
+            self._writer = self._file = None
+
+    def _append_sqlite(self, df):
+        if self._db is None:
+            self._db = sqlite3.connect(os.path.join(self.path, "{}.sqlite".format(self.run)))
+            self._db.execute('CREATE TABLE results ("{}" TEXT)'.format(COLUMN_RUN))
+            self._columns = [COLUMN_RUN]
+        with self._db:
+            for column in df.columns:
+                if column not in self._columns:
+                    self._db.execute('ALTER TABLE results ADD COLUMN "{}"'.format(column.replace('"', '""')))
+                    self._columns.append(column)
+            query = "INSERT INTO results ({}) VALUES ({})".format(
+             ", ".join('"{}"'.format(c.replace('"', '""')) for c in df.columns), ", ".join("?" * len(df.columns)))
+            self._db.executemany(query, [[_sqlite_value(v) for v in row] for row in df.itertuples(index=False)])
+
+    def close(self):
+        self._close_arrow()
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+
+def _sqlite_value(v):
+    if v is None or isinstance(v, (int, float, str, bytes)):
+        return v
+    if isinstance(v, np.integer):
+        return int(v)
+    if isinstance(v, np.floating):
+        return float(v)
+    return str(v)
+
+
+def _read_arrow(fname):
+    """
+    Read an Arrow stream, up to its last complete batch
+    """
+    if pa is None:
+        raise ImportError("pyarrow is needed to read {}".format(fname))
+    batches = []
+    with io.open(fname, "rb") as f:
+        try:
+            reader = pa.ipc.open_stream(f)
+            for batch in reader:
+                batches.append(batch)
+        except (pa.ArrowInvalid, OSError, IOError) as e:
+            # truncated by an interrupted run
+            logger.warning("Incomplete results {}: {}".format(fname, e))
+    if not batches:
+        return None
+    return pa.Table.from_batches(batches).to_pandas()
+
+
+def _read_sqlite(fname):
+    db = sqlite3.connect(fname)
+    try:
+        return pd.read_sql_query("SELECT * FROM results", db)
+    finally:
+        db.close()
+
+
+def read_results(path, keys=None, runs=None):
+    """
+    Read the results of a folder written by ResultSink.
+    :param path: results folder
+    :param runs: names of the runs to read (default: all)
+    :param keys: columns identifying a result (eg: ["subject", "parameters"]); if set, only the last result (in order
+                 of run) of each key is kept, to aggregate runs that were resumed or re-run
+    :return: DataFrame, indexed like the appended DataFrames, with the name of the run in column "_run"
+    """
+    parts = []
+    for fname in sorted(glob.glob(os.path.join(path, "*.arrows")) + glob.glob(os.path.join(path, "*.sqlite"))):
+        df = _read_arrow(fname) if fname.endswith(".arrows") else _read_sqlite(fname)
+        if df is not None and len(df):
+            parts.append(df)
+    if not parts:
+        return pd.DataFrame()
+    df = pd.concat(parts, ignore_index=True, sort=False)
+    if runs is not None:
+        df = df[df[COLUMN_RUN].isin(runs)]
+    if keys is not None:
+        df = df.drop_duplicates(subset=keys, keep="last")
+    return df.set_index(COLUMN_INDEX).rename_axis(None)
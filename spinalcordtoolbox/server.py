@@ -0,0 +1,301 @@
+#!/usr/bin/env python
+# -*- coding: utf-8
+# Local daemon running SCT commands in a warm process (see sct_server)
+#
+# Starting python, importing numpy/scipy/keras and loading models and templates is a large part of the run time
+# of short commands. The daemon runs commands in a process where all of these are already loaded, and keeps
+# loaded models and templates in memory across commands (see spinalcordtoolbox.utils.get_resident()).
+#
+# The daemon listens on a UNIX socket (no network access), only accessible by the user.
+# When the socket exists, the SCT launcher forwards commands to the daemon (see forward()), and falls back to
+# running them in a new process if the daemon is not available or can't run the command.
+#
+# Protocol: JSON messages, one per line. The client sends {"command", "args", "cwd", "env"}; the server replies
+# {"accepted": bool}, then {"output": str} messages while the command runs, then {"status": int}. Invalid requests
+# are answered with {"accepted": false, "error": str}.
+
+from __future__ import absolute_import
+
+import sys
+import os
+import json
+import errno
+import socket
+import importlib
+import tempfile
+import logging
+
+from spinalcordtoolbox import trace
+
+logger = logging.getLogger(__name__)
+
+# Modules imported by preload()
+PRELOAD_MODULES = ["spinalcordtoolbox.image", "spinalcordtoolbox.resampling", "spinalcordtoolbox.process_seg"]
+PRELOAD_MODULES_DEEPSEG = ["spinalcordtoolbox.deepseg_sc.core", "spinalcordtoolbox.deepseg_gm.deepseg_gm",
+                           "spinalcordtoolbox.deepseg_lesion.core"]
+
+
+def get_socket_path():
+    """
+    :return: path of the daemon socket: $SCT_SERVER_SOCKET, or a per-user path in the temporary directory
+    """
+    path = os.environ.get("SCT_SERVER_SOCKET", None)
+    if path is None:
+        path = os.path.join(tempfile.gettempdir(), "sct_server-{}".format(os.getuid()), "socket")
+    return path
+
+
+def _send(fileobj, message):
+    fileobj.write(json.dumps(message).encode("utf-8") + b"\n")
+    fileobj.flush()
+
+
+def _recv(fileobj):
+    """
+    :return: next message, or None if the connection is closed
+    """
+    line = fileobj.readline()
+    if not line:
+        return None
+    return json.loads(line.decode("utf-8"))
+
+
+def _connect(path_socket):
+    """
+    :return: socket connected to the daemon, or None if it is not running
+    """
+    if not os.path.exists(path_socket):
+        return None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path_socket)
+    except socket.error:
+        sock.close()
+        return None
+    return sock
+
+
+def forward(command, args, env=None, path_socket=None):
+    """
+    Run a command on the daemon, if it is running. The output of the command is written to stdout.
+    :param command: name of the SCT command, e.g. "sct_deepseg_sc"
+    :param args: list of command-line arguments
+    :param env: environment of the command (default: os.environ)
+    :param path_socket: path of the daemon socket (default: get_socket_path())
+    :return: exit status of the command, or None if the daemon is not running or can't run this command
+    """
+    sock = _connect(path_socket or get_socket_path())
+    if sock is None:
+        return None
+    try:
+        fileobj = sock.makefile("rwb")
+        _send(fileobj, {
+         "command": command,
+         "args": list(args),
+         "cwd": os.getcwd(),
+         "env": dict(os.environ if env is None else env),
+        })
+        message = _recv(fileobj)
+        if message is None or not message.get("accepted", False):
+            if message is not None and "error" in message:
+                sys.stderr.write("sct_server: {}\n".format(message["error"]))
+            return None
+        while True:
+            message = _recv(fileobj)
+            if message is None:
+                sys.stderr.write("sct_server: connection lost while running {}\n".format(command))
+                return 1
+            if "output" in message:
+                sys.stdout.write(message["output"])
+                sys.stdout.flush()
+            elif "status" in message:
+                return message["status"]
+    finally:
+        sock.close()
+
+
+def stop(path_socket=None):
+    """
+    Stop the daemon
+    :return: True if the daemon was running
+    """
+    sock = _connect(path_socket or get_socket_path())
+    if sock is None:
+        return False
+    try:
+        fileobj = sock.makefile("rwb")
+        _send(fileobj, {"stop": True})
+        _recv(fileobj)
+    finally:
+        sock.close()
+    return True
+
+
+def is_running(path_socket=None):
+    sock = _connect(path_socket or get_socket_path())
+    if sock is None:
+        return False
+    sock.close()
+    return True
+
+
+class _OutputStream(object):
+    """
+    Text file object sending what is written to the client
+    """
+    def __init__(self, fileobj):
+        self._fileobj = fileobj
+
+    def write(self, data):
+        if data:
+            _send(self._fileobj, {"output": data})
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def isatty(self):
+        return False
+
+
+def preload(names):
+    """
+    Import modules and load data used by commands, so that the first command doesn't have to.
+    :param names: list of items to preload: "deepseg" (keras and deep learning models code), "template" (PAM50
+      template used for vertebral labeling)
+    """
+    for name in PRELOAD_MODULES:
+        importlib.import_module(name)
+
+    if "deepseg" in names:
+        try:
+            for name in PRELOAD_MODULES_DEEPSEG:
+                importlib.import_module(name)
+        except ImportError as e:
+            logger.warning("Could not preload deep learning modules: {}".format(e))
+
+    if "template" in names:
+        from spinalcordtoolbox.utils import __data_dir__
+        from spinalcordtoolbox.vertebrae.core import load_template_data
+        path_template = os.path.join(__data_dir__, "PAM50")
+        for contrast in ("t1", "t2"):
+            try:
+                load_template_data(path_template, contrast)
+            except Exception as e:
+                logger.warning("Could not preload template {} ({}): {}".format(path_template, contrast, e))
+
+
+def serve(path_socket=None):
+    """
+    Run the daemon, until it is stopped with stop().
+    Commands are run one at a time, in the main thread of this process.
+    :param path_socket: path of the daemon socket (default: get_socket_path())
+    """
+    path_socket = path_socket or get_socket_path()
+    if is_running(path_socket):
+        raise RuntimeError("sct_server is already running on {}".format(path_socket))
+
+    # The socket is only accessible by the user
+    path_dir = os.path.dirname(path_socket)
+    try:
+        os.makedirs(path_dir, 0o700)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+    else:
+        os.chmod(path_dir, 0o700)  # the mode of makedirs() is masked by the umask
+    if os.stat(path_dir).st_uid != os.getuid():
+        raise RuntimeError("{} is not owned by the current user".format(path_dir))
+    if os.path.exists(path_socket):
+        os.remove(path_socket)  # stale socket of a daemon that was killed
+
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(path_socket)
+    os.chmod(path_socket, 0o600)
+    server.listen(16)
+    logger.info("sct_server listening on {}".format(path_socket))
+
+    try:
+        while True:
+            conn, _ = server.accept()
+            try:
+                fileobj = conn.makefile("rwb")
+                try:
+                    request = _recv(fileobj)
+                except ValueError as e:
+                    _send(fileobj, {"accepted": False, "error": "invalid request: {}".format(e)})
+                    continue
+                if request is None:
+                    continue
+                error = _check_request(request)
+                if error is not None:
+                    logger.warning("sct_server: {}".format(error))
+                    _send(fileobj, {"accepted": False, "error": error})
+                    continue
+                if request.get("stop", False):
+                    # Stop listening before replying, so that the daemon is seen as stopped once stop() returns
+                    server.close()
+                    os.remove(path_socket)
+                    _send(fileobj, {"stopped": True})
+                    break
+                _run_request(request, fileobj)
+            except (socket.error, IOError) as e:
+                # Client went away
+                logger.warning("sct_server: {}".format(e))
+            except Exception:
+                # The daemon keeps serving the other clients
+                logger.exception("sct_server: error while handling a request")
+            finally:
+                conn.close()
+    finally:
+        server.close()
+        if os.path.exists(path_socket):
+            os.remove(path_socket)
+    logger.info("sct_server stopped")
+
+
+def _check_request(request):
+    """
+    :return: error message if the request is not a valid stop or command request, else None
+    """
+    if not isinstance(request, dict):
+        return "invalid request: not an object"
+    if request.get("stop", False):
+        return None
+    string = (type(u""), str)
+    if not isinstance(request.get("command"), string):
+        return "invalid request: 'command' must be a string"
+    args = request.get("args")
+    if not isinstance(args, list) or not all(isinstance(a, string) for a in args):
+        return "invalid request: 'args' must be a list of strings"
+    env = request.get("env")
+    if not isinstance(env, dict) or not all(isinstance(k, string) and isinstance(v, string) for k, v in env.items()):
+        return "invalid request: 'env' must be an object of strings"
+    cwd = request.get("cwd")
+    if not isinstance(cwd, string) or not os.path.isdir(cwd):
+        return "invalid request: 'cwd' must be an existing directory"
+    return None
+
+
+def _run_request(request, fileobj):
+    import sct_utils as sct
+
+    command = request["command"]
+    code = None if command == "sct_server" else sct._get_entry_point([command])
+    if code is None:
+        _send(fileobj, {"accepted": False})
+        return
+    _send(fileobj, {"accepted": True})
+
+    logger.debug("sct_server: running {} {}".format(command, " ".join(request["args"])))
+    saved_env = dict(os.environ)
+    os.environ.clear()
+    os.environ.update(request["env"])
+    trace.start(name=command, argv=request["args"])
+    try:
+        status, _ = sct.run_inprocess(code, request["args"], cwd=request["cwd"], stream=_OutputStream(fileobj))
+    finally:
+        trace.finish()
+        os.environ.clear()
+        os.environ.update(saved_env)
+    _send(fileobj, {"status": status})
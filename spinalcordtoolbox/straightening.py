@@ -18,6 +18,7 @@ from spinalcordtoolbox.types import Centerline
 import spinalcordtoolbox.image as msct_image
 from spinalcordtoolbox.image import Image
 from spinalcordtoolbox.centerline.core import ParamCenterline, get_centerline
+from spinalcordtoolbox.trace import traced
 
 import sct_utils as sct
 from sct_image import pad_image
@@ -62,6 +63,7 @@ class SpinalCordStraightener(object):
 
         self.template_orientation = 0
 
+    @traced(cat="straightening")
     def straighten(self):
         """
         Straighten spinal cord. Steps: (everything is done in physical space)
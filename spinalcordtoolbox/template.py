@@ -10,14 +10,61 @@ import numpy as np
 logger = logging.getLogger(__name__)
 
 
+class VertLevelIndex(object):
+    """
+    Vertebral level of each slice of a vertebral labeling, computed once, for the lookups of
+    get_slices_from_vertebral_levels() and get_vertebral_level_from_slice(). Build it once per labeling and pass it
+    instead of the image when aggregating several metrics.
+    Important: This class assumes that the 3rd dimension is Z.
+    """
+    def __init__(self, im_vertlevel):
+        """
+        :param im_vertlevel: image object of vertebral labeling (e.g., label/template/PAM50_levels.nii.gz)
+        """
+        data_vertlevel = np.asarray(im_vertlevel.data)
+        nz = data_vertlevel.shape[-1]
+        data_vertlevel = data_vertlevel.reshape(-1, nz)
+        nonzero = data_vertlevel != 0
+        nonzero_finite = nonzero & np.isfinite(data_vertlevel)
+        count = nonzero_finite.sum(axis=0)
+        total = np.where(nonzero_finite, data_vertlevel, 0).sum(axis=0, dtype=np.float64)
+        # average non-null (finite) values and round to closest
+        levels = [int(np.round(total[iz] / count[iz])) if count[iz] else None for iz in range(nz)]
+        # level of each slice, ignoring non-finite values (see get_slices_from_vertebral_levels())
+        self._slices = {}
+        for iz, level in enumerate(levels):
+            if level is not None:
+                self._slices.setdefault(level, []).append(iz)
+        # level of each slice, None if the slice has non-finite values (see get_vertebral_level_from_slice())
+        self._levels = [None if (nonzero[:, iz] != nonzero_finite[:, iz]).any() else level
+                        for iz, level in enumerate(levels)]
+
+    def get_slices(self, level):
+        """
+        :param level: int: vertebral level
+        :return: list of int: slices
+        """
+        return list(self._slices.get(level, []))
+
+    def get_level(self, idx_slice):
+        """
+        :param idx_slice: int: slice (z)
+        :return: int: vertebral level. If no level is found (only zeros on this slice), return None.
+        """
+        return self._levels[idx_slice]
+
+
 def get_slices_from_vertebral_levels(im_vertlevel, level):
     """
     Find the slices of the corresponding vertebral level.
     Important: This function assumes that the 3rd dimension is Z.
-    :param im_vertlevel: image object of vertebral labeling (e.g., label/template/PAM50_levels.nii.gz)
+    :param im_vertlevel: image object of vertebral labeling (e.g., label/template/PAM50_levels.nii.gz), or its
+      VertLevelIndex
     :param level: int: vertebral level
     :return: list of int: slices
     """
+    if isinstance(im_vertlevel, VertLevelIndex):
+        return im_vertlevel.get_slices(level)
     data_vertlevel = im_vertlevel.data
     slices = []
     # loop across z
@@ -39,10 +86,13 @@ def get_vertebral_level_from_slice(im_vertlevel, idx_slice):
     """
     Find the vertebral level of the corresponding slice.
     Important: This function assumes that the 3rd dimension is Z.
-    :param im_vertlevel: image object of vertebral labeling (e.g., label/template/PAM50_levels.nii.gz)
+    :param im_vertlevel: image object of vertebral labeling (e.g., label/template/PAM50_levels.nii.gz), or its
+      VertLevelIndex
     :param idx_slice: int: slice (z)
     :return: int: vertebral level. If no level is found (only zeros on this slice), return None.
     """
+    if isinstance(im_vertlevel, VertLevelIndex):
+        return im_vertlevel.get_level(idx_slice)
     data_vertlevel = im_vertlevel.data
     # average non-null values and round to closest
     try:
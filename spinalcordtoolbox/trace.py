@@ -0,0 +1,204 @@
+#!/usr/bin/env python
+# -*- coding: utf-8
+# Timing and memory trace of SCT commands, in Chrome trace format
+#
+# Tracing is enabled by setting the environment variable SCT_TRACE to the path of the trace file (or by passing
+# "--trace out.json" to any SCT command). Each process records spans (wall time, CPU time, peak RSS, bytes
+# read/written) for the instrumented stages, see span() and traced(). Nested SCT commands (sct.run(), in-process or
+# as subprocesses) record their own spans, which are merged into one trace by the top-level command.
+# The trace can be opened with chrome://tracing or https://ui.perfetto.dev.
+
+from __future__ import absolute_import
+
+import sys
+import os
+import io
+import json
+import time
+import shutil
+import logging
+import tempfile
+import functools
+import threading
+
+logger = logging.getLogger(__name__)
+
+# State of the trace of this process (None if tracing is not enabled)
+_state = None
+
+
+class _TraceState(object):
+    def __init__(self, path, path_parts, is_root, name, argv):
+        self.path = path
+        self.path_parts = path_parts
+        self.is_root = is_root
+        self.name = name
+        self.argv = argv
+        self.events = []
+        self.pid = os.getpid()
+        self.start = _measure()
+
+
+def _maxrss_mb(who):
+    try:
+        import resource
+    except ImportError:
+        return None
+    maxrss = resource.getrusage(who).ru_maxrss
+    return maxrss / (1024. * 1024.) if sys.platform == "darwin" else maxrss / 1024.
+
+
+def _io_counters():
+    try:
+        import psutil
+        counters = psutil.Process().io_counters()
+    except Exception:
+        return 0, 0
+    return getattr(counters, "read_chars", counters.read_bytes), getattr(counters, "write_chars", counters.write_bytes)
+
+
+def _measure(children=False):
+    """
+    :return: wall time (us), CPU time (s) and bytes read/written, of this process (or of its children)
+    """
+    times = os.times()
+    cpu = times[2] + times[3] if children else times[0] + times[1]
+    read, written = (0, 0) if children else _io_counters()
+    return time.time() * 1e6, cpu, read, written
+
+
+def _event(name, cat, m0, m1, args, children=False):
+    try:
+        import resource
+        who = resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF
+    except ImportError:
+        who = None
+    args = dict(args)
+    args["cpu_s"] = round(m1[1] - m0[1], 6)
+    if who is not None:
+        args["peak_rss_mb"] = round(_maxrss_mb(who), 1)
+    if not children:
+        args["read_bytes"] = m1[2] - m0[2]
+        args["written_bytes"] = m1[3] - m0[3]
+    return {
+     "name": name,
+     "cat": cat,
+     "ph": "X",
+     "ts": m0[0],
+     "dur": m1[0] - m0[0],
+     "pid": _state.pid,
+     "tid": threading.current_thread().ident,
+     "args": args,
+    }
+
+
+def is_enabled():
+    return _state is not None
+
+
+def start(name=None, argv=None):
+    """
+    Start tracing this process, if $SCT_TRACE is set. Called by sct_utils.init_sct().
+    The first traced process is the root of the trace; processes it starts write their events in a temporary
+    folder ($SCT_TRACE_DIR), which is merged into the trace file when the root process finishes.
+    :param name: name of the command (default: name of the script)
+    :param argv: arguments of the command (default: sys.argv[1:])
+    """
+    global _state
+    path = os.environ.get("SCT_TRACE", None)
+    if path is None or _state is not None:
+        return
+    path_parts = os.environ.get("SCT_TRACE_DIR", None)
+    is_root = path_parts is None
+    if is_root:
+        path_parts = tempfile.mkdtemp(prefix="sct-trace-")
+        os.environ["SCT_TRACE_DIR"] = path_parts
+    if name is None:
+        name = os.path.splitext(os.path.basename(sys.argv[0]))[0] or "python"
+    _state = _TraceState(os.path.abspath(path), path_parts, is_root, name, sys.argv[1:] if argv is None else argv)
+
+
+def finish():
+    """
+    Stop tracing this process and write its events (in the trace file if this is the root process).
+    """
+    global _state
+    if _state is None:
+        return
+    state = _state
+    state.events.append(_event(state.name, "command", state.start, _measure(), {"argv": state.argv}))
+    state.events.append({"name": "process_name", "ph": "M", "pid": state.pid, "args": {"name": state.name}})
+    _state = None
+
+    if not state.is_root:
+        fname = os.path.join(state.path_parts, "{}-{}.json".format(state.pid, int(time.time() * 1e6)))
+        with io.open(fname, "w", encoding="utf-8") as f:
+            f.write(u"{}".format(json.dumps(state.events)))
+        return
+
+    events = []
+    for fname in sorted(os.listdir(state.path_parts)):
+        with io.open(os.path.join(state.path_parts, fname), "r", encoding="utf-8") as f:
+            events += json.load(f)
+    events += state.events
+    with io.open(state.path, "w", encoding="utf-8") as f:
+        f.write(u"{}".format(json.dumps({"traceEvents": events, "displayTimeUnit": "ms"})))
+    shutil.rmtree(state.path_parts, ignore_errors=True)
+    if os.environ.get("SCT_TRACE_DIR", None) == state.path_parts:
+        del os.environ["SCT_TRACE_DIR"]
+    logger.info("Trace written to {}".format(state.path))
+
+
+class span(object):
+    """
+    Context manager recording a span of the trace (no-op if tracing is not enabled).
+
+    Example:
+
+    .. code:: python
+
+       with span("resample", cat="resampling", shape=data.shape):
+           ...
+
+    :param name: name of the span
+    :param cat: category of the span
+    :param children: if True, the CPU time and peak RSS are those of the child processes (for subprocesses)
+    :param args: extra information stored with the span (JSON serializable)
+    """
+    def __init__(self, name, cat="sct", children=False, **args):
+        self.name = name
+        self.cat = cat
+        self.children = children
+        self.args = args
+        self._m0 = None
+
+    def __enter__(self):
+        if _state is not None:
+            self._m0 = _measure(self.children)
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if self._m0 is not None and _state is not None:
+            if exc_type is not None:
+                self.args["error"] = exc_type.__name__
+            _state.events.append(_event(self.name, self.cat, self._m0, _measure(self.children), self.args,
+                                        self.children))
+        return False
+
+
+def traced(name=None, cat="sct"):
+    """
+    Decorator recording a span for each call of the function (see span())
+    :param name: name of the span (default: module.function)
+    """
+    def decorator(func):
+        span_name = name or "{}.{}".format(func.__module__.split(".")[-1], func.__name__)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _state is None:
+                return func(*args, **kwargs)
+            with span(span_name, cat=cat):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -160,6 +160,104 @@ class CoordinateValue(Coordinate):
         return hash(self.value)
 
 
+class CoordinateArray(object):
+    """
+    Array of coordinates, stored as numpy columns (x, y, z and value) instead of one Coordinate object per point.
+
+    For compatibility, it behaves as a (read-only) sequence of Coordinate: indexing with an int or iterating
+    creates Coordinate objects on the fly. Indexing with a slice or an index array returns a CoordinateArray.
+
+    Example:
+      coords = CoordinateArray(x, y, z, value)
+      coords = coords.sort('value')
+      for coord in coords:
+          print(coord.x, coord.value)
+      coords_avg = coords.average_by_value()
+    """
+    def __init__(self, x=(), y=(), z=(), value=None, coord_class=Coordinate):
+        """
+        :param x, y, z: 1d arrays of coordinates
+        :param value: 1d array of values (default: zeros)
+        :param coord_class: class of the objects generated when indexing/iterating (Coordinate or CoordinateValue)
+        """
+        self.x = np.asarray(x)
+        self.y = np.asarray(y)
+        self.z = np.asarray(z)
+        self.value = np.zeros(len(self.x)) if value is None else np.asarray(value)
+        if not len(self.x) == len(self.y) == len(self.z) == len(self.value):
+            raise ValueError("x, y, z and value must have the same length")
+        self.coord_class = coord_class
+
+    @classmethod
+    def from_coordinates(cls, coordinates, coord_class=Coordinate):
+        """
+        :param coordinates: sequence of Coordinate
+        :return: CoordinateArray
+        """
+        return cls([c.x for c in coordinates], [c.y for c in coordinates], [c.z for c in coordinates],
+                   [c.value for c in coordinates], coord_class=coord_class)
+
+    def __len__(self):
+        return len(self.x)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, (int, np.integer)):
+            return self.coord_class([self.x[idx], self.y[idx], self.z[idx], self.value[idx]])
+        return CoordinateArray(self.x[idx], self.y[idx], self.z[idx], self.value[idx], coord_class=self.coord_class)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __repr__(self):
+        return "CoordinateArray([" + ", ".join(repr(c) for c in self) + "])"
+
+    def to_array(self):
+        """
+        :return: (nb_points x 3) array of x, y, z coordinates, eg. to use with Image.transfo_pix2phys()
+        """
+        return np.stack((self.x, self.y, self.z), axis=1)
+
+    def sort(self, key='value', reverse=False):
+        """
+        :param key: 'x', 'y', 'z' or 'value'
+        :param reverse: sort from larger to smaller
+        :return: sorted CoordinateArray. As with sorted(), the order of coordinates with equal keys is preserved.
+        """
+        if key not in ['x', 'y', 'z', 'value']:
+            raise ValueError("sorting parameter must be either 'x', 'y', 'z' or 'value'")
+        keys = getattr(self, key)
+        if reverse:
+            keys = -keys.astype(np.float64)
+        return self[np.argsort(keys, kind='mergesort')]
+
+    def group_by_value(self):
+        """
+        :return: dict of value -> CoordinateArray of the coordinates with this value
+        """
+        values, inverse = np.unique(self.value, return_inverse=True)
+        order = np.argsort(inverse, kind='mergesort')
+        bounds = np.cumsum(np.bincount(inverse, minlength=len(values)))
+        return dict((value, self[order[start:stop]])
+                    for value, start, stop in zip(values, np.concatenate(([0], bounds[:-1])), bounds))
+
+    def center_of_mass(self):
+        """
+        :return: Coordinate: mean position of the coordinates, with the value of the first one
+        """
+        return self.coord_class([self.x.mean(), self.y.mean(), self.z.mean(), self.value[0]])
+
+    def average_by_value(self):
+        """
+        :return: CoordinateArray of the center of mass of each group of coordinates with the same value, sorted by value
+        """
+        values, inverse, counts = np.unique(self.value, return_inverse=True, return_counts=True)
+        return CoordinateArray(np.bincount(inverse, weights=self.x) / counts,
+                               np.bincount(inverse, weights=self.y) / counts,
+                               np.bincount(inverse, weights=self.z) / counts,
+                               values, coord_class=self.coord_class)
+
+
 class Centerline:
     """
     This class represents a centerline in an image. Its coordinates can be in voxel space as well as in physical space.
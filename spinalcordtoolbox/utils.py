@@ -275,3 +275,25 @@ def parse_num_list_inv(list_int):
             colon_is_present = False
 
     return str_num
+
+
+# Objects that are expensive to load (trained models, template volumes...), see get_resident()
+_resident = {}
+
+
+def get_resident(key, loader, files=()):
+    """
+    Get an object that is expensive to load, loading it only once per process.
+    This is what keeps models and templates in memory across commands run by the sct_server daemon.
+    Note: the object is shared between callers, so it must not be modified.
+    :param key: hashable key identifying the object (e.g. name + parameters)
+    :param loader: function called without arguments to load the object
+    :param files: files the object is loaded from: the object is reloaded if one of them is modified
+    :return: loaded object
+    """
+    from spinalcordtoolbox.trace import span
+    stamp = tuple(os.path.getmtime(f) for f in files)
+    if key not in _resident or _resident[key][0] != stamp:
+        with span("load {}".format(key[0] if isinstance(key, tuple) else key), cat="load"):
+            _resident[key] = (stamp, loader())
+    return _resident[key][1]
@@ -14,6 +14,7 @@ import sct_utils as sct
 from sct_maths import mutual_information, dilate
 
 from spinalcordtoolbox.image import Image
+from spinalcordtoolbox.utils import get_resident
 from spinalcordtoolbox.metadata import get_file_label
 
 
@@ -44,6 +45,33 @@ def label_vert(fname_seg, fname_label, verbose=1):
     label_segmentation(fname_seg, list_disc_z, list_disc_value, verbose=verbose)
 
 
+def _load_readonly(fname):
+    """
+    Load image data as a read-only array, so that it can be safely shared (see get_resident())
+    """
+    data = Image(fname).data
+    data.flags.writeable = False
+    return data
+
+
+def load_template_data(path_template, contrast):
+    """
+    Load the template used for vertebral detection. The data is kept in memory (see get_resident()), so it must not
+    be modified.
+    :param path_template: path to the template folder (e.g. data/PAM50)
+    :param contrast: 't1' or 't2'
+    :return: data_template, data_disc_template: template image and vertebral labeling data
+    """
+    # adjust file names if MNI-Poly-AMU template is used (by default: PAM50)
+    fname_level = get_file_label(os.path.join(path_template, 'template'), 'vertebral labeling', output='filewithpath')
+    fname_template = get_file_label(os.path.join(path_template, 'template'), contrast.upper() + '-weighted template', output='filewithpath')
+    data_template = get_resident(('template_data', fname_template), lambda: _load_readonly(fname_template),
+                                 files=[fname_template])
+    data_disc_template = get_resident(('template_data', fname_level), lambda: _load_readonly(fname_level),
+                                      files=[fname_level])
+    return data_template, data_disc_template
+
+
 def vertebral_detection(fname, fname_seg, contrast, param, init_disc, verbose=1, path_template='', path_output='../',
                         scale_dist=1.):
     """
@@ -62,14 +90,9 @@ def vertebral_detection(fname, fname_seg, contrast, param, init_disc, verbose=1,
     sct.printv('\nLook for template...', verbose)
     sct.printv('Path template: ' + path_template, verbose)
 
-    # adjust file names if MNI-Poly-AMU template is used (by default: PAM50)
-    fname_level = get_file_label(os.path.join(path_template, 'template'), 'vertebral labeling', output='filewithpath')
-    fname_template = get_file_label(os.path.join(path_template, 'template'), contrast.upper() + '-weighted template', output='filewithpath')
-
     # Open template and vertebral levels
     sct.printv('\nOpen template and vertebral levels...', verbose)
-    data_template = Image(fname_template).data
-    data_disc_template = Image(fname_level).data
+    data_template, data_disc_template = load_template_data(path_template, contrast)
 
     # open anatomical volume
     im_input = Image(fname)
@@ -19,6 +19,8 @@ sys.path.append(os.path.join(__sct_dir__, 'scripts'))
 from spinalcordtoolbox import aggregate_slicewise
 from spinalcordtoolbox.process_seg import Metric
 from spinalcordtoolbox.image import Image
+from spinalcordtoolbox.template import VertLevelIndex, get_slices_from_vertebral_levels, \
+    get_vertebral_level_from_slice
 
 
 @pytest.fixture(scope="session")
@@ -99,6 +101,57 @@ def test_aggregate_across_selected_slices(dummy_metrics):
                                                            "types according to the casting rule ''safe''"
 
 
+def test_aggregate_slice_sums():
+    """Test that aggregations derived from per-slice sums match the functions applied on the voxels"""
+    rng = np.random.RandomState(0)
+    data = 100 + rng.rand(4, 3, 10)
+    data[0, 0, 2] = np.nan
+    mask = rng.rand(4, 3, 10, 2)
+    mask[..., 6, :] = 0  # empty slice
+    funcs = (('WA', aggregate_slicewise.func_wa), ('BIN', aggregate_slicewise.func_bin),
+             ('STD', aggregate_slicewise.func_std), ('MAX', aggregate_slicewise.func_max))
+    for perslice in [True, False]:
+        agg_metric = aggregate_slicewise.aggregate_per_slice_or_level(
+            Metric(data=data, label='x'), mask=Metric(data=mask, label='mask'), slices=[1, 2, 3, 5, 6],
+            perslice=perslice, group_funcs=funcs)
+        for slicegroup, agg in agg_metric.items():
+            data_group, mask_group = data[..., slicegroup].copy(), mask[..., slicegroup, :].copy()
+            assert agg['Size [vox]'] == pytest.approx(mask_group.sum())
+            mask_group[~np.isfinite(data_group)] = 0
+            data_group[~np.isfinite(data_group)] = 0
+            for name, func in funcs:
+                if slicegroup == (6,):
+                    assert agg['{}(x)'.format(name)] is None
+                else:
+                    assert agg['{}(x)'.format(name)] == pytest.approx(func(data_group, mask_group)[0], rel=1e-9)
+
+
+def test_aggregate_ml_map_batched():
+    """Test that ML and MAP estimations solved for all slice groups at once match the functions applied on the voxels"""
+    rng = np.random.RandomState(0)
+    data = 100 + rng.rand(4, 3, 10)
+    data[0, 0, 2] = np.nan
+    mask = rng.rand(4, 3, 10, 3)
+    mask[..., 6, :] = 0  # empty slice
+    mask[..., 7, 2] = 0  # label absent from the slice: Xt.X is singular
+    map_clusters = [[0], [1], [1]]
+    funcs = (('ML', aggregate_slicewise.func_ml), ('MAP', aggregate_slicewise.func_map))
+    for perslice in [True, False]:
+        agg_metric = aggregate_slicewise.aggregate_per_slice_or_level(
+            Metric(data=data, label='x'), mask=Metric(data=mask, label='mask'), slices=[1, 2, 5, 6, 7],
+            perslice=perslice, group_funcs=funcs, map_clusters=map_clusters)
+        for slicegroup, agg in agg_metric.items():
+            data_group, mask_group = data[..., slicegroup].copy(), mask[..., slicegroup, :].copy()
+            mask_group[~np.isfinite(data_group)] = 0
+            data_group[~np.isfinite(data_group)] = 0
+            for name, func in funcs:
+                if slicegroup == (6,):
+                    assert agg['{}(x)'.format(name)] is None
+                else:
+                    assert agg['{}(x)'.format(name)] == pytest.approx(
+                        func(data_group, mask_group, map_clusters)[0], rel=1e-6)
+
+
 # noinspection 801,PyShadowingNames
 def test_aggregate_across_all_slices(dummy_metrics):
     """Test extraction of metrics aggregation across slices: All slices by default"""
@@ -148,6 +201,27 @@ def test_aggregate_per_level(dummy_metrics, dummy_vert_level):
     assert agg_metric[(2, 3)] == {'VertLevel': (3,), 'WA()': 40.0}
 
 
+# noinspection 801,PyShadowingNames
+def test_vert_level_index(dummy_vert_level):
+    """Test that VertLevelIndex lookups match the ones on the image"""
+    im_vert_level = dummy_vert_level.copy()
+    im_vert_level.data[0, 0, 3] = 4  # partial volume: mean of 3 and 4
+    im_vert_level.data[0, 0, 5] = np.nan
+    im_vert_level.data[4, 4, 8] = 0  # empty slice
+    vert_level_index = VertLevelIndex(im_vert_level)
+    for level in range(1, 8):
+        assert vert_level_index.get_slices(level) == get_slices_from_vertebral_levels(im_vert_level, level)
+    for iz in range(im_vert_level.data.shape[-1]):
+        assert vert_level_index.get_level(iz) == get_vertebral_level_from_slice(im_vert_level, iz)
+    # the index can be passed instead of the image
+    agg_metric = aggregate_slicewise.aggregate_per_slice_or_level(Metric(data=np.arange(9.)), levels=[2, 3],
+                                                                  perslice=True, vert_level=vert_level_index,
+                                                                  group_funcs=(('WA', aggregate_slicewise.func_wa),))
+    assert agg_metric[(1,)]['VertLevel'] == (2,)
+    assert agg_metric[(2,)] == {'VertLevel': (3,), 'WA()': 2.0}
+    assert (3,) not in agg_metric  # round(3.5) == 4
+
+
 # noinspection 801,PyShadowingNames
 def test_extract_metric(dummy_data_and_labels):
     """Test different estimation methods."""
@@ -192,6 +266,62 @@ def test_extract_metric(dummy_data_and_labels):
     assert agg_metric[list(agg_metric)[0]]['MAP()'] == pytest.approx(20.0, rel=0.01)
 
 
+# noinspection 801,PyShadowingNames
+def test_extract_metric_multilabel(dummy_data_and_labels):
+    """Test that extracting several labels at once gives the same results as one label at a time"""
+    data, labels, label_struc = dummy_data_and_labels
+    for method in ['wa', 'bin', 'max']:
+        for perslice in [True, False]:
+            list_agg_metric = aggregate_slicewise.extract_metric_multilabel(data, labels=labels, perslice=perslice,
+                                                                            method=method, label_struc=label_struc,
+                                                                            ids_label=[0, 2, 99])
+            for id_label, agg_metric in zip([0, 2, 99], list_agg_metric):
+                agg_metric_ref = aggregate_slicewise.extract_metric(data, labels=labels, perslice=perslice,
+                                                                    method=method, label_struc=label_struc,
+                                                                    id_label=id_label)
+                assert sorted(agg_metric) == sorted(agg_metric_ref)
+                for slicegroup in agg_metric_ref:
+                    assert sorted(agg_metric[slicegroup]) == sorted(agg_metric_ref[slicegroup])
+                    for key, value in agg_metric_ref[slicegroup].items():
+                        if isinstance(value, float):
+                            assert agg_metric[slicegroup][key] == pytest.approx(value, rel=1e-9)
+                        else:
+                            assert agg_metric[slicegroup][key] == value
+
+
+def test_extract_metric_multilabel_memory():
+    """Test that the memory used by extract_metric_multilabel() does not grow with the number of voxels times the number
+    of slices, or as several (slice x voxel) matrices"""
+    tracemalloc = pytest.importorskip('tracemalloc')
+    from scipy import sparse
+    nx, ny, nz = 64, 64, 256
+    data = Metric(data=np.random.RandomState(0).rand(nx, ny, nz))
+    labels = np.zeros((nx, ny, nz, 2))
+    labels[30:34, 30:34, :, 0] = 1.
+    labels[32:36, 30:34, 10:20, 1] = 0.5
+    matrix_labels = sparse.csc_matrix(labels.reshape(-1, 2))
+    label_struc = {0: aggregate_slicewise.LabelStruc(id=0, name='label_0'),
+                   1: aggregate_slicewise.LabelStruc(id=1, name='label_1')}
+    tracemalloc.start()
+    try:
+        list_agg_metric = aggregate_slicewise.extract_metric_multilabel(data, labels=matrix_labels, perslice=True,
+                                                                        method='wa', label_struc=label_struc,
+                                                                        ids_label=[0, 1])
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    # a few arrays of one value per voxel (about 8 bytes per voxel each)
+    assert peak < 6 * data.data.nbytes
+    agg_metric_ref = aggregate_slicewise.extract_metric(data, labels=labels, perslice=True, method='wa',
+                                                        label_struc=label_struc, id_label=1)
+    for slicegroup in agg_metric_ref:
+        value = agg_metric_ref[slicegroup]['WA()']
+        if isinstance(value, float):
+            assert list_agg_metric[1][slicegroup]['WA()'] == pytest.approx(value, rel=1e-9)
+        else:
+            assert list_agg_metric[1][slicegroup]['WA()'] == value
+
+
 # noinspection 801,PyShadowingNames
 def test_extract_metric_2d(dummy_data_and_labels_2d):
     """Test different estimation methods."""
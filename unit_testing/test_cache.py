@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# -*- coding: utf-8
+# pytest unit tests for spinalcordtoolbox.cache
+
+from __future__ import print_function, absolute_import
+
+import os, io, time
+
+import pytest
+
+from spinalcordtoolbox.cache import StepCache, get_step_cache
+
+
+def write(path, content):
+    with io.open(path, "wb") as f:
+        f.write(content)
+
+
+def read(path):
+    with io.open(path, "rb") as f:
+        return f.read()
+
+
+@pytest.fixture()
+def workdir(tmpdir):
+    cwd = os.getcwd()
+    os.chdir(str(tmpdir))
+    write("in.txt", b"input")
+    yield tmpdir
+    os.chdir(cwd)
+
+
+def run_step(cache, params, content=b"output"):
+    with cache.step("test", input_files=["in.txt"], params=params, outputs=["out.txt"]) as step:
+        if not step.cached:
+            write("out.txt", content)
+    return step
+
+
+def test_step_cache(workdir):
+    cache = StepCache(str(workdir.join("store")))
+
+    step = run_step(cache, {"a": 1})
+    assert not step.cached
+    os.remove("out.txt")
+    step = run_step(cache, {"a": 1}, content=b"other")
+    assert step.cached
+    assert read("out.txt") == b"output"
+
+    # A changed parameter or input is recomputed
+    assert not run_step(cache, {"a": 2}).cached
+    write("in.txt", b"changed input")
+    assert not run_step(cache, {"a": 1}).cached
+
+
+def test_step_cache_result(workdir):
+    cache = StepCache(str(workdir.join("store")))
+    for i in range(2):
+        with cache.step("test", input_files=["in.txt"]) as step:
+            if not step.cached:
+                write("warp.txt", b"warp")
+                step.outputs = ["warp.txt"]
+                step.result = ["-warp.txt", "warp.txt"]
+        assert step.cached == (i == 1)
+        assert step.result == ["-warp.txt", "warp.txt"]
+
+
+def test_step_cache_exception(workdir):
+    cache = StepCache(str(workdir.join("store")))
+    with pytest.raises(RuntimeError):
+        with cache.step("test", input_files=["in.txt"], outputs=["out.txt"]) as step:
+            assert not step.cached
+            write("out.txt", b"partial")
+            raise RuntimeError()
+    assert cache.entries() == []
+
+
+def test_step_cache_eviction(workdir):
+    cache = StepCache(str(workdir.join("store")), max_size=25)
+    for i in range(3):
+        run_step(cache, {"i": i}, content=b"0123456789")
+        time.sleep(0.01)
+    assert len(cache.entries()) == 2
+    # entry 0 was evicted, entry 1 is now the most recently used
+    assert not run_step(cache, {"i": 0}, content=b"0123456789").cached
+    assert run_step(cache, {"i": 2}, content=b"0123456789").cached
+    assert len(cache.entries()) == 2
+
+
+def test_step_cache_disabled(workdir, monkeypatch):
+    monkeypatch.setenv("SCT_CACHE", "0")
+    monkeypatch.setenv("SCT_CACHE_DIR", str(workdir.join("store")))
+    cache = get_step_cache()
+    run_step(cache, {})
+    assert not run_step(cache, {}).cached
+    assert not workdir.join("store").exists()
@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+# -*- coding: utf-8
+# pytest unit tests for spinalcordtoolbox.cpu
+
+from __future__ import print_function, absolute_import
+
+import os, sys, subprocess, multiprocessing
+
+from spinalcordtoolbox import cpu
+from spinalcordtoolbox.utils import __sct_dir__
+
+
+def test_get_ncpu(monkeypatch):
+    monkeypatch.delenv("SCT_NCPU", raising=False)
+    assert cpu.get_ncpu() == multiprocessing.cpu_count()
+    monkeypatch.setenv("SCT_NCPU", "3")
+    assert cpu.get_ncpu() == 3
+    monkeypatch.setenv("SCT_NCPU", "0")
+    assert cpu.get_ncpu() == 1
+
+
+def test_thread_env(monkeypatch):
+    monkeypatch.setenv("SCT_NCPU", "4")
+    env = cpu.thread_env(env={"OMP_NUM_THREADS": "2", "MKL_NUM_THREADS": "8"})
+    assert env["SCT_NCPU"] == "4"
+    assert env["ITK_GLOBAL_DEFAULT_NUMBER_OF_THREADS"] == "4"
+    # lower values set by the user are kept
+    assert env["OMP_NUM_THREADS"] == "2"
+    assert env["MKL_NUM_THREADS"] == "4"
+
+
+def test_pool_size(monkeypatch):
+    monkeypatch.setenv("SCT_NCPU", "4")
+    assert cpu.pool_size() == 4
+    assert cpu.pool_size(0) == 4
+    assert cpu.pool_size(2) == 2
+    assert cpu.pool_size(16) == 4
+
+
+def test_split(monkeypatch):
+    monkeypatch.setenv("SCT_NCPU", "8")
+    monkeypatch.delenv("ITK_GLOBAL_DEFAULT_NUMBER_OF_THREADS", raising=False)
+    with cpu.split(3) as share:
+        assert share == 2
+        assert cpu.get_ncpu() == 2
+        # processes started in the context get the share of one worker
+        env = dict(os.environ)
+        env["PYTHONPATH"] = __sct_dir__
+        output = subprocess.check_output([sys.executable, "-c",
+         "import os; print(os.environ['ITK_GLOBAL_DEFAULT_NUMBER_OF_THREADS'])"], env=env)
+        assert output.decode().strip() == "2"
+        with cpu.split(4) as share:
+            assert share == 1
+    assert os.environ["SCT_NCPU"] == "8"
+    assert "ITK_GLOBAL_DEFAULT_NUMBER_OF_THREADS" not in os.environ
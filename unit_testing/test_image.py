@@ -673,3 +673,227 @@ def test_sequences(fake_3dimage_sct):
      .save(path_b, mutable=True)
     assert img.absolutepath is not None
     assert img.absolutepath == os.path.abspath(path_b)
+
+
+@pytest.mark.parametrize("ext", [".nii", ".nii.gz"])
+def test_lazy(fake_3dimage_sct, ext):
+    """
+    Test that a lazy image gives the same results as a regular one, reading only what's needed
+    """
+    path_tmp = sct.tmp_create(basename="test_lazy")
+    path = os.path.join(path_tmp, "img" + ext)
+    fake_3dimage_sct.save(path)
+
+    im_ref = msct_image.Image(path)
+    im = msct_image.Image(path, lazy=True)
+    assert im.is_lazy
+    assert im.orientation == im_ref.orientation
+    assert im.dim == im_ref.dim
+
+    for orientation in ("LPI", "ASR", "SLA"):
+        slicer_ref = msct_image.Slicer(im_ref, orientation)
+        slicer = msct_image.Slicer(im, orientation)
+        assert len(slicer) == len(slicer_ref)
+        for idx in range(len(slicer)):
+            assert (slicer[idx] == slicer_ref[idx]).all()
+
+    for axis in ("IS", "SI", "AP", "RL"):
+        slicer_ref = msct_image.SlicerOneAxis(im_ref, axis)
+        slicer = msct_image.SlicerOneAxis(im, axis)
+        for idx in range(len(slicer)):
+            assert (slicer[idx] == slicer_ref[idx]).all()
+
+    crop_spec = dict(((0, (1, 3)), (2, (3, 5))))
+    im_crop_ref = msct_image.spatial_crop(im_ref, crop_spec)
+    im_crop = msct_image.spatial_crop(im, crop_spec)
+    assert (im_crop.data == im_crop_ref.data).all()
+    assert (im_crop.header.get_best_affine() == im_crop_ref.header.get_best_affine()).all()
+
+    # Copies share the on-disk data
+    im_copy = im.copy()
+    assert im_copy.is_lazy
+    assert im.is_lazy
+
+    # Accessing the data loads it
+    assert (im.data == im_ref.data).all()
+    assert not im.is_lazy
+    assert (im_copy.data == im_ref.data).all()
+
+
+def test_change_orientation_nocopy(fake_4dimage_sct):
+    """
+    Test that changing orientation/shape gives views on the source data, and leaves the source untouched
+    """
+    im_src = fake_4dimage_sct.copy()
+    data_src = im_src.data.copy()
+    aff_src = im_src.header.get_best_affine()
+
+    im_dst = msct_image.change_orientation(im_src, "ASR")
+    assert np.shares_memory(im_dst.data, im_src.data)
+    assert im_dst.absolutepath is None
+    assert im_src.orientation == "LPI"
+    assert (im_src.header.get_best_affine() == aff_src).all()
+    assert (im_src.data == data_src).all()
+
+    # Reshaping a (non-contiguous) view
+    shape = im_dst.data.shape[:3] + (1,) + im_dst.data.shape[3:]
+    im_dst2 = msct_image.change_shape(im_dst, shape)
+    assert im_dst2.data.shape == shape
+    assert im_dst2.header.get_data_shape() == shape
+    assert im_dst.data.shape != shape
+
+    im_back = msct_image.change_orientation(im_dst, "LPI")
+    assert (im_back.data == data_src).all()
+
+
+def test_save_gz(fake_4dimage_sct):
+    """
+    Test saving .nii.gz files with the multi-threaded gzip writer, and overwriting a memory-mapped file
+    """
+    import gzip, io
+    from spinalcordtoolbox.gzip_writer import ParallelGzipWriter
+
+    path_tmp = sct.tmp_create(basename="test_save_gz")
+
+    # Small blocks, to get a multi-member gzip stream
+    payload = np.arange(100000, dtype=np.int32).tobytes()
+    path = os.path.join(path_tmp, "blocks.gz")
+    with io.open(path, "wb") as f, ParallelGzipWriter(f, level=1, nb_threads=3, block_size=1000) as gz:
+        for i in range(0, len(payload), 777):
+            gz.write(payload[i:i + 777])
+        assert gz.tell() == len(payload)
+    with gzip.open(path, "rb") as f:
+        assert f.read() == payload
+
+    im_src = fake_4dimage_sct.copy()
+    for compression_level in (None, 1, 9):
+        path = os.path.join(path_tmp, "img_{}.nii.gz".format(compression_level))
+        im_src.save(path, compression_level=compression_level)
+        img = nibabel.load(path)
+        assert (img.get_data() == im_src.data).all()
+        assert (img.affine == im_src.header.get_best_affine()).all()
+
+    # Overwrite a file which is memory-mapped by the data to save
+    path = os.path.join(path_tmp, "img.nii")
+    im_src.save(path)
+    im = msct_image.Image(path)
+    assert isinstance(im.data, np.memmap)
+    im.change_orientation("RPI").save(path)
+    im = msct_image.Image(path).change_orientation("LPI")
+    assert (im.data == im_src.data).all()
+
+
+def test_transfo_batched(fake_3dimage_sct):
+    """
+    Test the batched coordinate transforms against a per-point computation
+    """
+    im = fake_3dimage_sct.copy()
+    aff = np.array([[0.5, 0.1, 0, -10], [0, 0.8, 0.2, 5], [0.1, 0, 2, 3], [0, 0, 0, 1]])
+    im.header.set_sform(aff)
+    im.header.set_qform(aff)
+    aff = im.header.get_best_affine()
+
+    coordi = np.random.RandomState(0).uniform(-5, 15, size=(1000, 3))
+    expected = np.array([np.matmul(aff, np.append(c, 1))[:3] for c in coordi])
+    assert np.allclose(im.transfo_pix2phys(coordi), expected)
+    assert np.allclose(msct_image.apply_affine(aff, coordi, chunk_size=7), expected)
+    assert im.transfo_pix2phys(coordi, dtype=np.float32).dtype == np.float32
+    assert np.allclose(im.transfo_pix2phys(coordi, dtype=np.float32), expected, atol=1e-3)
+    assert np.allclose(im.transfo_phys2pix(expected, real=False), coordi)
+    assert (im.transfo_phys2pix(expected) == np.int32(np.round(coordi))).all()
+    assert im.transfo_pix2phys([[1, 2, 3]]).shape == (1, 3)
+
+    # Interpolating on its own grid gives the image back, whatever the slab size
+    for chunk_size in (1, 100, 2**20):
+        for interpolation_mode in (0, 1):
+            im_out = im.interpolate_from_image(im, interpolation_mode=interpolation_mode, border="nearest", chunk_size=chunk_size)
+            assert np.allclose(im_out.data, im.data)
+
+    # Nearest neighbour interpolation keeps the type of the data (and its values), other modes give float32
+    for dtype in (np.uint8, np.int16, np.float64):
+        im.data = (np.arange(im.data.size) % 200).reshape(im.data.shape).astype(dtype)
+        im_out = im.interpolate_from_image(im, interpolation_mode=0, border="nearest")
+        assert im_out.data.dtype == dtype
+        assert np.array_equal(im_out.data, im.data)
+        assert im.interpolate_from_image(im, interpolation_mode=1, border="nearest").data.dtype == np.float32
+
+
+def test_nonzero_coordinates(fake_3dimage_sct):
+    """
+    Test getNonZeroCoordinates() and getCoordinatesAveragedByValue() against a per-voxel implementation
+    """
+    from spinalcordtoolbox.types import Coordinate, CoordinateValue, CoordinateArray
+
+    im = fake_3dimage_sct.copy()
+    im.data = np.zeros(im.data.shape)
+    im.data[1, 2, 3] = 2
+    im.data[4, 2, 1] = 1
+    im.data[2, 6, 3] = 2
+    im.data[0, 0, 8] = 3
+    im.data[3, 3, 3] = 1
+
+    X, Y, Z = (im.data > 0).nonzero()
+    expected = [Coordinate([X[i], Y[i], Z[i], im.data[X[i], Y[i], Z[i]]]) for i in range(len(X))]
+
+    coords = im.getNonZeroCoordinates()
+    assert isinstance(coords, CoordinateArray)
+    assert len(coords) == 5
+    assert list(coords) == expected
+    assert [c.value for c in coords] == [c.value for c in expected]
+    assert coords[-1] == expected[-1]
+    assert list(coords[1:3]) == expected[1:3]
+
+    for sorting in ('x', 'y', 'z', 'value'):
+        for reverse in (False, True):
+            coords = im.getNonZeroCoordinates(sorting=sorting, reverse_coord=reverse)
+            expected_sorted = sorted(expected, key=lambda obj: getattr(obj, sorting), reverse=reverse)
+            assert list(coords) == expected_sorted
+    with pytest.raises(ValueError):
+        im.getNonZeroCoordinates(sorting='t')
+
+    assert isinstance(im.getNonZeroCoordinates(coordValue=True)[0], CoordinateValue)
+
+    coords_avg = im.getCoordinatesAveragedByValue()
+    assert [c.value for c in coords_avg] == [1, 2, 3]
+    assert [(c.x, c.y, c.z) for c in coords_avg] == [(3.5, 2.5, 2), (1.5, 4, 3), (0, 0, 8)]
+
+    groups = im.getNonZeroCoordinates().group_by_value()
+    assert sorted(groups.keys()) == [1, 2, 3]
+    assert list(groups[2]) == [Coordinate([1, 2, 3, 2]), Coordinate([2, 6, 3, 2])]
+    assert groups[2].center_of_mass().y == 4
+
+
+def test_metadata_cache(fake_3dimage_sct, monkeypatch):
+    """
+    Test that header-derived metadata is cached, and invalidated when the header changes
+    """
+    calls = []
+    get_orientation = msct_image.get_orientation
+    monkeypatch.setattr(msct_image, "get_orientation", lambda im: calls.append(1) or get_orientation(im))
+
+    im = fake_3dimage_sct.copy()
+    assert im.orientation == "LPI"
+    assert im.orientation == "LPI"
+    assert im.dim[:3] == (7, 8, 9)
+    assert len(calls) == 1
+
+    # Mutations
+    im.change_orientation("RPI")
+    assert im.orientation == "RPI"
+    assert (im.affine == im.header.get_best_affine()).all()
+    assert len(calls) == 2
+
+    im.hdr.set_qform(np.eye(4))
+    im.hdr.set_sform(np.eye(4))
+    assert im.orientation == "LPI"
+    assert len(calls) == 3
+
+    im.change_shape(im.data.shape + (1,))
+    assert im.dim[3] == 1
+    im.header = fake_3dimage_sct.header.copy()
+    assert im.orientation == "LPI"
+    assert len(calls) == 4
+
+    # The returned affine can't alter the cache
+    im.affine[0, 3] = 10
+    assert im.affine[0, 3] == 0
@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+# -*- coding: utf-8
+# pytest unit tests for spinalcordtoolbox.jobqueue
+
+from __future__ import print_function, absolute_import
+
+import os, time, multiprocessing
+
+from spinalcordtoolbox.jobqueue import JobQueue
+
+
+def square(args):
+    time.sleep(0.01)
+    return {"value": args[0] ** 2, "pid": os.getpid()}
+
+
+def crash(args):
+    raise RuntimeError("crash")
+
+
+def worker(path_queue):
+    JobQueue(path_queue).work(square, poll=0.05)
+
+
+def test_jobqueue_workers(tmpdir):
+    path_queue = str(tmpdir.join("queue"))
+    queue = JobQueue(path_queue)
+    assert queue.submit(dict(("job{:02d}".format(i), [i]) for i in range(20))) == 20
+
+    processes = [multiprocessing.Process(target=worker, args=(path_queue,)) for i in range(4)]
+    for p in processes:
+        p.start()
+    for p in processes:
+        p.join()
+        assert p.exitcode == 0
+
+    assert queue.status() == {"todo": 0, "running": 0, "done": 20, "failed": 0}
+    results = dict(queue.results())
+    assert [results["job{:02d}".format(i)]["value"] for i in range(20)] == [i ** 2 for i in range(20)]
+    assert len(set(r["pid"] for r in results.values())) > 1
+
+    # resume: done jobs are not submitted again
+    assert queue.submit({"job00": [0], "job20": [20]}) == 1
+    assert queue.work(square) == 1
+
+
+def test_jobqueue_stale_lease(tmpdir):
+    queue = JobQueue(str(tmpdir), lease_timeout=1.)
+    queue.submit({"a": [2], "b": [3]})
+    # a worker leases a job, then dies
+    dead = JobQueue(str(tmpdir), worker="dead")
+    job = dead.lease()
+    assert job.id == "a" and job.attempts == 1
+    old = time.time() - 10
+    os.utime(os.path.join(str(tmpdir), "running", "a.json"), (old, old))
+
+    assert queue.work(square) == 2
+    assert dict((k, v["value"]) for k, v in queue.results()) == {"a": 4, "b": 9}
+    # the dead worker can't send heartbeats anymore
+    assert not dead.heartbeat(job)
+
+
+def test_jobqueue_failure(tmpdir):
+    queue = JobQueue(str(tmpdir), max_attempts=2)
+    queue.submit({"a": [1]})
+    assert queue.work(crash) == 2
+    assert queue.status()["failed"] == 1
+    assert queue.retry_failed() == 1
+    assert queue.work(square) == 1
+    assert queue.status() == {"todo": 0, "running": 0, "done": 1, "failed": 0}
+
+
+def test_jobqueue_lease_old_job(tmpdir):
+    queue = JobQueue(str(tmpdir), lease_timeout=1.)
+    queue.submit({"a": [2]})
+    # the job waited longer than lease_timeout: its lease is not taken as expired
+    old = time.time() - 10
+    os.utime(os.path.join(str(tmpdir), "todo", "a.json"), (old, old))
+    assert queue.lease().id == "a"
+    assert queue.reclaim_stale() == 0
+    assert queue.status() == {"todo": 0, "running": 1, "done": 0, "failed": 0}
+
+
+def test_jobqueue_fail_after_reclaim(tmpdir):
+    slow = JobQueue(str(tmpdir), lease_timeout=1., worker="slow")
+    other = JobQueue(str(tmpdir), lease_timeout=1., worker="other")
+    slow.submit({"a": [2]})
+    job = slow.lease()
+    old = time.time() - 10
+    os.utime(os.path.join(str(tmpdir), "running", "a.json"), (old, old))
+    # the lease of the slow worker expired, and the job was leased again by another worker
+    assert other.reclaim_stale() == 1
+    job_other = other.lease()
+    assert job_other.attempts == 2
+    assert not slow.fail(job, "error")
+    assert slow.status() == {"todo": 0, "running": 1, "done": 0, "failed": 0}
+    assert other.fail(job_other, "error")
+    assert other.status() == {"todo": 1, "running": 0, "done": 0, "failed": 0}
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# -*- coding: utf-8
+# pytest unit tests for spinalcordtoolbox.metrics_db
+
+from __future__ import absolute_import
+
+import os
+import multiprocessing
+
+import numpy as np
+import pytest
+
+from spinalcordtoolbox.metrics_db import is_metrics_db, connect, save_as_sqlite, read_metrics
+
+
+def agg_metric(area):
+    """
+    :return: output of aggregate_per_slice_or_level() across vertebral levels 2 and 3
+    """
+    return {(0, 1, 2, 3): {'VertLevel': (2, 3), 'MEAN(area)': area, 'STD(area)': np.float64(1.5),
+                           'MEAN(angle_AP)': 'Weights sum to zero, can\'t be normalized'}}
+
+
+def save_subject(args):
+    fname, subject = args
+    save_as_sqlite(agg_metric(70. + int(subject[-2:])), fname, fname_in='{}_seg.nii.gz'.format(subject),
+                   subject=subject)
+
+
+def test_is_metrics_db():
+    assert is_metrics_db('csa.sqlite')
+    assert is_metrics_db('results/csa.DB')
+    assert not is_metrics_db('csa.csv')
+
+
+def test_save_as_sqlite(tmpdir):
+    fname = str(tmpdir.join('metrics.sqlite'))
+    save_as_sqlite(agg_metric(70.), fname, fname_in='seg.nii.gz', subject='sub-01')
+    df = read_metrics(fname)
+    assert len(df) == 3
+    row = df[(df['function'] == 'MEAN') & (df['metric'] == 'area')].iloc[0]
+    assert (row['subject'], row['filename'], row['slices'], row['slice_min'], row['slice_max'], row['vert_levels'],
+            row['value']) == ('sub-01', 'seg.nii.gz', '0:3', 0, 3, '2:3', 70.)
+    row = df[df['metric'] == 'angle_AP'].iloc[0]
+    assert np.isnan(row['value']) and row['error'] == 'Weights sum to zero, can\'t be normalized'
+
+    # append, then replace the results of the input file
+    save_as_sqlite(agg_metric(71.), fname, fname_in='seg.nii.gz', subject='sub-01', append=True)
+    assert list(read_metrics(fname, metric='area', function='MEAN')['value']) == [70., 71.]
+    save_as_sqlite(agg_metric(72.), fname, fname_in='seg.nii.gz', subject='sub-01')
+    assert list(read_metrics(fname, metric='area', function='MEAN')['value']) == [72.]
+
+    with pytest.raises(ValueError):
+        read_metrics(fname, foo='bar')
+    with pytest.raises(IOError):
+        read_metrics(str(tmpdir.join('missing.sqlite')))
+
+
+def test_save_as_sqlite_parallel(tmpdir):
+    fname = str(tmpdir.join('metrics.sqlite'))
+    subjects = ['sub-{:02d}'.format(i) for i in range(16)]
+    pool = multiprocessing.Pool(4)
+    try:
+        pool.map(save_subject, [(fname, subject) for subject in subjects])
+    finally:
+        pool.close()
+        pool.join()
+    df = read_metrics(fname, metric='area', function='MEAN', vert_levels='2:3')
+    assert sorted(df['subject']) == subjects
+    assert df['value'].mean() == pytest.approx(77.5)
+
+
+def test_read_metrics_while_writing(tmpdir):
+    fname = str(tmpdir.join('metrics.sqlite'))
+    save_as_sqlite(agg_metric(70.), fname, fname_in='seg.nii.gz', subject='sub-01')
+    # another process holds the write lock: reading neither waits for it nor modifies the database
+    db = connect(fname, timeout=0.)
+    db.execute("BEGIN IMMEDIATE")
+    try:
+        mtime = os.path.getmtime(fname)
+        assert list(read_metrics(fname, metric='area', function='MEAN')['value']) == [70.]
+        assert os.path.getmtime(fname) == mtime
+    finally:
+        db.execute("ROLLBACK")
+        db.close()
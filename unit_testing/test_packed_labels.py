@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+# -*- coding: utf-8
+# pytest unit tests for spinalcordtoolbox.packed_labels
+
+from __future__ import absolute_import
+
+import os
+import io
+import time
+
+import pytest
+import numpy as np
+import nibabel as nib
+
+from spinalcordtoolbox.image import Image
+from spinalcordtoolbox.metadata import InfoLabel
+from spinalcordtoolbox.aggregate_slicewise import Metric, LabelStruc, extract_metric_multilabel
+from spinalcordtoolbox.packed_labels import pack_labels, open_packed_labels, PACKED_LABELS_FILE
+
+
+@pytest.fixture()
+def label_folder(tmpdir):
+    """
+    :return: label folder with 3 labels, which are not in RPI orientation
+    """
+    path = str(tmpdir)
+    rng = np.random.RandomState(0)
+    affine = np.diag([-1., 1., 1., 1.])
+    indiv_labels = []
+    for i in range(3):
+        data = rng.rand(6, 7, 8).astype(np.float32)
+        data[data < 0.7] = 0
+        filename = 'atlas_{:02d}.nii.gz'.format(i)
+        nib.save(nib.nifti1.Nifti1Image(data, affine), os.path.join(path, filename))
+        indiv_labels.append((i, 'label {}'.format(i), filename))
+    with io.open(os.path.join(path, 'info_label.txt'), 'wb') as f:
+        InfoLabel(indiv_labels=indiv_labels, combined_labels=[(50, 'all', [0, 1, 2])]).save(f)
+    return path
+
+
+def load_labels(path):
+    return np.stack([Image(os.path.join(path, 'atlas_{:02d}.nii.gz'.format(i))).change_orientation('RPI').data
+                     for i in range(3)], axis=-1)
+
+
+def test_pack_labels(label_folder):
+    pack_labels(label_folder)
+    packed = open_packed_labels(label_folder)
+    labels = load_labels(label_folder)
+    assert packed.shape == labels.shape[:3]
+    assert [label[2] for label in packed.labels] == ['atlas_00.nii.gz', 'atlas_01.nii.gz', 'atlas_02.nii.gz']
+    assert packed.info_label._combined_labels == [(50, 'all', [0, 1, 2])]
+    np.testing.assert_array_equal(packed.dense(), labels)
+    np.testing.assert_array_equal(packed.label_data(1), labels[..., 1])
+    np.testing.assert_array_equal(packed.matrix().toarray(), labels.reshape(-1, 3))
+
+
+def test_pack_labels_outdated(label_folder):
+    assert open_packed_labels(label_folder) is None
+    pack_labels(label_folder)
+    assert os.path.isfile(os.path.join(label_folder, PACKED_LABELS_FILE))
+    time.sleep(0.01)
+    fname = os.path.join(label_folder, 'atlas_01.nii.gz')
+    nib.save(nib.load(fname), fname)
+    assert open_packed_labels(label_folder) is None
+
+
+def test_extract_metric_packed(label_folder):
+    pack_labels(label_folder)
+    labels = load_labels(label_folder)
+    data = Metric(data=np.random.RandomState(1).rand(*labels.shape[:3]))
+    label_struc = {0: LabelStruc(id=0, name='label 0'),
+                   1: LabelStruc(id=1, name='label 1'),
+                   50: LabelStruc(id=[0, 1, 2], name='all')}
+    list_agg_metric_ref = extract_metric_multilabel(data, labels=labels, label_struc=label_struc, ids_label=[0, 1, 50])
+    list_agg_metric = extract_metric_multilabel(data, labels=open_packed_labels(label_folder).matrix(),
+                                                label_struc=label_struc, ids_label=[0, 1, 50])
+    for agg_metric, agg_metric_ref in zip(list_agg_metric, list_agg_metric_ref):
+        for slicegroup in agg_metric_ref:
+            for key, value in agg_metric_ref[slicegroup].items():
+                if isinstance(value, float):
+                    assert agg_metric[slicegroup][key] == pytest.approx(value)
+                else:
+                    assert agg_metric[slicegroup][key] == value
@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+# -*- coding: utf-8
+# pytest unit tests for spinalcordtoolbox.pipeline
+
+from __future__ import print_function, absolute_import
+
+import sys, os, io
+
+import pytest
+import numpy as np
+import nibabel
+
+from spinalcordtoolbox.utils import __sct_dir__
+sys.path.append(os.path.join(__sct_dir__, 'scripts'))
+from spinalcordtoolbox.pipeline import Pipeline, Step
+
+# concatenates its inputs into its output, and records the run in ../runs.txt
+tool_code = """
+import sys, io
+content = "".join(io.open(p).read() for p in sys.argv[2:])
+if "fail" in content:
+    sys.exit(1)
+io.open(sys.argv[1], "w").write(content + sys.argv[1] + ";")
+io.open("../runs.txt", "a").write(sys.argv[1] + "\\n")
+"""
+
+
+def write(path, content):
+    with io.open(str(path), "w") as f:
+        f.write(content)
+
+
+def read(path):
+    with io.open(str(path), "r") as f:
+        return f.read()
+
+
+@pytest.fixture()
+def dataset(tmpdir):
+    write(tmpdir.join("tool.py"), tool_code)
+    for subject in ("sub-01", "sub-02"):
+        tmpdir.mkdir(subject).mkdir("anat")
+        write(tmpdir.join(subject, "anat", "in.txt"), subject)
+    return tmpdir
+
+
+def get_pipeline(dataset):
+    tool = "{} {}".format(sys.executable, dataset.join("tool.py"))
+    return Pipeline([
+     # declared out of order, scheduled from their inputs
+     Step("c", tool + " c.txt a.txt b.txt", inputs=["a.txt", "b.txt"], outputs=["c.txt"], folder="anat"),
+     Step("a", tool + " a.txt in.txt", inputs=["in.txt"], outputs=["a.txt"], folder="anat"),
+     Step("b", tool + " b.txt a.txt", inputs=["a.txt"], outputs=["b.txt"], folder="anat"),
+    ])
+
+
+def runs(dataset, subject):
+    path = dataset.join(subject, "runs.txt")
+    return read(path).split() if path.exists() else []
+
+
+def statuses(results):
+    return dict(((r.subject, r.step), r.status) for r in results)
+
+
+def test_pipeline_dependencies(dataset):
+    pipe = get_pipeline(dataset)
+    assert pipe.dependencies == {"a": set(), "b": set(["a"]), "c": set(["a", "b"])}
+    assert pipe.downstream(["b"]) == set(["b", "c"])
+    with pytest.raises(ValueError):
+        Pipeline([Step("a", "", inputs=["b"], outputs=["a"]), Step("b", "", inputs=["a"], outputs=["b"])])
+
+
+def test_pipeline_incremental(dataset):
+    pipe = get_pipeline(dataset)
+    results = pipe.run(str(dataset), jobs=2)
+    assert set(statuses(results).values()) == set(["done"])
+    for subject in ("sub-01", "sub-02"):
+        assert runs(dataset, subject) == ["a.txt", "b.txt", "c.txt"]
+    assert read(dataset.join("sub-01", "anat", "c.txt")) == "sub-01a.txt;sub-01a.txt;b.txt;c.txt;"
+
+    # nothing changed
+    results = pipe.run(str(dataset), jobs=2)
+    assert set(statuses(results).values()) == set(["up-to-date"])
+
+    # changed input of b: only b and c run again, for this subject only
+    write(dataset.join("sub-01", "anat", "a.txt"), "edited;")
+    assert set(r.step for r in pipe.run(str(dataset), dry_run=True) if r.status == "outdated") == set(["b", "c"])
+    results = statuses(pipe.run(str(dataset), jobs=2))
+    assert results["sub-01", "a"] == "up-to-date" and results["sub-01", "c"] == "done"
+    assert runs(dataset, "sub-01") == ["a.txt", "b.txt", "c.txt", "b.txt", "c.txt"]
+    assert runs(dataset, "sub-02") == ["a.txt", "b.txt", "c.txt"]
+
+    # forced step whose output does not change: downstream steps are up to date
+    results = statuses(pipe.run(str(dataset), subjects=["sub-02"], force=["b"]))
+    assert results["sub-02", "b"] == "done" and results["sub-02", "c"] == "up-to-date"
+
+
+def test_pipeline_failure(dataset):
+    pipe = get_pipeline(dataset)
+    write(dataset.join("sub-02", "anat", "in.txt"), "fail")
+    results = statuses(pipe.run(str(dataset), jobs=2))
+    assert results["sub-01", "c"] == "done"
+    assert results["sub-02", "a"] == "failed"
+    assert results["sub-02", "b"] == results["sub-02", "c"] == "skipped"
+    assert dataset.join("sub-02", ".sct_pipeline", "a.log").exists()
+
+    # resume: only the failed subject runs
+    write(dataset.join("sub-02", "anat", "in.txt"), "sub-02")
+    results = statuses(pipe.run(str(dataset), jobs=2))
+    assert results["sub-01", "c"] == "up-to-date"
+    assert results["sub-02", "c"] == "done"
+
+
+def test_pipeline_sct_step(dataset):
+    """SCT tools run as steps of the pipeline"""
+    data = np.arange(5 * 6 * 7, dtype=np.float32).reshape((5, 6, 7))
+    for subject in ("sub-01", "sub-02"):
+        nibabel.save(nibabel.Nifti1Image(data, np.eye(4)), str(dataset.join(subject, "anat", "t2.nii.gz")))
+    pipe = Pipeline([
+     Step("add", "sct_maths -i t2.nii.gz -add 1 -o t2_add.nii.gz",
+          inputs=["t2.nii.gz"], outputs=["t2_add.nii.gz"], folder="anat"),
+     Step("mean", "sct_maths -i t2_add.nii.gz -mean z -o t2_mean.nii.gz",
+          inputs=["t2_add.nii.gz"], outputs=["t2_mean.nii.gz"], folder="anat"),
+    ])
+    results = pipe.run(str(dataset), jobs=2)
+    assert set(statuses(results).values()) == set(["done"]), read(dataset.join("sub-01", ".sct_pipeline", "add.log"))
+    data_mean = nibabel.load(str(dataset.join("sub-02", "anat", "t2_mean.nii.gz"))).get_data()
+    np.testing.assert_allclose(np.squeeze(data_mean), np.mean(data + 1, axis=2), rtol=1e-5)
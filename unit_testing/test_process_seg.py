@@ -16,6 +16,7 @@ from spinalcordtoolbox.utils import __sct_dir__
 sys.path.append(os.path.join(__sct_dir__, 'scripts'))
 from spinalcordtoolbox import process_seg
 from spinalcordtoolbox.centerline.core import ParamCenterline
+from spinalcordtoolbox.cache import StepCache
 
 from create_test_data import dummy_segmentation
 
@@ -113,6 +114,57 @@ def test_compute_shape(im_seg, expected, params):
         assert obtained_value == expected_value
 
 
+def test_compute_shape_parallel(monkeypatch):
+    im_seg = dummy_segmentation(size_arr=(64, 64, 50), shape='ellipse', radius_RL=13.0, radius_AP=5.0,
+                                angle_RL=-10.0, angle_AP=15.0)
+    im_seg.data[:, :, 20] = 0  # empty slice
+    metrics_serial, _ = process_seg.compute_shape(im_seg, param_centerline=ParamCenterline(), verbose=VERBOSE, jobs=1)
+    monkeypatch.setenv("SCT_NCPU", "3")
+    metrics, _ = process_seg.compute_shape(im_seg, param_centerline=ParamCenterline(), verbose=VERBOSE, jobs=3)
+    for key in metrics_serial:
+        np.testing.assert_array_equal(metrics[key].data, metrics_serial[key].data)
+    assert math.isnan(metrics['area'].data[20])
+
+
+def test_compute_shape_cache(tmpdir, monkeypatch):
+    im_seg = dummy_segmentation(size_arr=(64, 64, 50), shape='ellipse', radius_RL=13.0, radius_AP=5.0, angle_RL=-10.0)
+    cache = StepCache(str(tmpdir))
+    metrics_ref, _ = process_seg.compute_shape(im_seg, param_centerline=ParamCenterline(), verbose=VERBOSE, jobs=1,
+                                               cache=cache)
+    # Count the slices that are computed
+    computed = []
+    properties_slices = process_seg._properties_slices
+
+    def _properties_slices(data, *args):
+        computed.append(data.shape[2])
+        return properties_slices(data, *args)
+    monkeypatch.setattr(process_seg, '_properties_slices', _properties_slices)
+    metrics, _ = process_seg.compute_shape(im_seg, param_centerline=ParamCenterline(), verbose=VERBOSE, jobs=1,
+                                           cache=cache)
+    assert sum(computed) == 0
+    for key in metrics_ref:
+        np.testing.assert_array_equal(metrics[key].data, metrics_ref[key].data)
+    # One entry per batch of slices
+    assert len(cache.entries()) == int(np.ceil(50. / process_seg.SLICES_PER_CHUNK))
+    # Without angle correction, only the batch of the edited slice (slices 16 to 31) is recomputed
+    process_seg.compute_shape(im_seg, angle_correction=False, verbose=VERBOSE, jobs=1, cache=cache)
+    del computed[:]
+    im_seg.data[:, :, 25] = 0
+    metrics, _ = process_seg.compute_shape(im_seg, angle_correction=False, verbose=VERBOSE, jobs=1, cache=cache)
+    assert computed == [process_seg.SLICES_PER_CHUNK - 1]
+    assert math.isnan(metrics['area'].data[25])
+    im_seg.data[:, 32:, 30] = 0
+    process_seg.compute_shape(im_seg, angle_correction=False, verbose=VERBOSE, jobs=1, cache=cache)
+    assert computed == [process_seg.SLICES_PER_CHUNK - 1] * 2
+
+
+def test_angles_from_derivatives():
+    # centerline going 1 voxel in x and 2 voxels in y per slice
+    angle_AP, angle_RL = process_seg._angles_from_derivatives([np.ones(3), 2 * np.ones(3)], 0.5, 1., 2.)
+    np.testing.assert_allclose(angle_AP, np.arctan2(0.5, 2.))
+    np.testing.assert_allclose(angle_RL, np.arctan2(2., 2.))
+
+
 # noinspection 801,PyShadowingNames
 def test_fix_orientation():
     dict_test_orientation = [
@@ -86,3 +86,49 @@ def test_nib_resample_image_4d(fake_4dimage_nib):
     assert img_r.get_data()[8, 8, 4, 0] == 1.0  # make sure there is no displacement in world coordinate system
     assert img_r.get_data()[8, 8, 4, 1] == 0.0
     assert img_r.header.get_zooms() == (0.5, 0.5, 1.0, 1.0)
+
+
+# noinspection 801,PyShadowingNames
+def test_nib_resample_image_3d_roi(fake_3dimage_nib_big):
+    """Test resampling restricted to a region"""
+    roi = np.zeros(fake_3dimage_nib_big.shape, dtype=np.uint8)
+    roi[12:17, 17:22, :] = 1
+    img_full = resampling.resample_nib(fake_3dimage_nib_big, new_size=[2, 2, 1], new_size_type='factor',
+                                       interpolation='nn')
+    img_r = resampling.resample_nib(fake_3dimage_nib_big, new_size=[2, 2, 1], new_size_type='factor',
+                                    interpolation='nn', roi=roi, roi_margin=[1, 1, np.inf])
+    # The region (with the support of the interpolation, i.e. 1 voxel, and a margin of 1mm, i.e. 2 voxels) is
+    # resampled, on all slices
+    assert img_r.get_data().shape == (15, 15, 19)
+    # The affine accounts for the crop
+    assert img_r.affine[:3, 3].tolist() == [10.5, 15.5, 0.0]
+    assert np.array_equal(img_r.get_data(), img_full.get_data()[21:36, 31:46, :])
+
+
+# noinspection 801,PyShadowingNames
+@pytest.mark.parametrize('interpolation', ['nn', 'linear'])
+def test_nib_resample_image_3d_roi_coarse(interpolation):
+    """Test resampling restricted to a region, with input voxels larger than the margin (eg: centerline upsampling)"""
+    data = np.zeros((10, 10, 10), dtype=np.float32)
+    data[5, 4, :] = np.linspace(1, 2, 10)
+    data[4, 6, 3:7] = 1
+    img = nib.nifti1.Nifti1Image(data, np.diag([2., 2., 2., 1.]))
+    img_full = resampling.resample_nib(img, new_size=[0.5, 0.5, 0.5], new_size_type='mm', interpolation=interpolation)
+    img_r = resampling.resample_nib(img, new_size=[0.5, 0.5, 0.5], new_size_type='mm', interpolation=interpolation,
+                                    roi=img, roi_margin=1., roi_crop=False)
+    assert np.count_nonzero(img_r.get_data()) == np.count_nonzero(img_full.get_data())
+    assert np.allclose(img_r.get_data(), img_full.get_data())
+
+
+# noinspection 801,PyShadowingNames
+def test_nib_resample_image_3d_roi_nocrop(fake_3dimage_nib_big):
+    """Test resampling restricted to a region, in the whole output grid"""
+    roi = np.zeros(fake_3dimage_nib_big.shape, dtype=np.uint8)
+    roi[12:17, 17:22, 8:11] = 1
+    img_full = resampling.resample_nib(fake_3dimage_nib_big, new_size=[2, 2, 1], new_size_type='factor',
+                                       interpolation='linear')
+    img_r = resampling.resample_nib(fake_3dimage_nib_big, new_size=[2, 2, 1], new_size_type='factor',
+                                    interpolation='linear', roi=roi, roi_crop=False)
+    assert img_r.get_data().shape == img_full.get_data().shape
+    assert np.allclose(img_r.affine, img_full.affine)
+    assert np.allclose(img_r.get_data(), img_full.get_data())
@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+# -*- coding: utf-8
+# pytest unit tests for spinalcordtoolbox.result_sink
+
+from __future__ import print_function, absolute_import
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from spinalcordtoolbox.result_sink import ResultSink, read_results
+
+
+def result(subject, status=0, **metrics):
+    return pd.DataFrame(index=[subject], data=dict(subject=subject, status=status, **metrics))
+
+
+@pytest.fixture(params=["sqlite", "arrow"])
+def format(request):
+    if request.param == "arrow":
+        pytest.importorskip("pyarrow")
+    return request.param
+
+
+def test_result_sink(tmpdir, format):
+    path = str(tmpdir)
+    # interrupted run: the results appended so far are kept
+    sink = ResultSink(path, run="run1", format=format)
+    sink.append(result("sub-01", dice=np.float64(0.9)))
+    sink.append(result("sub-02", status=1))
+    if format == "arrow":
+        sink._file.flush()  # no close: simulates a crash
+
+    # resumed run, with other columns
+    with ResultSink(path, run="run2", format=format) as sink:
+        sink.append(result("sub-02", dice=0.8, output="ok"))
+        sink.append(result("sub-03", dice=0.7, output="ok"))
+        assert sink.count == 2
+
+    df = read_results(path)
+    assert len(df) == 4
+    assert list(df.index) == ["sub-01", "sub-02", "sub-02", "sub-03"]
+
+    df = read_results(path, keys=["subject"])
+    assert list(df.index) == ["sub-01", "sub-02", "sub-03"]
+    assert list(df["_run"]) == ["run1", "run2", "run2"]
+    assert np.allclose(df["dice"].astype(float), [0.9, 0.8, 0.7])
+    assert list(df["status"].astype(int)) == [0, 0, 0]
+
+    assert list(read_results(path, runs=["run1"]).index) == ["sub-01", "sub-02"]
+    assert read_results(str(tmpdir.join("empty"))).empty
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+# -*- coding: utf-8
+# pytest unit tests for sct_pipeline
+
+from __future__ import print_function, absolute_import
+
+import sys, os
+
+import numpy as np
+import nibabel
+
+from spinalcordtoolbox.utils import __sct_dir__
+from spinalcordtoolbox.jobqueue import JobQueue
+from spinalcordtoolbox.result_sink import read_results
+sys.path.append(os.path.join(__sct_dir__, 'scripts'))
+import sct_pipeline
+
+
+DATA = np.arange(5 * 6 * 7, dtype=np.float32).reshape((5, 6, 7))
+
+
+def dataset(tmpdir):
+    """
+    :return: list of sct_maths arguments on a dataset of one subject, the last one failing
+    """
+    tmpdir.join("data", "sub-01", "mt").ensure(dir=True)
+    path_in = str(tmpdir.join("data", "sub-01", "mt", "mtr.nii.gz"))
+    nibabel.save(nibabel.Nifti1Image(DATA, np.eye(4)), path_in)
+    list_args = ["-i {} -add {} -o {}".format(path_in, i, str(tmpdir.join("out{}.nii.gz".format(i)))) for i in (1, 2)]
+    list_args.append("-i missing.nii.gz -add 1 -o out.nii.gz")
+    return list_args
+
+
+def test_run_function(tmpdir):
+    list_args = dataset(tmpdir)
+    path_results = str(tmpdir.join("results"))
+    ret = sct_pipeline.run_function("sct_maths", str(tmpdir.join("data")), ["sub-01"], list_args=list_args, nb_cpu=2,
+                                    path_results=path_results)
+    results = ret["results"]
+    assert list(results.index) == ["sub-01"] * 3
+    assert sorted(results["status"]) == [0, 0, 1]
+    assert results["status"].dtype.kind == "i"
+    np.testing.assert_allclose(nibabel.load(str(tmpdir.join("out2.nii.gz"))).get_data(), DATA + 2)
+    # the results are also written as they come
+    assert sorted(read_results(path_results)["status"]) == [0, 0, 1]
+
+
+def test_run_function_queue(tmpdir):
+    list_args = dataset(tmpdir)
+    path_queue, path_results = str(tmpdir.join("queue")), str(tmpdir.join("results"))
+
+    ret = sct_pipeline.run_function_queue("sct_maths", str(tmpdir.join("data")), ["sub-01"], path_queue,
+                                          list_args=list_args, nb_cpu=2, path_results=path_results)
+    assert sorted(ret["results"]["status"]) == [0, 0, 1]
+    np.testing.assert_allclose(nibabel.load(str(tmpdir.join("out2.nii.gz"))).get_data(), DATA + 2)
+    assert sorted(read_results(path_results)["status"]) == [0, 0, 1]
+    assert JobQueue(path_queue).status() == {"todo": 0, "running": 0, "done": 3, "failed": 0}
+
+    # resumed: the jobs are not run again
+    os.remove(str(tmpdir.join("out2.nii.gz")))
+    ret = sct_pipeline.run_function_queue("sct_maths", str(tmpdir.join("data")), ["sub-01"], path_queue,
+                                          list_args=list_args, nb_cpu=2)
+    assert sorted(ret["results"]["status"]) == [0, 0, 1]
+    assert not tmpdir.join("out2.nii.gz").exists()
+
+    # no job
+    ret = sct_pipeline.run_function_queue("sct_maths", str(tmpdir.join("data")), [], str(tmpdir.join("queue_empty")),
+                                          list_args=list_args, nb_cpu=2)
+    assert ret["results"].empty
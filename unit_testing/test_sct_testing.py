@@ -0,0 +1,45 @@
+#!/usr/bin/env python
+# -*- coding: utf-8
+# pytest unit tests for the performance measurements of sct_testing
+
+from __future__ import print_function, absolute_import
+
+import sys, os
+
+import pytest
+
+from spinalcordtoolbox.utils import __sct_dir__
+sys.path.append(os.path.join(__sct_dir__, 'scripts'))
+import sct_testing
+
+
+@pytest.mark.skipif(not hasattr(os, "wait4"), reason="peak memory is not measured on this platform")
+def test_run_measured():
+    cmd = '"{}" -c "import sys; a = bytearray(200 * 1024 * 1024); print(len(a)); sys.exit(3)"'.format(sys.executable)
+    status, output, peak_rss_mb = sct_testing.run_measured(cmd)
+    assert status == 3
+    assert output == str(200 * 1024 * 1024)
+    assert peak_rss_mb > 150
+
+
+def test_compare_perf():
+    baseline = {
+     "sct_propseg": sct_testing.perf_entry([("-i t2.nii.gz", 10., 600.), ("-i t1.nii.gz", 1., 400.)]),
+     "sct_removed": sct_testing.perf_entry([("-i t2.nii.gz", 10., 500.)]),
+    }
+    perf = {
+     "sct_propseg": sct_testing.perf_entry([("-i t2.nii.gz", 14., 520.), ("-i t1.nii.gz", 2., 650.)]),
+     "sct_new": sct_testing.perf_entry([("-i t2.nii.gz", 100., 5000.)]),
+    }
+    assert perf["sct_propseg"]["duration"] == 16. and perf["sct_propseg"]["peak_rss_mb"] == 650.
+
+    regressions = sct_testing.compare_perf(baseline, perf, tolerance=0.25, min_time=2.)
+    # t1 got 2x slower but is too short to be compared
+    assert regressions == [
+     ("sct_propseg", None, "duration", 11., 16.),
+     ("sct_propseg", "-i t1.nii.gz", "peak_rss_mb", 400., 650.),
+     ("sct_propseg", "-i t2.nii.gz", "duration", 10., 14.),
+    ]
+    assert sct_testing.compare_perf(baseline, perf, tolerance=0.5, min_time=2.) == [
+     ("sct_propseg", "-i t1.nii.gz", "peak_rss_mb", 400., 650.),
+    ]
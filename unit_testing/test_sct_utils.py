@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+# -*- coding: utf-8
+# pytest unit tests for sct_utils
+
+from __future__ import print_function, absolute_import
+
+import sys, os, glob
+
+import pytest
+
+import numpy as np
+import nibabel
+
+from spinalcordtoolbox.utils import __sct_dir__
+sys.path.append(os.path.join(__sct_dir__, 'scripts'))
+import sct_utils as sct
+import spinalcordtoolbox.image as msct_image
+
+
+@pytest.fixture()
+def fake_image_path():
+    path_tmp = sct.tmp_create(basename="test_sct_utils", verbose=0)
+    data = np.arange(5 * 6 * 7, dtype=np.float32).reshape((5, 6, 7))
+    path = os.path.join(path_tmp, "data.nii")
+    nibabel.save(nibabel.Nifti1Image(data, np.eye(4)), path)
+    return path
+
+
+def test_run_inprocess(fake_image_path):
+    path_tmp = os.path.dirname(fake_image_path)
+    cwd, argv = os.getcwd(), list(sys.argv)
+
+    status, output = sct.run(['sct_maths', '-i', 'data.nii', '-add', '1', '-o', 'data_add.nii'], cwd=path_tmp,
+                             verbose=0)
+    assert status == 0
+    assert (os.getcwd(), sys.argv) == (cwd, argv)
+    data_in = msct_image.Image(fake_image_path).data
+    data_out = msct_image.Image(os.path.join(path_tmp, 'data_add.nii')).data
+    np.testing.assert_allclose(data_out, data_in + 1)
+
+    # A failing script raises RunError, and the process state is restored
+    with pytest.raises(sct.RunError):
+        sct.run(['sct_maths', '-i', 'nonexistent.nii', '-add', '1', '-o', 'out.nii'], cwd=path_tmp, verbose=0)
+    assert (os.getcwd(), sys.argv) == (cwd, argv)
+    status, output = sct.run(['sct_maths', '-i', 'nonexistent.nii', '-add', '1', '-o', 'out.nii'], cwd=path_tmp,
+                             verbose=0, raise_exception=False)
+    assert status != 0
+
+
+def test_is_inprocess_script():
+    main = "def main(args=None):\n    pass\n\n"
+    assert sct._is_inprocess_script(main + 'if __name__ == "__main__":\n    sct.init_sct()\n    main()\n')
+    # globals defined when run as a script would be missing in-process
+    assert not sct._is_inprocess_script(main + 'if __name__ == "__main__":\n    param = Param()\n    main()\n')
+    assert not sct._is_inprocess_script(main)
+    assert not sct._is_inprocess_script('def main():\n    pass\n\nif __name__ == "__main__":\n    main()\n')
+
+
+@pytest.mark.parametrize('script', sorted(
+    os.path.splitext(os.path.basename(path))[0] for path in glob.glob(os.path.join(__sct_dir__, 'scripts', '*.py'))
+    if sct._get_entry_point([os.path.splitext(os.path.basename(path))[0]]) is not None))
+def test_run_inprocess_scripts(script):
+    """Each script run in-process gets to the parsing of its arguments"""
+    status, output = sct.run_inprocess(sct._get_entry_point([script]), ['-h'])
+    assert 'Traceback' not in output, output
+
+
+def test_run_inprocess_stream(fake_image_path, capsys):
+    """With verbose=2, the output of a script run in-process is printed as it is produced"""
+    status, output = sct.run(['sct_image', '-i', 'data.nii', '-getorient'], cwd=os.path.dirname(fake_image_path),
+                             verbose=2)
+    orientation = msct_image.Image(fake_image_path).orientation
+    assert status == 0
+    assert orientation in output.splitlines()
+    assert orientation in capsys.readouterr().out.splitlines()
+
+
+def test_run_entry_point():
+    assert sct._get_entry_point(['sct_maths', '-h']) is not None
+    assert sct._get_entry_point(['sct_resample', '-h']) is not None
+    # External binaries and shell commands are run as subprocesses
+    assert sct._get_entry_point(['isct_antsRegistration']) is None
+    assert sct._get_entry_point('sct_maths -h') is None
+    assert sct.run(['echo', 'hello'], verbose=0) == (0, 'hello')
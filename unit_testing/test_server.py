@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+# -*- coding: utf-8
+# pytest unit tests for spinalcordtoolbox.server
+
+from __future__ import print_function, absolute_import
+
+import sys, os, json, time, socket, subprocess
+
+import pytest
+
+import numpy as np
+import nibabel
+
+from spinalcordtoolbox.utils import __sct_dir__
+sys.path.append(os.path.join(__sct_dir__, 'scripts'))
+import sct_utils as sct
+from spinalcordtoolbox import server
+
+
+@pytest.fixture()
+def running_server():
+    path_tmp = sct.tmp_create(basename="test_server", verbose=0)
+    path_socket = os.path.join(path_tmp, "server", "socket")
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join([__sct_dir__] + env.get("PYTHONPATH", "").split(os.pathsep))
+    process = subprocess.Popen([sys.executable, os.path.join(__sct_dir__, "scripts", "sct_server.py"),
+                                "-socket", path_socket, "-preload"], env=env)
+    for i in range(300):
+        if server.is_running(path_socket):
+            break
+        time.sleep(0.1)
+    yield path_tmp, path_socket
+    server.stop(path_socket)
+    process.wait()
+
+
+def test_forward(running_server, capsys):
+    path_tmp, path_socket = running_server
+    data = np.arange(4 * 5 * 6, dtype=np.float32).reshape((4, 5, 6))
+    nibabel.save(nibabel.Nifti1Image(data, np.eye(4)), os.path.join(path_tmp, "data.nii"))
+
+    cwd = os.getcwd()
+    try:
+        os.chdir(path_tmp)
+        status = server.forward("sct_maths", ["-i", "data.nii", "-mul", "2", "-o", "data_mul.nii"],
+                                path_socket=path_socket)
+    finally:
+        os.chdir(cwd)
+    assert status == 0
+    assert "sct_maths" not in capsys.readouterr().err
+    data_out = nibabel.load(os.path.join(path_tmp, "data_mul.nii")).get_data()
+    np.testing.assert_allclose(data_out, data * 2)
+
+    # The daemon reports errors, and refuses commands it can't run in-process
+    assert server.forward("sct_maths", ["-i", "nonexistent.nii", "-o", "out.nii"], path_socket=path_socket) != 0
+    assert server.forward("isct_antsRegistration", [], path_socket=path_socket) is None
+
+    assert server.stop(path_socket)
+    assert not server.is_running(path_socket)
+    assert server.forward("sct_maths", ["-h"], path_socket=path_socket) is None
+
+
+def test_invalid_requests(running_server):
+    path_tmp, path_socket = running_server
+    assert os.stat(path_socket).st_mode & 0o777 == 0o600
+    for request in [b"not json", b"[]", b'{"command": "sct_maths"}',
+                    b'{"command": "sct_maths", "args": ["-h"], "env": {}, "cwd": "/nonexistent"}']:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(path_socket)
+        try:
+            fileobj = sock.makefile("rwb")
+            fileobj.write(request + b"\n")
+            fileobj.flush()
+            reply = json.loads(fileobj.readline().decode("utf-8"))
+        finally:
+            sock.close()
+        assert reply["accepted"] is False and "error" in reply
+    # The daemon still runs commands
+    assert server.forward("sct_maths", ["-h"], path_socket=path_socket) is not None
@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+# -*- coding: utf-8
+# pytest unit tests for spinalcordtoolbox.trace
+
+from __future__ import print_function, absolute_import
+
+import sys, os, io, json
+
+import numpy as np
+import nibabel
+
+from spinalcordtoolbox.utils import __sct_dir__
+sys.path.append(os.path.join(__sct_dir__, 'scripts'))
+import sct_utils as sct
+from spinalcordtoolbox import trace
+from spinalcordtoolbox.resampling import resample_nib
+
+
+child_code = """
+import sys
+from spinalcordtoolbox import trace
+trace.start(name="child")
+with trace.span("child_span"):
+    pass
+trace.finish()
+"""
+
+
+def test_trace(tmpdir, monkeypatch):
+    path_trace = str(tmpdir.join("trace.json"))
+    monkeypatch.setenv("SCT_TRACE", path_trace)
+    monkeypatch.delenv("SCT_TRACE_DIR", raising=False)
+
+    with trace.span("disabled"):
+        pass
+    trace.start(name="root")
+    assert trace.is_enabled()
+    with trace.span("outer", cat="test", value=1):
+        nii = nibabel.nifti1.Nifti1Image(np.ones((10, 10, 10), dtype=np.float32), np.eye(4))
+        resample_nib(nii, new_size=[2, 2, 2], new_size_type='factor')
+        # nested command, in a subprocess
+        env = dict(os.environ)
+        env["PYTHONPATH"] = os.pathsep.join([__sct_dir__] + env.get("PYTHONPATH", "").split(os.pathsep))
+        sct.run([sys.executable, "-c", child_code], env=env, verbose=0)
+    trace.finish()
+    assert not trace.is_enabled()
+    assert "SCT_TRACE_DIR" not in os.environ
+
+    with io.open(path_trace, "r") as f:
+        events = json.load(f)["traceEvents"]
+    spans = dict((e["name"], e) for e in events if e["ph"] == "X")
+    assert "disabled" not in spans
+    assert set(["outer", "resampling.resample_nib", "root", "child", "child_span"]) <= set(spans)
+    assert spans["outer"]["args"]["value"] == 1
+    assert "cpu_s" in spans["outer"]["args"]
+    assert spans["child"]["pid"] != spans["root"]["pid"]
+    # spans are nested in time
+    outer, inner = spans["outer"], spans["resampling.resample_nib"]
+    assert outer["ts"] <= inner["ts"] and inner["ts"] + inner["dur"] <= outer["ts"] + outer["dur"]
+    names = [e["args"]["name"] for e in events if e["ph"] == "M"]
+    assert sorted(names) == ["child", "root"]